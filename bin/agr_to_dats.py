@@ -4,17 +4,45 @@
 # At minimum it will include genes, gene names, human orthologs, and associated diseases
 
 import argparse
-from ccmm.dats.datsobj import DatsObj, DatsObjCache
+from ccmm.dats.datsobj import DatsObj, DatsObjCache, DatsObjCacheShard
+import ccmm.dats.datsobj as datsobj
 from collections import OrderedDict
 from ccmm.dats.datsobj import DATSEncoder
+from ccmm.dats.fragments import DatsFragmentStore
 import ccmm.agr.ref_genome_dataset
 import ccmm.agr.genes
 import json
 import logging
+import multiprocessing
 import os
 import re
 import sys
 
+# ------------------------------------------------------
+# Process a single MOD
+# ------------------------------------------------------
+
+# per-process state set by init_mod_worker
+WORKER_STATE = None
+
+def init_mod_worker(args, orthologs_by_gene, global_ids, fragment_store):
+    global WORKER_STATE
+    WORKER_STATE = { "args": args, "orthologs_by_gene": orthologs_by_gene, "global_ids": global_ids, "fragment_store": fragment_store }
+
+# Build the gene entities for a single MOD in a worker process, using a shard of the cache, and
+# write them to the fragment store, since returning the DatsObjs to the parent process would cost
+# more than building them. Returns the result of DatsFragmentStore.spill_shard, or None if a fatal
+# error was logged, since exiting from a worker would stall the pool.
+def process_mod_worker(mod):
+    (mod_num, acc) = mod
+    ws = WORKER_STATE
+    shard = DatsObjCacheShard(ws['global_ids'])
+    try:
+        gene_entity = ccmm.agr.genes.get_gene_json(shard, acc, ws['args'].gff3_json_path, ws['orthologs_by_gene'])
+    except SystemExit:
+        return None
+    return ws['fragment_store'].spill_shard("mod" + str(mod_num), gene_entity, shard)
+
 # ------------------------------------------------------
 # main()
 # ------------------------------------------------------
@@ -27,6 +55,8 @@ def main():
     parser.add_argument('--output_file', required=True, help ='Output file path for the DATS JSON file containing the top-level DATS Dataset.')
     parser.add_argument('--gff3_json_path', required=True, help ='Path to directory that contains GFF3 files, Basic Gene Information (BGI), disease and phenotype json files.')
     parser.add_argument('--ortholog_file', required=True, help ='Path to filtered ortholog file from AGR (.tsv)')
+    parser.add_argument('--ortholog_cache', required=False, help ='Path to a binary copy of --ortholog_file, which will be read instead of --ortholog_file if it was built from the same file (path, size and modification time), and written otherwise.')
+    parser.add_argument('--num_procs', required=False, type=int, default=1, help ='Number of worker processes to use. Each MOD is processed by a single process.')
     args = parser.parse_args()
 
     # logging
@@ -60,17 +90,47 @@ def main():
     REF_GENOME_VARS = OrderedDict([("value", "Property or Attribute"), ("valueIRI", "http://purl.obolibrary.org/obo/NCIT_C20189")])
 
     # read human homologs from alliance orthology file
-    all_orthologs = ccmm.agr.genes.read_orthology(args.ortholog_file)
+    all_orthologs = ccmm.agr.genes.read_orthology(args.ortholog_file, args.ortholog_cache)
+    # index orthologs by MOD gene once for all MODs
+    orthologs_by_gene = ccmm.agr.genes.index_orthologs(all_orthologs)
     
-    for acc in acc_d:
-        gene_entity = ccmm.agr.genes.get_gene_json(cache, acc, args.gff3_json_path, all_orthologs)
-        ref_genome = ref_genomes_by_id[acc]
-        ref_genome.set("isAbout", gene_entity)
+    accs = list(acc_d.keys())
+    n_accs = len(accs)
+
+    fragment_store = None
+    if args.num_procs > 1 and n_accs > 1 and not datsobj.DEBUG_NO_ID_REFS:
+        n_procs = min(args.num_procs, n_accs)
+        logging.info("processing " + str(n_accs) + " MOD(s) using " + str(n_procs) + " processes")
+        fragment_store = DatsFragmentStore(None)
+        initargs = (args, orthologs_by_gene, cache.get_ids(), fragment_store)
+        with multiprocessing.Pool(n_procs, initializer=init_mod_worker, initargs=initargs) as pool:
+            # results are returned in MOD order
+            for (acc, r) in zip(accs, pool.imap(process_mod_worker, list(enumerate(accs)), chunksize=1)):
+                if r is None:
+                    fragment_store.cleanup()
+                    logging.fatal("failed to process MOD " + acc)
+                    sys.exit(1)
+                (placeholder, shard_objs) = r
+                # objects (e.g., taxonomy) created by more than one worker are reduced to references to those of the first MOD
+                fragment_store.merge_shard(cache, shard_objs)
+                ref_genome = ref_genomes_by_id[acc]
+                ref_genome.set("isAbout", placeholder)
+    else:
+        for acc in accs:
+            gene_entity = ccmm.agr.genes.get_gene_json(cache, acc, args.gff3_json_path, orthologs_by_gene)
+            ref_genome = ref_genomes_by_id[acc]
+            ref_genome.set("isAbout", gene_entity)
     
 
     # write Dataset to DATS JSON file
     with open(args.output_file, mode="w") as jf:
-        jf.write(json.dumps(agr_dataset, indent=2, cls=DATSEncoder))
+        if fragment_store is None:
+            jf.write(json.dumps(agr_dataset, indent=2, cls=DATSEncoder))
+        else:
+            fragment_store.write_json(agr_dataset, jf)
+
+    if fragment_store is not None:
+        fragment_store.cleanup()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# Print subject/sample histograms, tissue counts and variable distributions for the GTEx v7 Portal
+# subject phenotype and sample attribute files, without building any DATS objects.
+
+import argparse
+import ccmm.gtex.stats
+import logging
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+V7_SUBJECT_PHENOTYPES_FILE = 'GTEx_v7_Annotations_SubjectPhenotypesDS.txt'
+V7_SAMPLE_ATTRIBUTES_FILE = 'GTEx_v7_Annotations_SampleAttributesDS.txt'
+
+# ------------------------------------------------------
+# main()
+# ------------------------------------------------------
+
+def main():
+
+    # input
+    parser = argparse.ArgumentParser(description='Compute summary statistics for GTEx public subject and sample metadata.')
+    parser.add_argument('--subject_phenotypes_path', default=V7_SUBJECT_PHENOTYPES_FILE, required=False, help ='Path to ' + V7_SUBJECT_PHENOTYPES_FILE)
+    parser.add_argument('--sample_attributes_path', default=V7_SAMPLE_ATTRIBUTES_FILE, required=False, help ='Path to ' + V7_SAMPLE_ATTRIBUTES_FILE)
+    parser.add_argument('--smafrze', required=False, help ='Only include samples with this analysis freeze (SMAFRZE) value e.g., RNASEQ, and their subjects.')
+    parser.add_argument('--subject_vars', required=False, default=",".join(ccmm.gtex.stats.DEFAULT_SUBJECT_VARS), help ='Comma-delimited list of subject phenotype variables whose distributions should be reported.')
+    parser.add_argument('--sample_vars', required=False, default=",".join(ccmm.gtex.stats.DEFAULT_SAMPLE_VARS), help ='Comma-delimited list of sample attribute variables whose distributions should be reported.')
+    parser.add_argument('--format', required=False, default='tsv', choices=ccmm.gtex.stats.OUTPUT_FORMATS, help ='Output format.')
+    parser.add_argument('--output_file', required=False, help ='Output file path. Defaults to standard output.')
+    args = parser.parse_args()
+
+    # logging
+    logging.basicConfig(level=logging.INFO)
+
+    subject_vars = [v.strip() for v in args.subject_vars.split(",") if v.strip() != ""]
+    sample_vars = [v.strip() for v in args.sample_vars.split(",") if v.strip() != ""]
+    stats = ccmm.gtex.stats.get_stats(args.subject_phenotypes_path, args.sample_attributes_path, args.smafrze, subject_vars, sample_vars)
+
+    if args.output_file is None:
+        ccmm.gtex.stats.write_stats(stats, sys.stdout, args.format)
+    else:
+        with open(args.output_file, mode="w") as fh:
+            ccmm.gtex.stats.write_stats(stats, fh, args.format)
+
+if __name__ == '__main__':
+    main()
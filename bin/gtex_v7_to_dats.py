@@ -4,16 +4,23 @@
 
 import argparse
 from ccmm.dats.datsobj import DatsObj, DatsObjCache
+import ccmm.dats.datsobj
 from collections import OrderedDict
 from ccmm.dats.datsobj import DATSEncoder
+import ccmm.gtex.characteristics
 import ccmm.gtex.dna_extracts
 import ccmm.gtex.wgs_datasets
 import ccmm.gtex.public_metadata
 import ccmm.gtex.restricted_metadata
+import ccmm.gtex.rna_extracts
 import ccmm.gtex.samples
+import ccmm.gtex.shards
+import ccmm.subset
+import ccmm.dbgap.restricted_metadata
 import ccmm.gtex.subjects
 import ccmm.gtex.parsers.portal_files as portal_files
 import ccmm.gtex.parsers.github_files as github_files
+from ccmm.pipeline import Pipeline, Stage
 import json
 import logging
 import os
@@ -93,6 +100,49 @@ def cross_check_ids(subjects, samples, manifest, filename, manifest_descr, sourc
     subj_compare_str += '{:>10s} subject_ids  NOT in {:>20s}: {:-6} / {:-6}'.format(manifest_descr, source_descr, n_subj_not_found, n_id_dump_subjects)
     logging.info(subj_compare_str)
 
+# ------------------------------------------------------
+# Subset selection
+# ------------------------------------------------------
+
+# Restrict the parsed input files to the subjects and samples selected by subset.
+def subset_inputs(subset, inputs):
+    p_subjects = inputs['p_subjects']
+    p_samples = inputs['p_samples']
+
+    # subject id and random fraction filters
+    subjects = {}
+    for s in subset.select_fraction(p_subjects.keys()):
+        if subset.subject_id_selected([s]):
+            subjects[s] = True
+
+    # sample id, tissue and analysis freeze filters
+    samples = {}
+    for s in p_samples:
+        p_sample = p_samples[s]
+        if p_sample['SUBJID']['mapped_value'] not in subjects:
+            continue
+        if not subset.sample_id_selected([s]):
+            continue
+        if not subset.tissue_selected([p_sample['SMTS']['mapped_value'], p_sample['SMTSD']['mapped_value']]):
+            continue
+        if not subset.analysis_freeze_selected(p_sample['SMAFRZE']['mapped_value']):
+            continue
+        samples[s] = True
+
+    # only keep subjects with at least one selected sample if samples were filtered directly
+    if subset.has_sample_filter():
+        subjects = dict([(p_samples[s]['SUBJID']['mapped_value'], True) for s in samples])
+
+    if len(subjects) == 0:
+        logging.fatal("subset does not include any GTEx subjects")
+        sys.exit(1)
+    logging.info("subset includes " + str(len(subjects)) + "/" + str(len(p_subjects)) + " subject(s) and " + str(len(samples)) + "/" + str(len(p_samples)) + " sample(s)")
+
+    inputs['p_subjects'] = ccmm.subset.filter_dict(p_subjects, subjects)
+    inputs['gh_subjects'] = ccmm.subset.filter_dict(inputs['gh_subjects'], subjects)
+    for k in ('p_samples', 'gh_samples', 'protected_rnaseq_files', 'protected_wgs_files', 'rnaseq_dois', 'wgs_dois'):
+        inputs[k] = ccmm.subset.filter_dict(inputs[k], samples)
+
 # ------------------------------------------------------
 # Handle restricted-access metadata
 # ------------------------------------------------------
@@ -171,7 +221,7 @@ def make_consent_group(args, group_name, group_index, subject_l, dats_subject_d)
     return group
 
 # augment public metadata with restricted-access (meta)data
-def add_restricted_data(cache, args, study_md, subjects_l, samples_d, study, study_id):
+def add_restricted_data(cache, args, study_md, subjects_l, samples_d, study, study_id, subset=None):
     restricted_mp = args.dbgap_protected_metadata_path
     if restricted_mp is None:
         return
@@ -187,6 +237,11 @@ def add_restricted_data(cache, args, study_md, subjects_l, samples_d, study, stu
 
     study_restricted_md = ccmm.gtex.restricted_metadata.read_study_metadata(restricted_mp)
 
+    # restrict to subjects and samples in the public metadata subset
+    if subset is not None:
+        for sid in study_restricted_md:
+            ccmm.dbgap.restricted_metadata.subset_study_metadata(study_restricted_md[sid], 'SUBJID', subjects_d, 'SAMPID', samples_d)
+
     d = study_restricted_md
     # get subject info
     subj = d['phs000424.v7']['Subject']
@@ -214,7 +269,8 @@ def add_restricted_data(cache, args, study_md, subjects_l, samples_d, study, stu
         slist = cid_to_subjects[cid]
         n_subjects = len(slist)
         cvc = code_to_c_var[cid]
-        if n_subjects != int(cvc['count']):
+        # counts in the var_report are for the whole study
+        if subset is None and n_subjects != int(cvc['count']):
             logging.fatal("subject count mismatch in consent group " + cid)
             sys.exit(1)
         logging.info("found " + str(n_subjects) + " subject(s) in consent group " + cid + " - " + cvc['name'])
@@ -230,29 +286,11 @@ def add_restricted_data(cache, args, study_md, subjects_l, samples_d, study, stu
     # e.g.,  ccmm.gtex.dna_extracts.update_dna_extracts_from_restricted_metadata(cache, study, study_md, study_restricted_md[study_id], samples_d)
 
 # ------------------------------------------------------
-# main()
+# Pipeline stages
 # ------------------------------------------------------
 
-def main():
-
-    # input
-    parser = argparse.ArgumentParser(description='Create DATS JSON for dbGaP GTEx public metadata.')
-    parser.add_argument('--output_file', required=True, help ='Output file path for the DATS JSON file containing the top-level DATS Dataset.')
-    parser.add_argument('--dbgap_public_xml_path', required=True, help ='Path to directory that contains public dbGaP metadata files e.g., *.data_dict.xml and *.var_report.xml')
-    parser.add_argument('--dbgap_protected_metadata_path', required=False, help ='Path to directory that contains access-controlled dbGaP tab-delimited metadata files.')
-    parser.add_argument('--max_output_samples', required=False, type=int, help ='Impose a limit on the number of sample Materials in the output DATS. For testing purposes only.')
-    parser.add_argument('--subject_phenotypes_path', default=V7_SUBJECT_PHENOTYPES_FILE, required=False, help ='Path to ' + V7_SUBJECT_PHENOTYPES_FILE)
-    parser.add_argument('--sample_attributes_path', default=V7_SAMPLE_ATTRIBUTES_FILE, required=False, help ='Path to ' + V7_SAMPLE_ATTRIBUTES_FILE)
-    parser.add_argument('--data_stewards_repo_path', default='data-stewards', required=False, help ='Path to local copy of https://github.com/dcppc/data-stewards')
-    parser.add_argument('--no_circular_links', action='store_true', help ='Whether to disallow circular links/paths within the JSON-LD output.')
-    parser.add_argument('--use_all_dbgap_subject_vars', action='store_true', help ='Whether to store all available dbGaP variable values as characteristics of the DATS subject Materials.')
-#    parser.add_argument('--use_all_dbgap_sample_vars', action='store_true', help ='Whether to store all available dbGaP variable values as characteristics of the DATS sample Materials.')
-    args = parser.parse_args()
-
-    # logging
-    logging.basicConfig(level=logging.INFO)
-#    logging.basicConfig(level=logging.DEBUG)
-
+# read GTEx Portal files and GitHub data-stewards id dumps, manifests and DOIs
+def read_inputs(args, ctx):
     # read portal metadata for subjects and samples
     p_subjects = portal_files.read_subject_phenotypes_file(args.subject_phenotypes_path)
     p_samples = portal_files.read_sample_attributes_file(args.sample_attributes_path)
@@ -280,17 +318,40 @@ def main():
     wgs_dois_file = args.data_stewards_repo_path + "/gtex/v7/manifests/protected_data/" + WGS_DOIS_FILE
     wgs_dois = github_files.read_dois_manifest(wgs_dois_file)
 
+    inputs = {
+        "p_subjects": p_subjects,
+        "p_samples": p_samples,
+        "gh_subjects": gh_subjects,
+        "gh_samples": gh_samples,
+        "gh_tissues": gh_tissues,
+        "protected_rnaseq_manifest": protected_rnaseq_manifest,
+        "protected_rnaseq_files": protected_rnaseq_files,
+        "protected_wgs_manifest": protected_wgs_manifest,
+        "protected_wgs_files": protected_wgs_files,
+        "rnaseq_dois": rnaseq_dois,
+        "wgs_dois": wgs_dois
+        }
+
+    # subject/sample subset
+    subset = ccmm.subset.get_subset_from_args(args)
+    if subset is not None:
+        subset_inputs(subset, inputs)
+    inputs['subset'] = subset
+
+    return inputs
+
+def cross_check_inputs(args, ctx):
     # compare GitHub manifest files with GitHub id dumps
-    cross_check_ids(gh_subjects, gh_samples, protected_rnaseq_files, protected_rnaseq_manifest, "RNA-Seq", "GitHub id dumps")
-    cross_check_ids(gh_subjects, gh_samples, protected_wgs_files, protected_wgs_manifest, "WGS","GitHub id dumps")
+    cross_check_ids(ctx['gh_subjects'], ctx['gh_samples'], ctx['protected_rnaseq_files'], ctx['protected_rnaseq_manifest'], "RNA-Seq", "GitHub id dumps")
+    cross_check_ids(ctx['gh_subjects'], ctx['gh_samples'], ctx['protected_wgs_files'], ctx['protected_wgs_manifest'], "WGS","GitHub id dumps")
 
     # compare GitHub manifest files with GTEx Portal metdata files
-    cross_check_ids(p_subjects, p_samples, protected_rnaseq_files, protected_rnaseq_manifest, "RNA-Seq", "GTEx Portal metadata")
-    cross_check_ids(p_subjects, p_samples, protected_wgs_files, protected_wgs_manifest, "WGS","GTEx Portal metadata")
-
-    # create top-level dataset
-    gtex_dataset = ccmm.gtex.wgs_datasets.get_dataset_json()
+    cross_check_ids(ctx['p_subjects'], ctx['p_samples'], ctx['protected_rnaseq_files'], ctx['protected_rnaseq_manifest'], "RNA-Seq", "GTEx Portal metadata")
+    cross_check_ids(ctx['p_subjects'], ctx['p_samples'], ctx['protected_wgs_files'], ctx['protected_wgs_manifest'], "WGS","GTEx Portal metadata")
 
+# Read public dbGaP metadata and find the corresponding dbGaP study Dataset in gtex_dataset.
+# Returns (study_id, dbGaP study Dataset, dbGaP study metadata)
+def read_dbgap_study_metadata(args, gtex_dataset):
     # index dbGaP study Datasets by id
     dbgap_study_datasets_by_id = {}
     for tds in gtex_dataset.get("hasPart"):
@@ -306,7 +367,6 @@ def main():
 
     # read public dbGaP metadata
     pub_xp = args.dbgap_public_xml_path
-    restricted_mp = args.dbgap_protected_metadata_path
     # read public metadata
     dbgap_study_pub_md = ccmm.gtex.public_metadata.read_study_metadata(pub_xp)
     # there should be only one study
@@ -316,9 +376,18 @@ def main():
     if n_study_ids != 1:
         logging.fatal("read " + str(n_study_ids) + " dbGaP studies from " + pub_xp)
         sys.exit(1)
+    if study_id not in dbgap_study_datasets_by_id:
+        logging.fatal("no Dataset found for dbGaP study " + study_id)
+        sys.exit(1)
 
-    dbgap_study_dataset = dbgap_study_datasets_by_id[study_id]
-    dbgap_study_md = dbgap_study_pub_md[study_id]
+    return (study_id, dbgap_study_datasets_by_id[study_id], dbgap_study_pub_md[study_id])
+
+# create top-level Dataset and read public dbGaP metadata
+def read_study_metadata(args, ctx):
+    # create top-level dataset
+    gtex_dataset = ccmm.gtex.wgs_datasets.get_dataset_json()
+
+    (study_id, dbgap_study_dataset, dbgap_study_md) = read_dbgap_study_metadata(args, gtex_dataset)
     sv = ccmm.gtex.public_metadata.add_study_vars(dbgap_study_dataset, dbgap_study_md)
     dbgap_study_md['id_to_var'] = sv['id_to_var']
     dbgap_study_md['type_name_cg_to_var'] = sv['type_name_cg_to_var']
@@ -329,12 +398,21 @@ def main():
     # cache used to minimize duplication of JSON objects in JSON-LD output
     cache = DatsObjCache()
 
-    # --------------------------
-    # subjects
-    # --------------------------
+    return {
+        "gtex_dataset": gtex_dataset,
+        "study_id": study_id,
+        "dbgap_study_dataset": dbgap_study_dataset,
+        "dbgap_study_md": dbgap_study_md,
+        "cache": cache
+        }
+
+# create subject Materials, the "all subjects" StudyGroup and the Study
+def build_subjects(args, ctx):
+    cache = ctx['cache']
+    dbgap_study_md = ctx['dbgap_study_md']
 
     # create subjects based on GTEx Portal subject phenotype file and GitHub data-stewards id dump
-    dats_subjects_d = ccmm.gtex.subjects.get_subjects_dats_materials(cache, p_subjects, gh_subjects, dbgap_study_md['type_name_cg_to_var']['Subject_Phenotypes'])
+    dats_subjects_d = ccmm.gtex.subjects.get_subjects_dats_materials(cache, ctx['p_subjects'], ctx['gh_subjects'], dbgap_study_md['type_name_cg_to_var']['Subject_Phenotypes'])
     # sorted list of subjects
     dats_subjects_l = sorted([dats_subjects_d[s] for s in dats_subjects_d], key=lambda s: s.get("name"))
 
@@ -363,47 +441,235 @@ def main():
             ])
 
     # link Study to Dataset
-    dbgap_study_dataset.set("producedBy", dats_study)
+    ctx['dbgap_study_dataset'].set("producedBy", dats_study)
 
-    # --------------------------
-    # sample Materials
-    # --------------------------
+    return {
+        "dats_subjects_d": dats_subjects_d,
+        "dats_subjects_l": dats_subjects_l,
+        "dats_study": dats_study
+        }
+
+# create sample Materials
+def build_samples(args, ctx):
+    dbgap_study_md = ctx['dbgap_study_md']
 
     # create samples based on GTEx Portal sample attributes file and GitHub data-stewards id dump
-    dats_samples_d = ccmm.gtex.samples.get_samples_dats_materials(cache, dats_subjects_d, p_samples, gh_samples, dbgap_study_md['type_name_cg_to_var']['Sample_Attributes'])
+    dats_samples_d = ccmm.gtex.samples.get_samples_dats_materials(ctx['cache'], ctx['dats_subjects_d'], ctx['p_samples'], ctx['gh_samples'], dbgap_study_md['type_name_cg_to_var']['Sample_Attributes'], args.num_procs, args.sample_characteristics)
     # sorted list of samples
     dats_samples_l = sorted([dats_samples_d[s] for s in dats_samples_d], key=lambda s: s.get("name"))
     if args.max_output_samples is not None:
         dats_samples_l = dats_samples_l[0:int(args.max_output_samples)]
         logging.warn("limiting output to " + str(len(dats_samples_l)) + " sample(s) due to value of --max_output_samples")
-    dbgap_study_dataset.set("isAbout", dats_samples_l)
+    ctx['dbgap_study_dataset'].set("isAbout", dats_samples_l)
 
-    # --------------------------
-    # file Datasets
-    # --------------------------
+    return { "dats_samples_d": dats_samples_d }
 
-    file_datasets_l = []
+# create file Datasets
+def build_file_datasets(args, ctx):
+    cache = ctx['cache']
+    dats_samples_d = ctx['dats_samples_d']
+    p_samples = ctx['p_samples']
+    gh_samples = ctx['gh_samples']
 
-    # WGS CRAM
-    wgs_dats_file_datasets_l = ccmm.gtex.samples.get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, protected_wgs_files, wgs_dois, args.no_circular_links)
-    logging.info("adding Datasets for " + str(len(wgs_dats_file_datasets_l)) + " WGS CRAM files")
-    file_datasets_l.extend(wgs_dats_file_datasets_l)
+    # WGS and RNA-Seq CRAM
+    manifests = [
+        ("WGS", ctx['protected_wgs_files'], ctx['wgs_dois']),
+        ("RNA-Seq", ctx['protected_rnaseq_files'], ctx['rnaseq_dois'])
+        ]
+    file_datasets_l = ccmm.gtex.samples.get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, manifests, args.no_circular_links)
 
-    # RNA-Seq CRAM
-    rnaseq_dats_file_datasets_l = ccmm.gtex.samples.get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, protected_rnaseq_files, rnaseq_dois, args.no_circular_links)
-    logging.info("adding Datasets for " + str(len(rnaseq_dats_file_datasets_l)) + " RNA-Seq CRAM files")
-    file_datasets_l.extend(rnaseq_dats_file_datasets_l)
+    ctx['dbgap_study_dataset'].set("hasPart", file_datasets_l)
 
-    dbgap_study_dataset.set("hasPart", file_datasets_l)
+    return { "file_datasets_l": file_datasets_l }
 
-    # augment public (meta)data with restricted-access (meta)data
-    if restricted_mp is not None:
+# augment public (meta)data with restricted-access (meta)data
+def add_restricted_metadata(args, ctx):
+    if args.dbgap_protected_metadata_path is not None:
         # create study groups and update subjects/samples with restricted phenotype data
-        add_restricted_data(cache, args, dbgap_study_md, dats_subjects_l, dats_samples_d, dats_study, study_id)
+        add_restricted_data(ctx['cache'], args, ctx['dbgap_study_md'], ctx['dats_subjects_l'], ctx['dats_samples_d'], ctx['dats_study'], ctx['study_id'], ctx['subset'])
+
+# Returns the GTEx sample id (SAMPID) of a DNA or RNA extract Material read from a public instance,
+# i.e., the name of the biological sample Material from which it derives.
+def get_extract_sample_id(extract):
+    bio_sample = extract.get("derivesFrom")[0]
+    if not isinstance(bio_sample, DatsObj) or not bio_sample.hasProperty("name"):
+        logging.fatal("no biological sample Material found for " + extract.get("name"))
+        sys.exit(1)
+    return bio_sample.get("name")
+
+# Read a public instance written by a previous run and recover the context needed by the
+# add_restricted_metadata and write_output stages.
+def load_public_instance(args, ctx):
+    logging.info("reading public instance from " + args.public_instance)
+    gtex_dataset = ccmm.dats.datsobj.read_dats_json(args.public_instance)
+    if not isinstance(gtex_dataset, DatsObj) or gtex_dataset.get("@type") != "Dataset":
+        logging.fatal(args.public_instance + " does not contain a DATS Dataset")
+        sys.exit(1)
+
+    (study_id, dbgap_study_dataset, dbgap_study_md) = read_dbgap_study_metadata(args, gtex_dataset)
+    if not dbgap_study_dataset.hasProperty("producedBy") or not isinstance(dbgap_study_dataset.get("isAbout"), list):
+        logging.fatal("dbGaP study Dataset in " + args.public_instance + " has no Study or samples; sharded instances are not supported")
+        sys.exit(1)
+
+    # match dbGaP variables to the existing variable Dimensions
+    sv = ccmm.gtex.public_metadata.index_study_vars(dbgap_study_dataset, dbgap_study_md)
+    dbgap_study_md['id_to_var'] = sv['id_to_var']
+    dbgap_study_md['type_name_cg_to_var'] = sv['type_name_cg_to_var']
+
+    # subjects appear in full in the "all subjects" StudyGroup
+    dats_study = dbgap_study_dataset.get("producedBy")
+    study_groups = dats_study.get("studyGroups")
+    if len(study_groups) != 1 or study_groups[0].get("name") != "all subjects":
+        logging.fatal(args.public_instance + " already contains consent groups or other restricted-access data")
+        sys.exit(1)
+    dats_subjects_l = study_groups[0].get("members")
+
+    # index DNA/RNA extract Materials by GTEx sample id, as in a full build
+    dats_samples_d = {}
+    for s in dbgap_study_dataset.get("isAbout"):
+        if isinstance(s, DatsObj):
+            dats_samples_d[get_extract_sample_id(s)] = s
+    logging.info("read " + str(len(dats_subjects_l)) + " subject(s) and " + str(len(dats_samples_d)) + " sample(s) from public instance")
+
+    # a public instance built from a subset must be overlaid with the same --subset_* options
+    subset = ccmm.subset.get_subset_from_args(args)
+
+    return {
+        "gtex_dataset": gtex_dataset,
+        "study_id": study_id,
+        "dbgap_study_dataset": dbgap_study_dataset,
+        "dbgap_study_md": dbgap_study_md,
+        "cache": DatsObjCache(),
+        "dats_subjects_l": dats_subjects_l,
+        "dats_samples_d": dats_samples_d,
+        "dats_study": dats_study,
+        "subset": subset
+        }
+
+# write Dataset to DATS JSON file
+def write_output(args, ctx):
+    if args.shard_by is not None:
+        ccmm.gtex.shards.write_sharded_dataset(args.output_file, ctx['gtex_dataset'], ctx['dbgap_study_dataset'], ctx['dats_samples_d'], ctx['p_samples'], args.shard_by, args.shard_size)
+        return
 
-    # write Dataset to DATS JSON file
     with open(args.output_file, mode="w") as jf:
-        jf.write(json.dumps(gtex_dataset, indent=2, cls=DATSEncoder))
+        jf.write(json.dumps(ctx['gtex_dataset'], indent=2, cls=DATSEncoder))
+
+# write a separate RNA extract JSON file for each RNA-Seq sample
+def write_samples_json(args, ctx):
+    if args.samples_json_dir is None and args.samples_json_archive is None:
+        return
+    rnaseq_samples = ccmm.gtex.rna_extracts.filter_samples(ctx['p_samples'], "RNASEQ")
+    ccmm.gtex.rna_extracts.write_samples_json(ctx['p_subjects'], rnaseq_samples, args.samples_json_dir, args.num_procs, args.samples_json_archive)
+
+def get_pipeline(args):
+    # apply restricted-access metadata to an existing public instance
+    if args.public_instance is not None:
+        stages = [
+            Stage("public_instance", load_public_instance,
+                  outputs=["gtex_dataset", "study_id", "dbgap_study_dataset", "dbgap_study_md", "cache",
+                           "dats_subjects_l", "dats_samples_d", "dats_study", "subset"],
+                  args=["public_instance", "dbgap_public_xml_path",
+                        "subset_subjects", "subset_samples", "subset_tissues", "subset_smafrze", "subset_fraction", "subset_seed"]),
+            Stage("restricted_metadata", add_restricted_metadata,
+                  inputs=["cache", "dbgap_study_md", "dats_subjects_l", "dats_samples_d", "dats_study", "study_id", "subset"],
+                  args=["dbgap_protected_metadata_path", "no_circular_links", "use_all_dbgap_subject_vars"]),
+            Stage("write_output", write_output,
+                  inputs=["gtex_dataset"],
+                  args=["output_file"],
+                  checkpoint=False)
+            ]
+        return Pipeline("gtex_v7_restricted_overlay", stages, args.checkpoint_dir)
+
+    stages = [
+        Stage("read_inputs", read_inputs,
+              outputs=["p_subjects", "p_samples", "gh_subjects", "gh_samples", "gh_tissues",
+                       "protected_rnaseq_manifest", "protected_rnaseq_files", "protected_wgs_manifest", "protected_wgs_files",
+                       "rnaseq_dois", "wgs_dois", "subset"],
+              args=["subject_phenotypes_path", "sample_attributes_path", "data_stewards_repo_path",
+                    "subset_subjects", "subset_samples", "subset_tissues", "subset_smafrze", "subset_fraction", "subset_seed"]),
+        Stage("cross_check_ids", cross_check_inputs,
+              inputs=["p_subjects", "p_samples", "gh_subjects", "gh_samples", "protected_rnaseq_manifest", "protected_rnaseq_files",
+                      "protected_wgs_manifest", "protected_wgs_files"],
+              checkpoint=False),
+        Stage("study_metadata", read_study_metadata,
+              outputs=["gtex_dataset", "study_id", "dbgap_study_dataset", "dbgap_study_md", "cache"],
+              args=["dbgap_public_xml_path"]),
+        Stage("subjects", build_subjects,
+              inputs=["cache", "dbgap_study_md", "dbgap_study_dataset", "p_subjects", "gh_subjects"],
+              outputs=["dats_subjects_d", "dats_subjects_l", "dats_study"],
+              args=["no_circular_links"]),
+        Stage("samples", build_samples,
+              inputs=["cache", "dbgap_study_md", "dbgap_study_dataset", "dats_subjects_d", "p_samples", "gh_samples"],
+              outputs=["dats_samples_d"],
+              args=["max_output_samples", "sample_characteristics"]),
+        Stage("file_datasets", build_file_datasets,
+              inputs=["cache", "dbgap_study_dataset", "dats_samples_d", "p_samples", "gh_samples",
+                      "protected_wgs_files", "wgs_dois", "protected_rnaseq_files", "rnaseq_dois"],
+              outputs=["file_datasets_l"],
+              args=["no_circular_links"]),
+        Stage("restricted_metadata", add_restricted_metadata,
+              inputs=["cache", "dbgap_study_md", "dats_subjects_l", "dats_samples_d", "dats_study", "study_id", "subset"],
+              args=["dbgap_protected_metadata_path", "no_circular_links", "use_all_dbgap_subject_vars"]),
+        Stage("write_output", write_output,
+              inputs=["gtex_dataset", "dbgap_study_dataset", "dats_samples_d", "p_samples"],
+              args=["output_file", "shard_by", "shard_size"],
+              checkpoint=False),
+        Stage("write_samples_json", write_samples_json,
+              inputs=["p_subjects", "p_samples"],
+              args=["samples_json_dir", "samples_json_archive"],
+              checkpoint=False)
+        ]
+    return Pipeline("gtex_v7_to_dats", stages, args.checkpoint_dir)
+
+# ------------------------------------------------------
+# main()
+# ------------------------------------------------------
+
+def main():
+
+    # input
+    parser = argparse.ArgumentParser(description='Create DATS JSON for dbGaP GTEx public metadata.')
+    parser.add_argument('--output_file', required=True, help ='Output file path for the DATS JSON file containing the top-level DATS Dataset.')
+    parser.add_argument('--dbgap_public_xml_path', required=True, help ='Path to directory that contains public dbGaP metadata files e.g., *.data_dict.xml and *.var_report.xml')
+    parser.add_argument('--dbgap_protected_metadata_path', required=False, help ='Path to directory that contains access-controlled dbGaP tab-delimited metadata files.')
+    parser.add_argument('--max_output_samples', required=False, type=int, help ='Impose a limit on the number of sample Materials in the output DATS. For testing purposes only.')
+    parser.add_argument('--subject_phenotypes_path', default=V7_SUBJECT_PHENOTYPES_FILE, required=False, help ='Path to ' + V7_SUBJECT_PHENOTYPES_FILE)
+    parser.add_argument('--sample_attributes_path', default=V7_SAMPLE_ATTRIBUTES_FILE, required=False, help ='Path to ' + V7_SAMPLE_ATTRIBUTES_FILE)
+    parser.add_argument('--data_stewards_repo_path', default='data-stewards', required=False, help ='Path to local copy of https://github.com/dcppc/data-stewards')
+    parser.add_argument('--no_circular_links', action='store_true', help ='Whether to disallow circular links/paths within the JSON-LD output.')
+    parser.add_argument('--sample_characteristics', required=False, default=ccmm.gtex.characteristics.DEFAULT_SAMPLE_PROFILE, choices=sorted(ccmm.gtex.characteristics.SAMPLE_PROFILES.keys()), help ='Which GTEx Portal sample attributes to store as characteristics of the DATS sample Materials.')
+    parser.add_argument('--use_all_dbgap_subject_vars', action='store_true', help ='Whether to store all available dbGaP variable values as characteristics of the DATS subject Materials.')
+#    parser.add_argument('--use_all_dbgap_sample_vars', action='store_true', help ='Whether to store all available dbGaP variable values as characteristics of the DATS sample Materials.')
+    ccmm.subset.add_subset_args(parser, gtex_filters=True)
+    parser.add_argument('--shard_by', required=False, choices=ccmm.gtex.shards.SHARD_BY, help ='Write sample Materials and file Datasets to separate shard files, one per tissue (SMTSD) or one per --shard_size samples.')
+    parser.add_argument('--shard_size', required=False, type=int, default=ccmm.gtex.shards.DEFAULT_SHARD_SIZE, help ='Number of samples per shard when --shard_by=count.')
+    parser.add_argument('--samples_json_dir', required=False, help ='Also write a separate DATS JSON file for each RNA-Seq sample to this directory.')
+    parser.add_argument('--samples_json_archive', required=False, help ='Also write a separate DATS JSON file for each RNA-Seq sample to this tar (.tar, .tar.gz, .tgz) or zip (.zip) archive.')
+    parser.add_argument('--num_procs', required=False, type=int, default=1, help ='Number of worker processes to use when building sample Materials and per-sample JSON files.')
+    parser.add_argument('--public_instance', required=False, help ='Path to a public DATS JSON instance written by a previous run. If given, the restricted-access metadata in --dbgap_protected_metadata_path is added to this instance instead of building a new one. Any --subset_ options must match those used to build the public instance.')
+    parser.add_argument('--checkpoint_dir', required=False, help ='Directory in which to save the state of the conversion after each stage. A build resumed with --resume and a new --dbgap_protected_metadata_path reruns only the restricted-access and output stages.')
+    parser.add_argument('--resume', action='store_true', help ='Resume from the last valid checkpoint in --checkpoint_dir.')
+    args = parser.parse_args()
+
+    # logging
+    logging.basicConfig(level=logging.INFO)
+#    logging.basicConfig(level=logging.DEBUG)
+
+    if args.resume and args.checkpoint_dir is None:
+        logging.fatal("--resume requires --checkpoint_dir")
+        sys.exit(1)
+
+    if args.public_instance is not None:
+        if args.dbgap_protected_metadata_path is None:
+            logging.fatal("--public_instance requires --dbgap_protected_metadata_path")
+            sys.exit(1)
+        if args.shard_by is not None or args.samples_json_dir is not None or args.samples_json_archive is not None:
+            logging.fatal("--public_instance can't be combined with --shard_by, --samples_json_dir or --samples_json_archive")
+            sys.exit(1)
+
+    pipeline = get_pipeline(args)
+    pipeline.run(args, resume=args.resume)
 
 if __name__ == '__main__':
     main()
@@ -3,7 +3,9 @@
 # Create DATS JSON description of TOPMed public data.
 
 import argparse
-from ccmm.dats.datsobj import DatsObj, DatsObjCache
+from ccmm.dats.datsobj import DatsObj, DatsObjCache, DatsObjCacheShard, TieredDatsObjCache
+import ccmm.dats.datsobj as datsobj
+from ccmm.dats.fragments import DatsFragmentStore
 from collections import OrderedDict
 from ccmm.dats.datsobj import DATSEncoder
 import ccmm.topmed.samples
@@ -12,16 +14,40 @@ import ccmm.topmed.dna_extracts
 import ccmm.topmed.wgs_datasets
 import ccmm.topmed.public_metadata
 import ccmm.topmed.restricted_metadata
+import ccmm.topmed.file_index
 import ccmm.topmed.parsers.manifest_files as manifest_files
+import ccmm.topmed.parsers.guid_index as guid_index
+import ccmm.subset
 import json
 import logging
+import multiprocessing
 import os
 import re
 import sys
 
-# synthetic subject and sample ids
-SUBJ_ID = 1
-SAMP_ID = 1
+# ------------------------------------------------------
+# Synthetic subject and sample ids
+# ------------------------------------------------------
+
+# Allocates the numeric part of the synthetic subject and sample ids used for studies with no
+# restricted-access metadata. Each accession draws from its own arithmetic sequence (acc_index + 1,
+# acc_index + 1 + n_accs, ...) so that the ids assigned don't depend on the order in which the
+# accessions are processed. With one study per accession this assigns the same ids as numbering
+# the studies consecutively.
+class SyntheticIdAllocator:
+    acc_index = None
+    n_accs = None
+    n_allocated = None
+
+    def __init__(self, acc_index, n_accs):
+        self.acc_index = acc_index
+        self.n_accs = n_accs
+        self.n_allocated = 0
+
+    def next_id(self):
+        id = self.acc_index + 1 + (self.n_accs * self.n_allocated)
+        self.n_allocated += 1
+        return id
 
 # ------------------------------------------------------
 # Create DATS StudyGroups from restricted access data
@@ -112,7 +138,7 @@ def make_consent_group(args, group_name, group_index, subject_l, dats_subject_d)
             cl.append(DatsObj("Dimension", [("name", "member of study group"), ("values", [ group.getIdRef() ])]))
     return group
 
-def add_study_groups(cache, args, study_md, study_restricted_md, subjects_l, dats_study, study_id):
+def add_study_groups(cache, args, study_md, study_restricted_md, subjects_l, dats_study, study_id, subset=None):
     # index DATS subjects by dbGaP_Subject_ID
     subjects_d = {}
     for s in subjects_l:
@@ -155,7 +181,8 @@ def add_study_groups(cache, args, study_md, study_restricted_md, subjects_l, dat
         slist = cid_to_subjects[cid]
         n_subjects = len(slist)
         cvc = code_to_c_var[cid]
-        if n_subjects != int(cvc['count']):
+        # counts in the var_report are for the whole study
+        if subset is None and n_subjects != int(cvc['count']):
             logging.fatal("subject count mismatch in consent group " + cid)
             sys.exit(1)
         logging.info("adding StudyGroup for " + str(n_subjects) + " subject(s) in consent group " + cid + ": " + cvc['name'])
@@ -167,8 +194,8 @@ def add_study_groups(cache, args, study_md, study_restricted_md, subjects_l, dat
 # Process a single study
 # ------------------------------------------------------
 
-def process_study(args, cache, topmed_dataset, dbgap_study_dataset, study_id, study_pub_md, study_restricted_md, sample_manifest, file_guids):
-    global SUBJ_ID, SAMP_ID
+# Returns the file index entries for the study (see ccmm.topmed.file_index) if args.file_index is set, otherwise None.
+def process_study(args, cache, dbgap_study_dataset, study_id, study_pub_md, study_restricted_md, sample_manifest, file_guids, id_allocator, subset=None):
     study_md = study_pub_md[study_id]        
     study_res_md = None
 
@@ -184,10 +211,10 @@ def process_study(args, cache, topmed_dataset, dbgap_study_dataset, study_id, st
 
     # create DATS subject Materials
     if study_restricted_md is None:
-        # create single dummy subject
-        dbgap_subj_id = "{:07d}".format(SUBJ_ID)
-        subj_id = "SU{:07d}".format(SUBJ_ID)
-        SUBJ_ID += 1
+        # create single dummy subject and sample
+        synthetic_id = id_allocator.next_id()
+        dbgap_subj_id = "{:07d}".format(synthetic_id)
+        subj_id = "SU{:07d}".format(synthetic_id)
         dats_subjects_d = ccmm.topmed.subjects.get_synthetic_subject_dats_material_from_public_metadata(cache, dbgap_study_dataset, study_md, dbgap_subj_id, subj_id)
     else:
         # create complete subject list from restricted metadata
@@ -217,7 +244,7 @@ def process_study(args, cache, topmed_dataset, dbgap_study_dataset, study_id, st
 
     # create additional StudyGroups for protected metadata
     if study_restricted_md is not None:
-        add_study_groups(cache, args, study_md, study_restricted_md, dats_subjects_l, dats_study, study_id)
+        add_study_groups(cache, args, study_md, study_restricted_md, dats_subjects_l, dats_study, study_id, subset)
 
     # --------------------------
     # samples
@@ -227,11 +254,12 @@ def process_study(args, cache, topmed_dataset, dbgap_study_dataset, study_id, st
     # create DATS sample Materials (i.e., RNA/DNA extracts and biological samples)
     if study_restricted_md is None:
         # create single dummy sample
-        dbgap_samp_id = "{:07d}".format(SAMP_ID)
-        samp_id = "SA{:07d}".format(SAMP_ID)
-        SAMP_ID += 1
+        dbgap_samp_id = "{:07d}".format(synthetic_id)
+        samp_id = "SA{:07d}".format(synthetic_id)
         dats_samples_d = ccmm.topmed.samples.get_synthetic_sample_dats_material_from_public_metadata(cache, dats_subjects_l[0], dbgap_study_dataset, study_md, dbgap_samp_id, samp_id)
     else:
+        # only create Materials for samples that have TOPMed files
+        ccmm.topmed.restricted_metadata.filter_non_topmed_samples(study_res_md, study_id, sample_manifest, file_guids)
         # samples indexed by dbGaP_Sample_ID from restricted metadata
         dats_samples_d = ccmm.topmed.samples.get_samples_dats_materials_from_restricted_metadata(cache, dats_subjects_d, dbgap_study_dataset, study_md, study_res_md)
 
@@ -248,22 +276,68 @@ def process_study(args, cache, topmed_dataset, dbgap_study_dataset, study_id, st
         logging.info("adding file Datasets for " + str(len(file_datasets_l)) + " sample(s)")
         dbgap_study_dataset.set("hasPart", file_datasets_l)
 
-        # filter samples not referenced by Datasets
-        referenced_samples = {}
-        for fd in file_datasets_l:
-            data_acq = fd.get("producedBy")
-            for ds in data_acq.get("input"):
-                ds_id = ds.get("@id")
-                referenced_samples[ds_id] = True
+        if args.file_index is not None:
+            return ccmm.topmed.file_index.get_study_file_index(dats_samples_d, file_datasets_l, sample_manifest, file_guids)
 
-        filtered_dats_samples_l = []
-        for ds in dats_samples_l:
-            if ds.get("@id") in referenced_samples:
-                filtered_dats_samples_l.append(ds)
+    return None
+
+# ------------------------------------------------------
+# Process a single accession
+# ------------------------------------------------------
 
-        nfs = len(filtered_dats_samples_l)
-        logging.info(str(nfs) + " sample Materials remain after filtering non-TOPMed samples")
-        dbgap_study_dataset.set("isAbout", filtered_dats_samples_l)
+# Process all the studies in the accession at position acc_index in the accession list. Study-independent
+# objects (Annotations, DataTypes, etc.) are shared with other accessions through global_cache.
+# Returns (list of (study_id, dbGaP study Dataset, file index entries) for the studies that were
+# processed, list of global_cache keys used.)
+def process_accession(args, acc, acc_index, n_accs, studies_by_id, sample_manifest, file_guids, global_cache, subset=None):
+    # cache used to minimize duplication of JSON objects in JSON-LD output
+    # subjects and samples are cached per accession, so they are not shared across studies
+    cache = TieredDatsObjCache(global_cache)
+    id_allocator = SyntheticIdAllocator(acc_index, n_accs)
+    processed = []
+
+    # read public metadata
+    pub_xp = args.dbgap_public_xml_path + "/" + acc
+    study_pub_md = ccmm.topmed.public_metadata.read_study_metadata(pub_xp)
+
+    # read protected metadata
+    restricted_mp = args.dbgap_protected_metadata_path
+    study_restricted_md = None
+    if restricted_mp is not None:
+        restricted_mp = restricted_mp + "/" + acc
+        study_restricted_md = ccmm.topmed.restricted_metadata.read_study_metadata(restricted_mp)
+
+    for study_id in study_pub_md:
+        dbgap_study_dataset = studies_by_id[study_id]
+        if subset is not None:
+            n_subjects = ccmm.topmed.restricted_metadata.subset_study_metadata(study_restricted_md[study_id], subset)
+            if n_subjects == 0:
+                logging.warn("subset does not include any subjects from " + study_id + ", skipping study")
+                continue
+        file_index_entries = process_study(args, cache, dbgap_study_dataset, study_id, study_pub_md, study_restricted_md, sample_manifest, file_guids, id_allocator, subset)
+        processed.append((study_id, dbgap_study_dataset, file_index_entries))
+
+    return (processed, cache.global_keys_used)
+
+# per-process state set by init_accession_worker
+WORKER_STATE = None
+
+def init_accession_worker(args, n_accs, studies_by_id, sample_manifest, file_guids, subset, global_ids):
+    global WORKER_STATE
+    WORKER_STATE = { "args": args, "n_accs": n_accs, "studies_by_id": studies_by_id, "sample_manifest": sample_manifest, "file_guids": file_guids, "subset": subset, "global_ids": global_ids }
+
+# Process a single (acc_index, acc) in a worker process, using a shard of the global cache. Returns
+# (processed studies, global keys used, cache shard), or None if a fatal error was logged, since
+# exiting from a worker would stall the pool.
+def process_accession_worker(indexed_acc):
+    (acc_index, acc) = indexed_acc
+    ws = WORKER_STATE
+    shard = DatsObjCacheShard(ws['global_ids'])
+    try:
+        (processed, global_keys_used) = process_accession(ws['args'], acc, acc_index, ws['n_accs'], ws['studies_by_id'], ws['sample_manifest'], ws['file_guids'], shard, ws['subset'])
+    except SystemExit:
+        return None
+    return (processed, global_keys_used, shard)
 
 # ------------------------------------------------------
 # main()
@@ -279,13 +353,24 @@ def main():
     parser.add_argument('--dbgap_protected_metadata_path', required=False, help ='Path to directory that contains access-controlled dbGaP tab-delimited metadata files.')
     parser.add_argument('--manifest_file', required=False, help ='Path to directory that contains TOPMed file manifest for access-controlled data.')
     parser.add_argument('--guid_files', required=False, help ='Path to directory that contains the .tsv GUID files for TOPMed CRAM and VCF files and associated index files.')
+    parser.add_argument('--guid_index', required=False, help ='Path to a persistent SQLite index of the GUID files, which will be created if necessary and updated from --guid_files, if given. Avoids reading and checking the GUID files in full on every run.')
     parser.add_argument('--no_circular_links', action='store_true', help ='Whether to disallow circular links/paths within the JSON-LD output.')
+    ccmm.subset.add_subset_args(parser)
+    parser.add_argument('--num_procs', required=False, type=int, default=1, help ='Number of worker processes to use. Each accession is processed by a single process.')
+    parser.add_argument('--spill_dir', required=False, help ='Directory in which to write each completed study to a temporary file, rather than keeping all of the studies in memory until the output file is written. Limits peak memory use to roughly that of the largest accession.')
+    parser.add_argument('--file_index', required=False, help ='Output file path for an index of the file-level Datasets in the output, which bin/topmed_update_files.py can use to update them for a new manifest or set of GUID files.')
     args = parser.parse_args()
 
     # logging
     logging.basicConfig(level=logging.INFO)
 #    logging.basicConfig(level=logging.DEBUG)
 
+    # subject/sample subset, applied to the restricted metadata
+    subset = ccmm.subset.get_subset_from_args(args)
+    if subset is not None and args.dbgap_protected_metadata_path is None:
+        logging.fatal("subset options require --dbgap_protected_metadata_path")
+        sys.exit(1)
+
     # get accession list
     acc_l = []
     for acc in args.dbgap_accession_list.split(","):
@@ -318,45 +403,75 @@ def main():
             sys.exit(1)
         sample_manifest = manifest_files.read_manifest(args.manifest_file)
 
-        # read guid files
-        if args.guid_files is None:
-            logging.fatal("--dbgap_protected_metadata_path given, but no --guid_files specified")
+        # read guid files, or use/update persistent index
+        if args.guid_files is None and (args.guid_index is None or not os.path.isfile(args.guid_index)):
+            logging.fatal("--dbgap_protected_metadata_path given, but no --guid_files or existing --guid_index specified")
             sys.exit(1)
-        file_guids = {}
-        for suffix in ('cram', 'crai', 'vcf', 'vcfcsi'):
-            guid_file = args.guid_files + "/" + "topmed-" + suffix + ".tsv"
-            guids = manifest_files.read_guid_file(guid_file)
-            # add guids to file_guids
-            for g in guids:
-                if g in file_guids:
-                    logging.fatal("duplicate filename " + g + " in GUID file " + guid_file)
+        file_guids = guid_index.read_file_guids(args.guid_files, args.guid_index)
+
+    # process each accession, in parallel if requested
+    n_accs = len(acc_l)
+    indexed_accs = list(enumerate(acc_l))
+    # cache for study-independent objects shared by all accessions
+    global_cache = DatsObjCache()
+
+    # completed studies are written to spill_store, if any, and released
+    spill_store = None
+    if args.spill_dir is not None:
+        spill_store = DatsFragmentStore(args.spill_dir)
+
+    # merge study Datasets built by the workers back into topmed_dataset, in accession order
+    study_datasets = topmed_dataset.get("hasPart")
+    file_index_studies = OrderedDict()
+    def add_study_datasets(processed):
+        for (study_id, dbgap_study_dataset, file_index_entries) in processed:
+            if file_index_entries is not None:
+                file_index_studies[dbgap_study_dataset.get("identifier").get("identifier")] = file_index_entries
+            index = study_datasets.index(studies_by_id[study_id])
+            if spill_store is not None:
+                dbgap_study_dataset = spill_store.spill(dbgap_study_dataset)
+            study_datasets[index] = dbgap_study_dataset
+            studies_by_id[study_id] = dbgap_study_dataset
+
+    global_keys_used_lists = []
+    if args.num_procs > 1 and n_accs > 1 and not datsobj.DEBUG_NO_ID_REFS:
+        n_procs = min(args.num_procs, n_accs)
+        logging.info("processing " + str(n_accs) + " accession(s) using " + str(n_procs) + " processes")
+        with multiprocessing.Pool(n_procs, initializer=init_accession_worker, initargs=(args, n_accs, studies_by_id, sample_manifest, file_guids, subset, global_cache.get_ids())) as pool:
+            # results are returned in accession order
+            for (acc_index, r) in enumerate(pool.imap(process_accession_worker, indexed_accs, chunksize=1)):
+                if r is None:
+                    logging.fatal("failed to process accession " + acc_l[acc_index])
                     sys.exit(1)
-                file_guids[g] = guids[g]
-        logging.info("read GUIDs for " + str(len(file_guids)) + " file(s)")
-
-    for acc in acc_l:
-        # cache used to minimize duplication of JSON objects in JSON-LD output
-        # TODO - note that this disallows sharing of subjects (for example) across studies
-        cache = DatsObjCache()
-        
-        # read public metadata
-        pub_xp = args.dbgap_public_xml_path + "/" + acc
-        study_pub_md = ccmm.topmed.public_metadata.read_study_metadata(pub_xp)
-
-        # read protected metadata
-        restricted_mp = args.dbgap_protected_metadata_path
-        study_restricted_md = None
-        if restricted_mp is not None:
-            restricted_mp = restricted_mp + "/" + acc
-            study_restricted_md = ccmm.topmed.restricted_metadata.read_study_metadata(restricted_mp)
-
-        for study_id in study_pub_md:
-            dbgap_study_dataset = studies_by_id[study_id]
-            process_study(args, cache, topmed_dataset, dbgap_study_dataset, study_id, study_pub_md, study_restricted_md, sample_manifest, file_guids)
+                (processed, global_keys_used, shard) = r
+                # objects created by more than one worker are reduced to references to those of the first accession
+                datsobj.merge_cache_shards(global_cache, [shard])
+                add_study_datasets(processed)
+                global_keys_used_lists.append(global_keys_used)
+                # release the results before waiting for the next accession
+                r = processed = shard = None
+    else:
+        for (i, acc) in indexed_accs:
+            (processed, global_keys_used) = process_accession(args, acc, i, n_accs, studies_by_id, sample_manifest, file_guids, global_cache, subset)
+            add_study_datasets(processed)
+            global_keys_used_lists.append(global_keys_used)
+            processed = None
+
+    n_saved = datsobj.get_shared_bytes_saved(global_cache, global_keys_used_lists)
+    logging.info("shared " + str(len(global_cache.cache)) + " study-independent object(s) across accessions, saving approximately " + str(n_saved) + " bytes")
 
     # write Dataset to DATS JSON file
     with open(args.output_file, mode="w") as jf:
-        jf.write(json.dumps(topmed_dataset, indent=2, cls=DATSEncoder))
+        if spill_store is None:
+            jf.write(json.dumps(topmed_dataset, indent=2, cls=DATSEncoder))
+        else:
+            spill_store.write_json(topmed_dataset, jf)
+    if spill_store is not None:
+        spill_store.cleanup()
+
+    # write index of file Datasets
+    if args.file_index is not None:
+        ccmm.topmed.file_index.write_file_index(args.file_index, global_cache.get_ids(), file_index_studies)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Update the file-level Datasets in a TOPMed DATS instance written by topmed_to_dats.py --file_index
+# for a new TOPMed manifest and/or set of GUID files, without rebuilding the subjects and samples.
+
+import argparse
+from ccmm.dats.datsobj import DatsObj, DATSEncoder
+import ccmm.dats.datsobj
+import ccmm.topmed.file_index
+import ccmm.topmed.parsers.manifest_files as manifest_files
+import ccmm.topmed.parsers.guid_index as guid_index
+import json
+import logging
+import os
+import sys
+
+# ------------------------------------------------------
+# main()
+# ------------------------------------------------------
+
+def main():
+
+    # input
+    parser = argparse.ArgumentParser(description='Update the file-level Datasets in a TOPMed DATS instance for a new manifest and GUID files.')
+    parser.add_argument('--prior_instance', required=True, help ='Path to the DATS JSON file written by a previous run of topmed_to_dats.py.')
+    parser.add_argument('--prior_file_index', required=True, help ='Path to the file index written with --prior_instance, by topmed_to_dats.py --file_index or a previous update.')
+    parser.add_argument('--manifest_file', required=True, help ='Path to the new TOPMed file manifest for access-controlled data.')
+    parser.add_argument('--guid_files', required=False, help ='Path to directory that contains the new .tsv GUID files for TOPMed CRAM and VCF files and associated index files.')
+    parser.add_argument('--guid_index', required=False, help ='Path to a persistent SQLite index of the GUID files, which will be created if necessary and updated from --guid_files, if given.')
+    parser.add_argument('--output_file', required=True, help ='Output file path for the updated DATS JSON file.')
+    parser.add_argument('--file_index', required=False, help ='Output file path for the updated file index.')
+    parser.add_argument('--no_circular_links', action='store_true', help ='Whether to disallow circular links/paths within the JSON-LD output. Should match the setting used to create --prior_instance.')
+    args = parser.parse_args()
+
+    # logging
+    logging.basicConfig(level=logging.INFO)
+
+    if args.guid_files is None and (args.guid_index is None or not os.path.isfile(args.guid_index)):
+        logging.fatal("no --guid_files or existing --guid_index specified")
+        sys.exit(1)
+
+    # read new manifest and GUIDs
+    sample_manifest = manifest_files.read_manifest(args.manifest_file)
+    file_guids = guid_index.read_file_guids(args.guid_files, args.guid_index)
+
+    # read prior instance and file index
+    logging.info("reading prior instance from " + args.prior_instance)
+    topmed_dataset = ccmm.dats.datsobj.read_dats_json(args.prior_instance)
+    if not isinstance(topmed_dataset, DatsObj) or topmed_dataset.get("@type") != "Dataset":
+        logging.fatal(args.prior_instance + " does not contain a DATS Dataset")
+        sys.exit(1)
+    file_index = ccmm.topmed.file_index.read_file_index(args.prior_file_index)
+
+    # regenerate changed file Datasets
+    new_file_index = ccmm.topmed.file_index.update_file_datasets(topmed_dataset, file_index, sample_manifest, file_guids, args.no_circular_links)
+
+    # write Dataset to DATS JSON file
+    with open(args.output_file, mode="w") as jf:
+        jf.write(json.dumps(topmed_dataset, indent=2, cls=DATSEncoder))
+
+    # write updated index of file Datasets
+    if args.file_index is not None:
+        ccmm.topmed.file_index.write_file_index(args.file_index, new_file_index['global_ids'], new_file_index['studies'])
+
+if __name__ == '__main__':
+    main()
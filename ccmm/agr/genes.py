@@ -2,12 +2,15 @@
 
 from ccmm.dats.datsobj import DatsObj
 import ccmm.dats.util as util
+import ccmm.agr.parsers.json_files as json_files
 from collections import OrderedDict
+import numpy as np
 import pandas as pd
 import csv
 import json
 import logging
 import os
+import pickle
 import re
 import sys
 
@@ -51,6 +54,18 @@ EVID = {
     "IMP": "ECO_0000315"
 }
 
+# Columns read from the ortholog file: (column number, name)
+ORTHOLOG_COLUMNS = [
+    (0, 'ortho_gene_id'),
+    (1, 'ortho_gene_symbol'),
+    (2, 'ortho_taxon'),
+    (4, 'mod_gene_id'),
+    (6, 'mod_taxon')
+]
+
+# Ortholog columns with only a few distinct values
+ORTHOLOG_TAXON_COLUMNS = ['ortho_taxon', 'mod_taxon']
+
 # To Do List of relation IDs
 #RELID = {
 #    "is_implicated_in": "ECO",
@@ -58,19 +73,96 @@ EVID = {
 #    "is_marker_for": "ECO_"
 #}
 
+# ------------------------------------------------------
+# Records
+# ------------------------------------------------------
+
+# Fixed set of fields read from a BGI, disease or phenotype entry. Records use __slots__ rather than a
+# per-record dict to keep large MODs in memory, and their fields can be read either as attributes or
+# like the dicts they replace, e.g., f['primaryId'].
+class Record:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for (field, value) in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+class GeneFeature(Record):
+    __slots__ = ('descr', 'primaryId', 'alt_ids', 'assembly', 'chr', 'start', 'end', 'strand', 'soid', 'taxon')
+
+class DiseaseAnnotation(Record):
+    __slots__ = ('object_id', 'do_id', 'data_provider', 'date_ass', 'association_type', 'evidence_codes', 'pubmed_id', 'mod_pub_id')
+
+class PhenotypeAnnotation(Record):
+    __slots__ = ('object_id', 'date_ass', 'phe_statement', 'pubmed_id', 'mod_pub_id', 'phe_term_ids')
+
+# ------------------------------------------------------
+# Indexing
+# ------------------------------------------------------
+
 def search_dict(key, value, list_of_dictionaries):
     return [element for element in list_of_dictionaries if element[key] == value]
 
+# Group a list of dicts (or Records) by the value of key. Returns an OrderedDict mapping each value to
+# the list of dicts with that value, with both the values and the dicts in each list in their original order.
+def group_by(key, list_of_dictionaries):
+    groups = OrderedDict()
+    for element in list_of_dictionaries:
+        value = element[key]
+        if value in groups:
+            groups[value].append(element)
+        else:
+            groups[value] = [element]
+    return groups
+
+# Index disease or phenotype annotations by gene and then by term. Returns a dict mapping each
+# object_id to an OrderedDict that maps each of its term_key values to the corresponding annotations.
+def index_annotations(term_key, annotations):
+    return dict([(object_id, group_by(term_key, gene_annots)) for (object_id, gene_annots) in group_by('object_id', annotations).items()])
+
+# Columns of the ortholog table needed to build the genes, with the range of rows that holds the
+# orthologs of each mod_gene_id. Values are read by row number, so no per-ortholog dicts are created.
+class OrthologIndex:
+    ortho_gene_id = None
+    ortho_gene_symbol = None
+    ortho_taxon = None
+    # mod_gene_id -> (start, end)
+    ranges = None
+
+    # returns the row numbers of the orthologs of mod_gene_id, in their order in the ortholog file
+    def get_rows(self, mod_gene_id):
+        (start, end) = self.ranges.get(mod_gene_id, (0, 0))
+        return range(start, end)
+
+# Index orthologs, as returned by read_orthology, by mod_gene_id
+def index_orthologs(orthologs):
+    index = OrthologIndex()
+    index.ortho_gene_id = orthologs['ortho_gene_id'].tolist()
+    index.ortho_gene_symbol = orthologs['ortho_gene_symbol'].tolist()
+    # categorical, so each row refers to one of a few shared strings
+    index.ortho_taxon = orthologs['ortho_taxon'].tolist()
+    # rows are sorted by mod_gene_id, so each gene's orthologs start where its id first appears
+    mod_gene_ids = orthologs['mod_gene_id']
+    starts = np.flatnonzero(~mod_gene_ids.duplicated().to_numpy()).tolist()
+    ends = starts[1:] + [len(mod_gene_ids)]
+    index.ranges = dict(zip(mod_gene_ids.iloc[starts].tolist(), zip(starts, ends)))
+    logging.info("indexed " + str(len(mod_gene_ids)) + " ortholog(s) of " + str(len(index.ranges)) + " MOD gene(s)")
+    return index
+
+# ------------------------------------------------------
+# Input
+# ------------------------------------------------------
+
 def read_bgi(cache, mod, bgi_gff3_disease_path):
     
     features = []
-    feature = {}
     
     file = bgi_gff3_disease_path + "/" + mod + "_BGI.json"
-    f = open(file)
-    x = json.load(f)
-    f.close()
-    records = x["data"]
+    # entries are read one at a time
+    records = json_files.iter_json_array(file)
     
     for entry in records:
         # required gene attributes per BGI
@@ -107,18 +199,7 @@ def read_bgi(cache, mod, bgi_gff3_disease_path):
             logging.fatal("encountered taxonomy other than Mouse (10090) or Rat (10116) - " + taxonId)
             sys.exit(1)
         
-        feature = {
-            'descr': geneSynopsis,
-            'primaryId': primaryId,
-            'alt_ids': crossRefIds,
-            'assembly': assembly,
-            'chr': chr,
-            'start': start,
-            'end': end,
-            'strand': strand,
-            'soid': soTermId,
-            'taxon': taxon
-        }
+        feature = GeneFeature(geneSynopsis, primaryId, crossRefIds, assembly, chr, start, end, strand, soTermId, taxon)
         features.append(feature)
         
     return features
@@ -126,13 +207,9 @@ def read_bgi(cache, mod, bgi_gff3_disease_path):
 def read_disease(cache, mod, gff3_json_path):
     
     diseases = []
-    disease = {}
     
     file = gff3_json_path + "/" + mod + "_disease.json"
-    f = open(file)
-    x = json.load(f)
-    f.close()
-    records = x["data"]
+    records = json_files.iter_json_array(file)
     
     for entry in records:
         # required disease attributes
@@ -147,16 +224,7 @@ def read_disease(cache, mod, gff3_json_path):
         if 'modPublicationId' in entry["evidence"]["publication"].keys():
             mod_pub_id = entry["evidence"]["publication"]["modPublicationId"]
 
-        disease = {
-            'object_id': object_id,
-            'do_id': do_id,
-            'data_provider': data_provider,
-            'date_ass': date_ass,
-            'association_type': obj_relation["associationType"],
-            'evidence_codes': evidence["evidenceCodes"],
-            'pubmed_id':  pubmed_id,
-            'mod_pub_id': mod_pub_id
-        }
+        disease = DiseaseAnnotation(object_id, do_id, data_provider, date_ass, obj_relation["associationType"], evidence["evidenceCodes"], pubmed_id, mod_pub_id)
         diseases.append(disease)
 
     return diseases
@@ -165,13 +233,9 @@ def read_phenotype(cache, mod, gff3_json_path):
     #assumes one phenotype termID per record as is in RGD and MGI phenotype JSONs 
     
     phenotypes = []
-    phenotype = {}
     
     file = gff3_json_path + "/" + mod + "_phenotype.json"
-    f = open(file)
-    x = json.load(f)
-    f.close()
-    records = x["data"]
+    records = json_files.iter_json_array(file)
     
     for entry in records:
         # required disease attributes
@@ -187,46 +251,60 @@ def read_phenotype(cache, mod, gff3_json_path):
         if 'phenotypeTermIdentifiers' in entry.keys():
             phe_term_ids = entry["phenotypeTermIdentifiers"][0]['termId']
         
-        phenotype = {
-            'object_id': object_id,
-            'date_ass': date_ass,
-            'phe_statement': phe_statement,
-            'pubmed_id':  pubmed_id,
-            'mod_pub_id': mod_pub_id,
-            'phe_term_ids': phe_term_ids
-        }
+        phenotype = PhenotypeAnnotation(object_id, date_ass, phe_statement, pubmed_id, mod_pub_id, phe_term_ids)
         phenotypes.append(phenotype)
 
     return phenotypes
 
 
-def read_orthology(ortholog_file):
-    
-    orthologs = []
-    ortholog = {}
-    
-    orth_list = pd.read_csv(ortholog_file, sep='\t', header=14, dtype='str')
-    # Process the entries in the file
-    
-    for row in orth_list.itertuples():
-        #logging.info("orth: " + str(row)) 
-        ortho_gene_id, ortho_gene_symbol, ortho_taxon, mod_gene_id, mod_taxon = row[1], row[2], row[3], row[5], row[7]
-        ortholog = {
-            'ortho_gene_id': ortho_gene_id,
-            'ortho_gene_symbol': ortho_gene_symbol,
-            'ortho_taxon': ortho_taxon,
-            'mod_gene_id': mod_gene_id,
-            'mod_taxon': mod_taxon
-            }
-        orthologs.append(ortholog)
-    
-    return orthologs
-        
+# Returns the path, size and modification time of an ortholog file, which identify the file that an
+# ortholog cache was built from.
+def get_ortholog_file_info(ortholog_file):
+    st = os.stat(ortholog_file)
+    return { "path": os.path.abspath(ortholog_file), "size": st.st_size, "mtime": st.st_mtime }
+
+# Read an ortholog cache written by read_orthology. Returns the DataFrame, or None if the cache was
+# built from a different file or version of ortholog_file.
+def read_ortholog_cache(cache_file, ortholog_file):
+    with open(cache_file, "rb") as fh:
+        cached = pickle.load(fh)
+    source = get_ortholog_file_info(ortholog_file)
+    if not isinstance(cached, dict) or cached.get("source") != source:
+        logging.info("ortholog cache " + cache_file + " was not built from the current " + ortholog_file + ", rebuilding")
+        return None
+    logging.info("read " + str(len(cached["orthologs"])) + " ortholog(s) from " + cache_file)
+    return cached["orthologs"]
 
+# Read the ortholog file into a DataFrame with one row per ortholog, sorted by mod_gene_id (keeping
+# the original order of each gene's orthologs) and with categorical taxon columns.
+#
+# cache_file - optional path to a binary copy of the DataFrame, which is read instead of ortholog_file
+#  if it was built from the same path, size and modification time of ortholog_file, and is otherwise
+#  (re)written after reading ortholog_file
+def read_orthology(ortholog_file, cache_file=None):
+    if cache_file is not None and os.path.isfile(cache_file):
+        orthologs = read_ortholog_cache(cache_file, ortholog_file)
+        if orthologs is not None:
+            return orthologs
 
+    source = get_ortholog_file_info(ortholog_file)
+    orth_list = pd.read_csv(ortholog_file, sep='\t', header=14, dtype='str', usecols=[c for (c, name) in ORTHOLOG_COLUMNS])
+    orth_list.columns = [name for (c, name) in ORTHOLOG_COLUMNS]
+    for col in ORTHOLOG_TAXON_COLUMNS:
+        orth_list[col] = orth_list[col].astype('category')
+    orthologs = orth_list.sort_values('mod_gene_id', kind='mergesort').reset_index(drop=True)
+    logging.info("read " + str(len(orthologs)) + " ortholog(s) from " + ortholog_file)
+
+    if cache_file is not None:
+        with open(cache_file, "wb") as fh:
+            pickle.dump({ "source": source, "orthologs": orthologs }, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        logging.info("wrote orthologs to " + cache_file)
+    return orthologs
 
-# Generate DATS JSON for a single gene
-def get_gene_json(cache, mod, gff3_json_path, orthologs):
+# Generate DATS JSON for the genes of a MOD
+#
+# orthologs_by_gene - OrthologIndex, as returned by index_orthologs
+def get_gene_json(cache, mod, gff3_json_path, orthologs_by_gene):
     
     # read gene features form BGI file
     features = read_bgi(cache, mod, gff3_json_path)
@@ -238,6 +316,10 @@ def get_gene_json(cache, mod, gff3_json_path, orthologs):
     phenotypes = read_phenotype(cache, mod, gff3_json_path)
     
     # TODO - read gene features from GFF3 file
+
+    # index annotations by gene and term, so that each gene's annotations are found in constant time
+    diseases_by_gene = index_annotations('do_id', diseases)
+    phenotypes_by_gene = index_annotations('phe_term_ids', phenotypes)
     
     genes = []
     
@@ -265,21 +347,19 @@ def get_gene_json(cache, mod, gff3_json_path, orthologs):
         #encode disease
         disease_list = []
         
-        gene_diseases = search_dict('object_id', f['primaryId'], diseases)  
+        # diseases for the gene, grouped by DO id
+        gene_diseases = diseases_by_gene.get(f['primaryId'])
         
-        if len(gene_diseases) > 0:
-            
-            do_ids = [d['do_id'] for d in gene_diseases] 
-            uniq_do_ids = list(set(do_ids))
+        if gene_diseases is not None:
             
-            for d in uniq_do_ids:
+            for d in gene_diseases:
                 disease_id =  DatsObj("Annotation", [ 
                     ("value",  d),
                     ("valueIRI", "http://purl.obolibrary.org/obo/DOID_"+ d[5:])])
                 
                 
                 
-                select_diseases = search_dict('do_id', d, gene_diseases)
+                select_diseases = gene_diseases[d]
                 
                 #relation = OrderedDict([("value", select_diseases[0]['association_type'])])
                 relation = DatsObj("Annotation", [
@@ -326,16 +406,13 @@ def get_gene_json(cache, mod, gff3_json_path, orthologs):
         #assumes one phenotype termID per record as is in RGD and MGI phenotype JSONs  
         phenotype_list = []
         
-        gene_phenotypes = search_dict('object_id', f['primaryId'], phenotypes)  
+        # phenotypes for the gene, grouped by phenotype term
+        gene_phenotypes = phenotypes_by_gene.get(f['primaryId'])
         
-        if len(gene_phenotypes) > 0:
-            
-            phe_ids = [p['phe_term_ids'] for p in gene_phenotypes] 
-            #logging.info("phe_ids: " + str(phe_ids))
-            uniq_phe_ids = list(set(phe_ids))
+        if gene_phenotypes is not None:
               
-            for p in uniq_phe_ids:               
-                select_phenotypes = search_dict('phe_term_ids', p, gene_phenotypes) 
+            for p in gene_phenotypes:               
+                select_phenotypes = gene_phenotypes[p]
                 #logging.info("select_phe: " + str(select_phenotypes))
                 
                 term_id = DatsObj("Annotation", [ 
@@ -380,21 +457,23 @@ def get_gene_json(cache, mod, gff3_json_path, orthologs):
         #encode ortholog
         ortholog_list = []
         
-        gene_orthologs = search_dict('mod_gene_id', f['primaryId'], orthologs)  
+        gene_orthologs = orthologs_by_gene.get_rows(f['primaryId'])
 
         if len(gene_orthologs) > 0:
             for o in gene_orthologs:  
-                if '9606' in o['ortho_taxon']:
+                ortho_taxon = orthologs_by_gene.ortho_taxon[o]
+                if '9606' in ortho_taxon:
                     o_taxon = util.get_taxon_human(cache)
                 else:
-                    logging.fatal("encountered taxonomy other human - " + o['ortho_taxon'])
+                    logging.fatal("encountered taxonomy other human - " + ortho_taxon)
                     sys.exit(1)
         
+                ortho_gene_id = orthologs_by_gene.ortho_gene_id[o]
                 mol_entity_ortholog = DatsObj("MolecularEntity", [
-                    ("identifier", DatsObj("Identifier", [("identifier", o['ortho_gene_id'])])),
-                    ("name", o['ortho_gene_id']),
+                    ("identifier", DatsObj("Identifier", [("identifier", ortho_gene_id)])),
+                    ("name", ortho_gene_id),
                     ("taxonomy", [ o_taxon ]),
-                    ("alternateIdentifiers", util.get_alt_id(o['ortho_gene_symbol'], "Gene Symbol")),
+                    ("alternateIdentifiers", util.get_alt_id(orthologs_by_gene.ortho_gene_symbol[o], "Gene Symbol")),
                 ]) 
                 
                 related_entity_id = OrderedDict([
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Incremental reader for the AGR JSON files (BGI, disease and phenotype.)
+#
+# Each of these files is a single JSON object whose "data" array holds one entry per gene or
+# annotation. Rather than loading the entire file, iter_json_array reads it in fixed-size chunks and
+# decodes one array element at a time, so only the current element and the fields that the caller
+# keeps from it are held in memory.
+
+import json
+import logging
+import re
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+CHUNK_SIZE = 1024 * 1024
+
+WHITESPACE_REGEX = re.compile(r'[ \t\n\r]*')
+
+# ------------------------------------------------------
+# JsonReader
+# ------------------------------------------------------
+
+# Buffered reader that decodes a JSON document a token or value at a time.
+class JsonReader:
+    path = None
+    fh = None
+    chunk_size = None
+    decoder = None
+    buf = None
+    pos = None
+    eof = None
+
+    def __init__(self, path, fh, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fatal(self, msg):
+        logging.fatal(msg + " in " + self.path)
+        sys.exit(1)
+
+    # read another chunk, discarding the part of the buffer that has already been decoded
+    def fill(self):
+        chunk = self.fh.read(self.chunk_size)
+        if chunk == "":
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    # skip whitespace and return the next character, or None at the end of the file
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE_REGEX.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return None
+            self.fill()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c is None or c not in chars:
+            self.fatal("expected one of '" + chars + "' but found " + ("end of file" if c is None else "'" + c + "'"))
+        self.pos += 1
+        return c
+
+    # decode the next JSON value. A value that ends at the end of the buffer may be incomplete (e.g.,
+    # a number) so more of the file is read before accepting it.
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    self.fatal("invalid JSON: " + str(e))
+            self.fill()
+
+# Iterate over the elements of the array stored under key in the top-level JSON object in path.
+def iter_json_array(path, key="data", chunk_size=CHUNK_SIZE):
+    with open(path, encoding='utf-8') as fh:
+        reader = JsonReader(path, fh, chunk_size)
+        reader.expect("{")
+        if reader.peek() == "}":
+            reader.fatal("no '" + key + "' array found")
+
+        while True:
+            name = reader.decode_value()
+            reader.expect(":")
+            if name != key:
+                # skip other members, e.g., metaData
+                reader.decode_value()
+            else:
+                reader.expect("[")
+                if reader.peek() == "]":
+                    return
+                while True:
+                    yield reader.decode_value()
+                    if reader.expect(",]") == "]":
+                        return
+            if reader.expect(",}") == "}":
+                reader.fatal("no '" + key + "' array found")
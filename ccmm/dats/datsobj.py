@@ -3,9 +3,9 @@
 from collections import OrderedDict
 import json
 import logging
+import os
 import re
 import sys
-import uuid
 
 # ------------------------------------------------------
 # Global variables
@@ -73,6 +73,65 @@ DATS_TYPES = {
 # DatsObj
 # ------------------------------------------------------
 
+# identifier URI schemes that are used as @ids
+# TODO - this only catches the handful of URI schemes used in the current encodings
+ID_URI_REGEX = re.compile(r'^(https?|s3|gs|ftp):')
+
+# JSON-LD @context of each DATS type that has one, computed on first use
+DATS_CONTEXTS = {}
+
+# Returns the @context list for dats_type, or None if it has no context.
+def get_dats_context(dats_type):
+    if dats_type not in DATS_CONTEXTS:
+        dt = DATS_TYPES[dats_type]
+        context = None
+        if dt['has_context']:
+            json_ld_file = dt['schema']
+            sdo_context_file = re.sub(r'_schema.json$', '_sdo_context.jsonld', json_ld_file)
+            sdo_json_ld_context =  JSON_LD_SDO_CONTEXT_URI_PREFIX + sdo_context_file
+            obo_foundry_context_file = re.sub(r'_schema.json$', '_obo_context.jsonld', json_ld_file)
+            obo_foundry_ld_context =  JSON_LD_OBO_FOUNDRY_CONTEXT_URI_PREFIX + obo_foundry_context_file 
+            context = [ sdo_json_ld_context, obo_foundry_ld_context ]
+        DATS_CONTEXTS[dats_type] = context
+    return DATS_CONTEXTS[dats_type]
+
+# Returns the identifier URI in atts (a list of (key, value)), if any, to use as the @id.
+def get_identifier_uri(atts):
+    id_uri = None
+    for att in atts:
+        (key, val) = att
+        if key == "identifier" and isinstance(val, DatsObj):
+            if val.get("@type") == "Identifier":
+                idval = val.get("identifier")
+                if ID_URI_REGEX.match(idval):
+                    id_uri = idval
+    return id_uri
+
+TMP_ID_PREFIX = "http://127.0.0.1/TMPID/"
+
+# number of random UUIDs to generate at once for temporary @ids
+TMP_ID_BATCH_SIZE = 4096
+
+# unused random bytes for temporary @ids, and the process they were generated in
+TMP_ID_STATE = { "bytes": b"", "offset": 0, "pid": None }
+
+# Returns a new temporary @id, equivalent to TMP_ID_PREFIX + str(uuid.uuid4()), but with the random
+# bytes read in batches. The batch is discarded after a fork so that processes never share ids.
+def get_tmp_id():
+    st = TMP_ID_STATE
+    offset = st['offset']
+    if offset >= len(st['bytes']) or st['pid'] != os.getpid():
+        st['bytes'] = os.urandom(16 * TMP_ID_BATCH_SIZE)
+        st['pid'] = os.getpid()
+        offset = 0
+    st['offset'] = offset + 16
+    # set the version (4) and variant (RFC 4122) bits, as in uuid.UUID
+    n = int.from_bytes(st['bytes'][offset:offset + 16], 'big')
+    n = (n & ~(0xc000 << 48)) | (0x8000 << 48)
+    n = (n & ~(0xf000 << 64)) | (4 << 76)
+    h = '%032x' % n
+    return TMP_ID_PREFIX + h[0:8] + '-' + h[8:12] + '-' + h[12:16] + '-' + h[16:20] + '-' + h[20:32]
+
 class DatsObj:
     data = None
 
@@ -82,36 +141,21 @@ class DatsObj:
             logging.fatal("Unknown DATS object type '" + dats_type + "'")
             sys.exit(1)
             
-        dt = DATS_TYPES[dats_type]
         dats_atts = [("@type", dats_type)]
 
         # @context
-        if dt['has_context']:
-            json_ld_file = dt['schema']
-            sdo_context_file = re.sub(r'_schema.json$', '_sdo_context.jsonld', json_ld_file)
-            sdo_json_ld_context =  JSON_LD_SDO_CONTEXT_URI_PREFIX + sdo_context_file
-            obo_foundry_context_file = re.sub(r'_schema.json$', '_obo_context.jsonld', json_ld_file)
-            obo_foundry_ld_context =  JSON_LD_OBO_FOUNDRY_CONTEXT_URI_PREFIX + obo_foundry_context_file 
-            dats_atts.append(("@context", [ sdo_json_ld_context, obo_foundry_ld_context ] ))
+        context = get_dats_context(dats_type)
+        if context is not None:
+            dats_atts.append(("@context", list(context)))
 
         # @id
-        # use identifier URI if one is specified
-        id_uri = None
-        for att in atts:
-            (key, val) = att
-            if key == "identifier" and isinstance(val, DatsObj):
-                if val.get("@type") == "Identifier":
-                    idval = val.get("identifier")
-                    # TODO - this only catches the handful of URI schemes used in the current encodings
-                    if re.match(r'^(https?|s3|gs|ftp):', idval):
-                        id_uri = idval
-
-        # assign random uuid if no id specified
+        # assign random uuid if no id specified, or use identifier URI if one is specified
         if id == "":
+            id_uri = get_identifier_uri(atts)
             if id_uri is not None:
                 id = id_uri
             else:
-                id = "http://127.0.0.1/TMPID/" + str(uuid.uuid4())
+                id = get_tmp_id()
 
         dats_atts.append(("@id", id))
         dats_atts.extend(atts)
@@ -171,4 +215,133 @@ class DatsObjCache:
         self.cache[obj_key] = new_obj
         return new_obj
 
-    
+    # return a dict mapping each key in the cache to the @id of its object
+    def get_ids(self):
+        return dict([(k, self.cache[k].data["@id"]) for k in self.cache])
+
+# ------------------------------------------------------
+# TieredDatsObjCache
+# ------------------------------------------------------
+
+# cache key prefixes of study-independent objects, which can be shared by all the studies in an instance
+GLOBAL_CACHE_KEY_PREFIXES = ("Annotation.", "TaxonomicInformation.", "DataStandard:", "Organization:", "DataType.", "AnatomicalPart:")
+
+# DatsObjCache with two tiers. Objects whose keys start with one of global_prefixes are looked up in
+# global_cache, which may be shared by several TieredDatsObjCaches (e.g., one per study), so that
+# each of them is written in full only once per instance. All other objects (e.g., subjects and
+# samples) are looked up in the local tier, which behaves like a standalone DatsObjCache. global_cache
+# may be a DatsObjCache or a DatsObjCacheShard.
+class TieredDatsObjCache(DatsObjCache):
+    global_cache = None
+    global_prefixes = None
+    # global keys used through this cache, in order of first use
+    global_keys_used = None
+    global_keys_used_d = None
+
+    def __init__(self, global_cache, global_prefixes=GLOBAL_CACHE_KEY_PREFIXES):
+        DatsObjCache.__init__(self)
+        self.global_cache = global_cache
+        self.global_prefixes = tuple(global_prefixes)
+        self.global_keys_used = []
+        self.global_keys_used_d = {}
+
+    def get_obj_or_ref(self, obj_key, obj_fn):
+        if obj_key.startswith(self.global_prefixes):
+            if obj_key not in self.global_keys_used_d:
+                self.global_keys_used_d[obj_key] = True
+                self.global_keys_used.append(obj_key)
+            return self.global_cache.get_obj_or_ref(obj_key, obj_fn)
+        return DatsObjCache.get_obj_or_ref(self, obj_key, obj_fn)
+
+# Estimate the number of bytes saved by sharing the objects in global_cache (a DatsObjCache) rather
+# than writing each of them in full once per TieredDatsObjCache, given the global_keys_used of each
+# of the TieredDatsObjCaches. Sizes are those of the compact JSON encoding, so the savings in
+# indented output are somewhat larger.
+def get_shared_bytes_saved(global_cache, global_keys_used_lists):
+    n_users = {}
+    for keys in global_keys_used_lists:
+        for k in keys:
+            n_users[k] = n_users.get(k, 0) + 1
+
+    n_saved = 0
+    for k in n_users:
+        if n_users[k] < 2 or k not in global_cache.cache:
+            continue
+        obj = global_cache.cache[k]
+        full_size = len(json.dumps(obj, cls=DATSEncoder))
+        ref_size = len(json.dumps(obj.getIdRef()))
+        n_saved += (n_users[k] - 1) * (full_size - ref_size)
+    return n_saved
+
+# ------------------------------------------------------
+# DatsObjCacheShard
+# ------------------------------------------------------
+
+# Stand-in for DatsObjCache in a worker process that builds part of an instance. It is seeded with
+# the keys and @ids of the parent cache: keys already in the parent always yield id references, and
+# new keys behave as in DatsObjCache (full object on first use, id reference thereafter.) New keys
+# are recorded in order of first use so that merge_cache_shards can reconcile them with the parent.
+# A single id reference dict is handed out per key so that it can be rewritten during the merge.
+class DatsObjCacheShard:
+    parent_ids = None
+    cache = None
+    refs = None
+    new_keys = None
+
+    def __init__(self, parent_ids):
+        self.parent_ids = parent_ids
+        self.cache = {}
+        self.refs = {}
+        self.new_keys = []
+
+    def get_obj_or_ref(self, obj_key, obj_fn):
+        if obj_key in self.refs:
+            return self.refs[obj_key]
+        if obj_key in self.parent_ids:
+            ref = { "@id": self.parent_ids[obj_key] }
+            self.refs[obj_key] = ref
+            return ref
+        new_obj = obj_fn()
+        self.cache[obj_key] = new_obj
+        self.refs[obj_key] = new_obj.getIdRef()
+        self.new_keys.append(obj_key)
+        return new_obj
+
+# Merge cache shards into the parent DatsObjCache cache. Shards must be given in the order in which
+# their objects appear in the output. The first shard to create an object for a given key provides
+# the object used by the parent; copies created by later shards are reduced to id references to it
+# in place, and the id references that those shards handed out for the key are updated to match.
+# The result is the same as if every object had been built serially with the parent cache.
+def merge_cache_shards(cache, shards):
+    n_merged = 0
+    for shard in shards:
+        for key in shard.new_keys:
+            obj = shard.cache[key]
+            if key in cache.cache:
+                canonical_id = cache.cache[key].data["@id"]
+                obj.data = OrderedDict([("@id", canonical_id)])
+                shard.refs[key]["@id"] = canonical_id
+                n_merged += 1
+            else:
+                cache.cache[key] = obj
+    logging.debug("merged " + str(len(shards)) + " cache shard(s), replaced " + str(n_merged) + " duplicate object(s) with id references")
+
+# ------------------------------------------------------
+# DATS JSON input
+# ------------------------------------------------------
+
+# json object_pairs_hook that turns each JSON object with a known DATS @type and an @id back into a
+# DatsObj, keeping its original @id and @context. Id references and untyped objects are left as dicts.
+def dats_object_pairs_hook(pairs):
+    d = OrderedDict(pairs)
+    dats_type = d.get("@type")
+    if isinstance(dats_type, str) and dats_type in DATS_TYPES and "@id" in d:
+        obj = DatsObj.__new__(DatsObj)
+        obj.data = d
+        return obj
+    return d
+
+# Read a DATS JSON file written with DATSEncoder.
+def read_dats_json(path):
+    with open(path) as fh:
+        return json.load(fh, object_pairs_hook=dats_object_pairs_hook)
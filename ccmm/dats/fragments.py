@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Temporary on-disk storage for completed parts of a DATS instance.
+#
+# Large instances (e.g., multi-study TOPMed builds) can be written without holding every part in
+# memory: each part is serialized to a fragment file as soon as it is complete and replaced in the
+# instance by a placeholder string. write_json() then writes the instance, streaming each fragment
+# into the place of its placeholder, and produces exactly the same bytes as
+#
+#   json.dumps(obj, indent=2, cls=DATSEncoder)
+#
+# would have for the original instance.
+#
+# Worker processes can also serialize the parts they build directly to fragments (see spill_shard),
+# so that only the fragment names, rather than the DatsObjs themselves, are returned to the parent.
+# Each object created by the worker's DatsObjCacheShard is written to a fragment of its own, and
+# merge_shard decides, in output order, whether it appears in full or as an id reference, as
+# ccmm.dats.datsobj.merge_cache_shards does for DatsObjs.
+
+from ccmm.dats.datsobj import DatsObj, DATSEncoder
+from collections import OrderedDict
+import binascii
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+JSON_INDENT = 2
+
+# an "@id" attribute on a line of its own
+ID_LINE_REGEX = re.compile(r'^(\s*"@id": ")((?:[^"\\]|\\.)*)(".*)$')
+
+# ------------------------------------------------------
+# DatsFragmentStore
+# ------------------------------------------------------
+
+class DatsFragmentStore:
+    dir_path = None
+    # random token that makes the placeholders for this store unique
+    token = None
+    placeholder_regex = None
+    n_fragments = None
+    # fragment name -> @id of the object to write in place of the fragment, for shard objects that
+    # were created by an earlier part of the instance
+    ref_fragments = None
+    # @id of a shard object -> @id of the object that replaces it
+    id_map = None
+
+    # Fragments are written to a new temporary directory in parent_dir, or in the default temporary
+    # directory if parent_dir is None.
+    def __init__(self, parent_dir):
+        self.dir_path = tempfile.mkdtemp(prefix="dats-fragments-", dir=parent_dir)
+        self.token = binascii.hexlify(os.urandom(8)).decode('ascii')
+        # placeholder on a line of its own, either as a list element or as the value of a key
+        self.placeholder_regex = re.compile(r'^(\s*)((?:"(?:[^"\\]|\\.)*": )?)"@@DATS_FRAGMENT:' + self.token + r':([\w\.\-]+)@@"(,?)$')
+        self.n_fragments = 0
+        self.ref_fragments = {}
+        self.id_map = {}
+
+    def get_path(self, name):
+        return os.path.join(self.dir_path, "fragment-" + name + ".json")
+
+    def get_placeholder(self, name):
+        return "@@DATS_FRAGMENT:" + self.token + ":" + name + "@@"
+
+    def write_fragment_file(self, name, obj, placeholders=None):
+        path = self.get_path(name)
+        with open(path, mode="w") as fh:
+            if placeholders is None:
+                json.dump(obj, fh, indent=JSON_INDENT, cls=DATSEncoder)
+            else:
+                json.dump(obj, fh, indent=JSON_INDENT, cls=PlaceholderEncoder, placeholders=placeholders, root=obj)
+        logging.debug("wrote fragment " + name + " (" + str(os.path.getsize(path)) + " bytes) to " + path)
+
+    # Serialize obj to a new fragment and return the placeholder that should replace it in the instance.
+    def spill(self, obj):
+        name = str(self.n_fragments)
+        self.n_fragments += 1
+        self.write_fragment_file(name, obj)
+        logging.info("wrote fragment " + name + " to " + self.get_path(name))
+        return self.get_placeholder(name)
+
+    # Serialize obj, which was built in a worker process using DatsObjCacheShard shard, to a new
+    # fragment called name. Each object that the shard created is written to its own fragment, so
+    # name must be unique across all the workers. Returns (placeholder for obj, list of (cache key,
+    # @id, fragment name) for the shard's objects), the latter to be passed to merge_shard.
+    def spill_shard(self, name, obj, shard):
+        shard_objs = []
+        placeholders = {}
+        for (i, key) in enumerate(shard.new_keys):
+            o = shard.cache[key]
+            o_name = name + "." + str(i)
+            placeholders[id(o)] = self.get_placeholder(o_name)
+            shard_objs.append((key, o.get("@id"), o_name))
+        for (key, o_id, o_name) in shard_objs:
+            self.write_fragment_file(o_name, shard.cache[key], placeholders)
+        self.write_fragment_file(name, obj, placeholders)
+        return (self.get_placeholder(name), shard_objs)
+
+    # Reconcile the objects created by a worker's cache shard, as returned by spill_shard, with the
+    # parent DatsObjCache cache. Shards must be merged in the order in which they appear in the
+    # output. The first shard to create an object for a given key provides the object that is
+    # written in full; later copies are written as id references to it.
+    def merge_shard(self, cache, shard_objs):
+        n_merged = 0
+        for (key, o_id, o_name) in shard_objs:
+            if key in cache.cache:
+                canonical_id = cache.cache[key].data["@id"]
+                self.ref_fragments[o_name] = canonical_id
+                if o_id != canonical_id:
+                    self.id_map[o_id] = canonical_id
+                n_merged += 1
+            else:
+                # the parent only needs the @id
+                obj = DatsObj.__new__(DatsObj)
+                obj.data = OrderedDict([("@id", o_id)])
+                cache.cache[key] = obj
+        logging.debug("merged " + str(len(shard_objs)) + " shard object(s), replaced " + str(n_merged) + " duplicate object(s) with id references")
+
+    # Write obj as DATS JSON to fh, replacing each placeholder with the corresponding fragment.
+    def write_json(self, obj, fh):
+        skeleton = json.dumps(obj, indent=JSON_INDENT, cls=DATSEncoder)
+        # JSON strings can't contain raw newlines, so every placeholder is matched on a single line
+        self.write_lines(skeleton.split("\n"), "", "", fh)
+
+    # Write lines of JSON to fh, the first prefixed with first_prefix and the rest with indent,
+    # replacing placeholders with the corresponding fragments.
+    def write_lines(self, lines, first_prefix, indent, fh):
+        first_line = True
+        for line in lines:
+            fh.write(first_prefix if first_line else "\n" + indent)
+            first_line = False
+            line = line.rstrip("\n")
+            if len(self.id_map) > 0:
+                line = self.map_ids(line)
+            m = self.placeholder_regex.match(line)
+            if m is None:
+                fh.write(line)
+                continue
+            (p_indent, p_key, name, comma) = m.groups()
+            self.write_lines(self.get_fragment_lines(name), p_indent + p_key, indent + p_indent, fh)
+            fh.write(comma)
+
+    def get_fragment_lines(self, name):
+        if name in self.ref_fragments:
+            return json.dumps({ "@id": self.ref_fragments[name] }, indent=JSON_INDENT).split("\n")
+        return iter_file_lines(self.get_path(name))
+
+    # replace a shard object's @id with that of the object that replaced it
+    def map_ids(self, line):
+        m = ID_LINE_REGEX.match(line)
+        if m is None or m.group(2) not in self.id_map:
+            return line
+        return m.group(1) + self.id_map[m.group(2)] + m.group(3)
+
+    # Remove the fragment directory.
+    def cleanup(self):
+        n_files = len(os.listdir(self.dir_path))
+        shutil.rmtree(self.dir_path)
+        logging.info("removed " + str(n_files) + " fragment(s) from " + self.dir_path)
+
+# ------------------------------------------------------
+# Utility functions
+# ------------------------------------------------------
+
+# DATSEncoder that writes a placeholder in place of each DatsObj in placeholders (a dict keyed by
+# the id() of the object) except for root, the object being serialized.
+class PlaceholderEncoder(DATSEncoder):
+    placeholders = None
+    root = None
+
+    def __init__(self, placeholders=None, root=None, **kw):
+        DATSEncoder.__init__(self, **kw)
+        self.placeholders = placeholders
+        self.root = root
+
+    def default(self, o):
+        if o is not self.root and id(o) in self.placeholders:
+            return self.placeholders[id(o)]
+        return DATSEncoder.default(self, o)
+
+def iter_file_lines(path):
+    with open(path) as fh:
+        for line in fh:
+            yield line
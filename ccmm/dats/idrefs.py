@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Utilities for finding and resolving JSON-LD id references (see DatsObj.getIdRef) in trees of DatsObjs.
+#
+# DatsObjCache embeds each cached object in full the first time it is used and as an id reference
+# thereafter, so any part of an instance that is written to a separate file may contain references
+# to objects that are defined elsewhere. The functions below can be used to temporarily replace
+# such references with the objects themselves before serializing the part.
+
+from ccmm.dats.datsobj import DatsObj
+import logging
+
+# ------------------------------------------------------
+# id references
+# ------------------------------------------------------
+
+# whether o is an id reference of the form returned by DatsObj.getIdRef(), or a DatsObj that has
+# been reduced to one by ccmm.dats.datsobj.merge_cache_shards
+def is_id_ref(o):
+    if isinstance(o, DatsObj):
+        o = o.data
+    return isinstance(o, dict) and len(o) == 1 and "@id" in o
+
+# returns (container, list of (key, value)) for a DatsObj, dict or list, or (None, None)
+def get_items(o):
+    if isinstance(o, DatsObj):
+        return (o.data, list(o.data.items()))
+    if isinstance(o, dict):
+        return (o, list(o.items()))
+    if isinstance(o, list):
+        return (o, list(enumerate(o)))
+    return (None, None)
+
+# Index every DatsObj in root (which may be a DatsObj, dict or list) by @id. Where several
+# distinct objects share an @id the first one found is kept.
+def index_objs(root, id_to_obj=None):
+    if id_to_obj is None:
+        id_to_obj = {}
+    seen = {}
+    stack = [root]
+
+    while len(stack) > 0:
+        o = stack.pop()
+        if isinstance(o, DatsObj):
+            if id(o) in seen or is_id_ref(o):
+                continue
+            seen[id(o)] = True
+            oid = o.data["@id"]
+            if oid not in id_to_obj:
+                id_to_obj[oid] = o
+            stack.extend(o.data.values())
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, list):
+            stack.extend(o)
+
+    return id_to_obj
+
+# Replace each id reference in root that can't be resolved within root itself or to one of the
+# ids in available with the referenced object from id_to_obj. Only the first such reference to
+# each object is replaced; the rest are left as references. Replacements are made in place and
+# are returned so that they can be undone with restore_id_refs.
+def inline_missing_id_refs(root, id_to_obj, available):
+    avail = dict([(k, True) for k in available])
+    for k in index_objs(root):
+        avail[k] = True
+
+    swaps = []
+    n_unresolved = 0
+    seen = {}
+    stack = [root]
+
+    while len(stack) > 0:
+        o = stack.pop()
+        if isinstance(o, DatsObj):
+            if id(o) in seen:
+                continue
+            seen[id(o)] = True
+        (container, items) = get_items(o)
+        if container is None:
+            continue
+
+        for (k, v) in items:
+            if not is_id_ref(v):
+                stack.append(v)
+                continue
+            ref_id = v.data["@id"] if isinstance(v, DatsObj) else v["@id"]
+            if ref_id in avail:
+                continue
+            if ref_id not in id_to_obj:
+                n_unresolved += 1
+                logging.debug("unable to resolve id reference " + ref_id)
+                continue
+            obj = id_to_obj[ref_id]
+            container[k] = obj
+            swaps.append((container, k, v))
+            for i in index_objs(obj):
+                avail[i] = True
+            stack.append(obj)
+
+    if n_unresolved > 0:
+        logging.warn("unable to resolve " + str(n_unresolved) + " id reference(s)")
+
+    return swaps
+
+# undo the replacements made by inline_missing_id_refs
+def restore_id_refs(swaps):
+    for (container, k, v) in reversed(swaps):
+        container[k] = v
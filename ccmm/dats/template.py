@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# Templates for DATS subtrees that are created once per record with only a few values changed, e.g.,
+# the Dataset, DatasetDistribution, and Access objects created for each file in a manifest.
+#
+# A template is written like the corresponding DatsObj constructor calls, but with TemplateObj in
+# place of DatsObj and with a Slot in place of each value that differs between records:
+#
+#   ACCESS_TEMPLATE = DatsTemplate(TemplateObj("Access", [ ("accessURL", Slot("url")) ]))
+#   access = ACCESS_TEMPLATE.fill({ "url": gs_uri })
+#
+# Compiling a template does the per-type work of the DatsObj constructor (type checking, @context
+# lookup, and finding the attributes that can supply an identifier URI @id) once, so that filling
+# it only has to copy values and assign @ids. fill() returns the same tree of DatsObjs that the
+# constructor calls would: every TemplateObj becomes a new DatsObj, lists and dicts are copied, and
+# any DatsObj in the template (e.g., a shared DataStandard) is used as-is.
+
+from ccmm.dats.datsobj import DatsObj, DATS_TYPES, ID_URI_REGEX, get_dats_context, get_identifier_uri, get_tmp_id
+from collections import OrderedDict
+import logging
+import sys
+
+# ------------------------------------------------------
+# Template description
+# ------------------------------------------------------
+
+# placeholder for a value that is supplied when the template is filled
+class Slot:
+    name = None
+
+    def __init__(self, name):
+        self.name = name
+
+# placeholder for a DatsObj that is created each time the template is filled
+class TemplateObj:
+    dats_type = None
+    atts = None
+    id = None
+
+    def __init__(self, dats_type, atts = [], id = ""):
+        self.dats_type = dats_type
+        self.atts = atts
+        self.id = id
+
+# ------------------------------------------------------
+# DatsTemplate
+# ------------------------------------------------------
+
+# A template compiled to a Python function that builds the entire tree with a single call, e.g.,
+#
+#   def fill(values):
+#       v1 = values['doi']
+#       o2 = new_dats_obj(OrderedDict([("@type", 'Identifier'), ("@context", list(K[0])), ("@id", get_tmp_id()), ("identifier", v1)]))
+#       o3 = new_dats_obj(OrderedDict([("@type", 'DatasetDistribution'), ..., ("@id", get_identifier_id(o2)), ("identifier", o2), ...]))
+#       return o3
+#
+class DatsTemplate:
+    slot_names = None
+    # constants referenced by the generated code
+    consts = None
+    # generated statements
+    lines = None
+    n_vars = None
+    source = None
+    fill_fn = None
+
+    def __init__(self, template):
+        self.slot_names = {}
+        self.consts = []
+        self.lines = []
+        self.n_vars = 0
+        root = self.compile(template)
+        self.source = "def fill(values):\n" + "".join(["    " + l + "\n" for l in self.lines]) + "    return " + root + "\n"
+        namespace = { "K": self.consts, "OrderedDict": OrderedDict, "new_dats_obj": new_dats_obj, "get_tmp_id": get_tmp_id, "get_identifier_id": get_identifier_id, "get_uri_id": get_uri_id }
+        exec(compile(self.source, "<DatsTemplate>", "exec"), namespace)
+        self.fill_fn = namespace['fill']
+
+    def new_var(self, prefix, expr):
+        self.n_vars += 1
+        var = prefix + str(self.n_vars)
+        self.lines.append(var + " = " + expr)
+        return var
+
+    def const(self, value):
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return repr(value)
+        self.consts.append(value)
+        return "K[" + str(len(self.consts) - 1) + "]"
+
+    # Compile a template value into an expression that evaluates to a new instance of the value,
+    # adding statements to self.lines as needed.
+    def compile(self, value):
+        if isinstance(value, Slot):
+            self.slot_names[value.name] = True
+            return "values[" + repr(value.name) + "]"
+        if isinstance(value, TemplateObj):
+            if value.dats_type not in DATS_TYPES:
+                logging.fatal("Unknown DATS object type '" + value.dats_type + "'")
+                sys.exit(1)
+            atts = []
+            id_expr = None if value.id == "" else repr(value.id)
+            for (k, v) in value.atts:
+                expr = self.compile(v)
+                # as in DatsObj, the @id may come from an Identifier
+                if k == "identifier" and value.id == "":
+                    if isinstance(v, TemplateObj) and v.dats_type == "Identifier":
+                        id_val = self.compile_identifier_value(v)
+                        if id_val is not None:
+                            id_expr = "get_uri_id(" + id_val + ")"
+                    elif isinstance(v, Slot) or isinstance(v, DatsObj):
+                        expr = self.new_var("v", expr)
+                        id_expr = "get_identifier_id(" + expr + ")"
+                atts.append("(" + repr(k) + ", " + expr + ")")
+            if id_expr is None:
+                id_expr = "get_tmp_id()"
+
+            dats_atts = ["(\"@type\", " + repr(value.dats_type) + ")"]
+            context = get_dats_context(value.dats_type)
+            if context is not None:
+                dats_atts.append("(\"@context\", list(" + self.const(context) + "))")
+            dats_atts.append("(\"@id\", " + id_expr + ")")
+            dats_atts.extend(atts)
+            return self.new_var("o", "new_dats_obj(OrderedDict([" + ", ".join(dats_atts) + "]))")
+        if isinstance(value, list):
+            return "[" + ", ".join([self.compile(v) for v in value]) + "]"
+        if isinstance(value, dict):
+            return "{" + ", ".join([repr(k) + ": " + self.compile(v) for (k, v) in value.items()]) + "}"
+        return self.const(value)
+
+    # Returns an expression for the "identifier" value of an Identifier TemplateObj, which must
+    # already have been compiled, or None if it has none.
+    def compile_identifier_value(self, identifier):
+        for (k, v) in identifier.atts:
+            if k == "identifier":
+                if isinstance(v, Slot):
+                    return "values[" + repr(v.name) + "]"
+                return self.const(v)
+        return None
+
+    # Returns a new instance of the template, with each Slot replaced by the corresponding entry in values.
+    def fill(self, values):
+        try:
+            return self.fill_fn(values)
+        except KeyError:
+            missing = [n for n in self.slot_names if n not in values]
+            if len(missing) == 0:
+                raise
+            logging.fatal("no value given for template slot(s) " + ",".join(missing))
+            sys.exit(1)
+
+# equivalent to DatsObj(dats_type, atts, id) for data that already includes @type, @context, and @id
+def new_dats_obj(data):
+    obj = DatsObj.__new__(DatsObj)
+    obj.data = data
+    return obj
+
+# Returns the @id to use for an object whose "identifier" attribute is an Identifier with value idval.
+def get_uri_id(idval):
+    if ID_URI_REGEX.match(idval):
+        return idval
+    return get_tmp_id()
+
+# Returns the @id to use for an object whose "identifier" attribute is identifier.
+def get_identifier_id(identifier):
+    id_uri = get_identifier_uri([("identifier", identifier)])
+    if id_uri is None:
+        return get_tmp_id()
+    return id_uri
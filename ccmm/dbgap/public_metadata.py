@@ -6,39 +6,20 @@ import re
 import sys
 import xml.etree.ElementTree as ET
 from ccmm.dats.datsobj import DatsObj
+import ccmm.dbgap.study_files as study_files
+import ccmm.dbgap.var_stats as var_stats
 import ccmm.util as util
 
 # ------------------------------------------------------
 # Global variables
 # ------------------------------------------------------
 
-# list of permitted file types
-FILE_TYPES = [
-    'Subject',
-    'Sample',
-    'Sample_Attributes',
-    'Subject_Phenotypes',
-    'Subject_Images'
-]
-
-FILE_TYPES_RE = '|'.join(FILE_TYPES)
-
-# list of permitted metadata types
-METADATA_TYPES = [
-    'data_dict',
-    'var_report',
-    'MULTI',
-    # TODO - handle use codes separately and ensure all combinations are handled:
-    'DS-CS-RD',
-    'DS-LD',
-    'GRU',
-    'HMB',
-    'DS-LD-RD',
-    ''
-]
-
-METADATA_TYPES_RE = '|'.join(METADATA_TYPES)
- 
+# permitted file and metadata types
+FILE_TYPES = study_files.FILE_TYPES
+FILE_TYPES_RE = study_files.FILE_TYPES_RE
+METADATA_TYPES = study_files.METADATA_TYPES
+METADATA_TYPES_RE = study_files.METADATA_TYPES_RE
+
 # expected attribute values for the <stat> element
 STAT_ATTRIBS = {
     "n": True,
@@ -232,44 +213,15 @@ def read_dbgap_data_dict_or_var_report_xml(xml_file):
 
 # Find all dbGaP XML or .txt metadata files in a given directory.
 def get_study_metadata_files(dir, suffix):
-    filenames = os.listdir(dir)
-    files = []
-
-    for f in filenames:
-        # ignore anything that doesn't start with a study id and end with suffix
-        if re.match(r'^phs\d+\..*\.' + suffix + '$', f):
-            # list of possible file types (Subject, Sample, etc.) may vary from study to study
-            # phsXXXXXX - study accession
-            # phtXXXXXX - phenotype trait table accession
-            # v = data version, p = participant set version, c = consent group version
-            m = re.match(r'^(phs\d+\.v\d+)\.(pht\d+\.v\d+)(\.p\d+)?\.(\S+)_(' + FILE_TYPES_RE + ').(' + METADATA_TYPES_RE + ')\.' + suffix + '$', f)
-            if m is None:
-                logging.fatal("unable to parse file type and study name from dbGaP file " + f)
-                sys.exit(1)
-
-            file = {
-                "name": f, 
-                "path": os.path.join(dir, f), 
-                "study_id": m.group(1), 
-                "phenotype_id": m.group(2), 
-                "participant_set_version": m.group(3),
-                "study_name": m.group(4), 
-                "metadata_type": m.group(5), 
-                "file_type": m.group(6) 
-                }
-
-            files.append(file)
-
-        else:
-            logging.debug("ignoring metadata file " + f)
-
-    return util.make_multilevel_dict(files, ["study_id", "study_name", "metadata_type", "file_type"])
+    catalog = study_files.find_study_metadata_files(dir, suffix)
+    return catalog.get_multilevel_dict()
 
 # Read all dbGaP XML metadata files in a given directory and read and parse their contents.
 def read_study_metadata(dir):
     study_md = {}
-    study_files = get_study_metadata_files(dir, "xml")
-    n_studies = len(study_files)
+    catalog = study_files.find_study_metadata_files(dir, "xml")
+    study_ids = catalog.get_study_ids()
+    n_studies = len(study_ids)
     study_str = 'study'
     if n_studies > 1:
         study_str = 'studies'
@@ -278,15 +230,15 @@ def read_study_metadata(dir):
     # identify sub-studies
     # heuristic: studies with no data_dict files will be treated as sub-studies
     n_not_substudy = 0
+    substudy_ids = {}
     substudy_names = {}
-    for study_id in study_files:
-        sd = study_files[study_id]
-        if util.multilevel_dict_key_exists(sd, 'data_dict'):
+    for study_id in study_ids:
+        if catalog.has_key('file_type', 'data_dict', study_id):
             n_not_substudy += 1
         else:
-            sd['_is_substudy'] = 1
+            substudy_ids[study_id] = True
             # substudies should have only a single study name
-            ss_names = [x for x in sd.keys() if not x.startswith('_')]
+            ss_names = catalog.get_keys(study_id)
             n_ss_names = len(ss_names)
             if n_ss_names != 1:
                 logging.fatal("Sub-study " + study_id + " maps to " + str(n_ss_names) + " substudy names: " + ",".join(ss_names))
@@ -299,33 +251,30 @@ def read_study_metadata(dir):
         sys.exit(1)
 
     # process one study at a time
-    for study_id in study_files:
+    for study_id in study_ids:
+        if study_id in substudy_ids:
+            continue
 
         # find file data for parent study
-        sd = None
-
-        study = study_files[study_id]
-        if '_is_substudy' in study:
-            continue
+        sd_name = None
 
-        for study_name in study:
-            if study_name.startswith('_'):
-                continue
+        for study_name in catalog.get_keys(study_id):
             if study_name in substudy_names:
                 logging.info("skipping sub-study " + study_name)
                 continue
-            if sd is not None:
+            if sd_name is not None:
                 logging.fatal("found multiple top-level studies under " + study_id)
                 sys.exit(1)
-            sd = study[study_name]
+            sd_name = study_name
 
-        if sd is None:
+        if sd_name is None:
             logging.fatal("failed to find any top-level study under " + study_id)
             sys.exit(1)
 
+        study_name = sd_name
         logging.info("processing metadata for study " + study_id + " | " + study_name)
 
-        md = { 'files': sd }
+        md = { 'files': catalog.get_subtree(study_id, study_name) }
         study_md[study_id] = md
         
         # each study may have a data_dict and var_report for each of the following:
@@ -333,21 +282,71 @@ def read_study_metadata(dir):
             for filetype in ('data_dict', 'var_report'):
 
                 # Subject_Phenotypes is not always present
-                if datatype not in sd:
+                if not catalog.has_path(study_id, study_name, datatype):
                     logging.info("no XML found for " + datatype + "." + filetype)
                     continue
 
                 if datatype not in md:
                     md[datatype] = {}
 
-                file_path = sd[datatype][filetype]['path']
+                file = catalog.get_file(study_id, study_name, datatype, filetype)
+                if file is None:
+                    logging.fatal("no " + filetype + " XML found for " + study_id + " " + datatype)
+                    sys.exit(1)
+                file_path = file['path']
                 logging.debug("parsing metadata file " + file_path)
 
                 xml_data = read_dbgap_data_dict_or_var_report_xml(file_path)
                 md[datatype][filetype] = { 'file': file_path, 'data': xml_data }
 
+                # numeric summary statistics for each variable
+                if filetype == 'var_report':
+                    md[datatype][filetype]['stats'] = var_stats.VarReportStats(xml_data['vars'])
+
     return study_md
 
+# Add var to the lookup tables returned by add_study_vars and index_study_vars.
+def add_var_to_lookups(id_to_var, vdict, var_type, var, dim):
+    var_name = var['name']
+
+    # track dbGaP variable Dimension and variable report by dbGaP id
+    if var['id'] in id_to_var:
+        logging.fatal("duplicate definition found for dbGaP variable " + var_name + " with accession=" + var['id'])
+        sys.exit(1)
+
+    t ={"dim": dim, "var": var}
+    id_to_var[var['id']] = t
+
+    # track by name and consent group
+    m = re.match(r'^(.*)(\.(c\d+))$', var['id'])
+
+    if m is None:
+        suffix = ""
+    else:
+        suffix = "." + m.group(3)
+
+    key = "".join([var_name, suffix])
+    if key in vdict:
+        logging.fatal("duplicate definition found for dbGaP variable " + key + " in " + var_type + " file")
+    vdict[key] = t
+
+# Returns a CategoryValuesPair for each summary statistic in the var_report for the data dictionary
+# variable with id var_id.
+#
+# stats - VarReportStats for the var_report, or None if there is no var_report
+def get_var_stats_properties(stats, var_id):
+    if stats is None:
+        return []
+    pos = stats.get_data_dict_pos(var_id)
+    if pos is None:
+        return []
+    props = []
+    for s in var_stats.DIMENSION_STATS:
+        value = stats.get_stat_at(pos, s)
+        if value is not None:
+            props.append(DatsObj("CategoryValuesPair", [("category", s), ("values", [ var_stats.get_number(value) ])]))
+    return props
+
 # Record study variables as dimensions of the study/Dataset.
 def add_study_vars(study, study_md):
     
@@ -360,6 +359,9 @@ def add_study_vars(study, study_md):
         if var_type in study_md:
             var_data = study_md[var_type]['data_dict']['data']
             vars = var_data['vars']
+            stats = None
+            if 'var_report' in study_md[var_type]:
+                stats = study_md[var_type]['var_report']['stats']
             vdict = {}
             type_name_cg_to_var[var_type] = vdict
 
@@ -373,30 +375,42 @@ def add_study_vars(study, study_md):
                     ("identifier", id),
                     ("name", DatsObj("Annotation", [("value", var_name)])),
                     ("description", var['description'])
-                    # TODO: include stats
                 ])  
 
+                extra_props = get_var_stats_properties(stats, var['id'])
+                if len(extra_props) > 0:
+                    dim.set("extraProperties", extra_props)
+
                 study.getProperty("dimensions").append(dim)
-            
-                # track dbGaP variable Dimension and variable report by dbGaP id
-                if var['id'] in id_to_var:
-                    logging.fatal("duplicate definition found for dbGaP variable " + var_name + " with accession=" + var['id'])
-                    sys.exit(1)
+                add_var_to_lookups(id_to_var, vdict, var_type, var, dim)
 
-                t ={"dim": dim, "var": var}
-                id_to_var[var['id']] = t
-                
-                # track by name and consent group
-                m = re.match(r'^(.*)(\.(c\d+))$', var['id'])
-        
-                if m is None:
-                    suffix = ""
-                else:
-                    suffix = "." + m.group(3)
+    return { "id_to_var": id_to_var, "type_name_cg_to_var": type_name_cg_to_var }
 
-                key = "".join([var_name, suffix])
-                if key in vdict:
-                    logging.fatal("duplicate definition found for dbGaP variable " + key + " in " + var_type + " file")
-                vdict[key] = t
+# Rebuild the lookup tables returned by add_study_vars for a study whose variable Dimensions were
+# created by add_study_vars and have since been written out and read back in (see
+# ccmm.dats.datsobj.read_dats_json.) Dimensions are matched to variables by dbGaP id.
+def index_study_vars(study, study_md):
+    id_to_dim = {}
+    for dim in study.getProperty("dimensions"):
+        if not isinstance(dim, DatsObj) or not dim.hasProperty("identifier"):
+            continue
+        id = dim.get("identifier")
+        if isinstance(id, DatsObj) and id.get("identifierSource") == "dbGaP":
+            id_to_dim[id.get("identifier")] = dim
+
+    id_to_var = {}
+    type_name_cg_to_var = {}
+
+    for var_type in ('Subject', 'Subject_Phenotypes', 'Sample', 'Sample_Attributes'):
+        if var_type in study_md:
+            vars = study_md[var_type]['data_dict']['data']['vars']
+            vdict = {}
+            type_name_cg_to_var[var_type] = vdict
+
+            for var in vars:
+                if var['id'] not in id_to_dim:
+                    logging.fatal("no Dimension found for dbGaP variable " + var['name'] + " with accession=" + var['id'])
+                    sys.exit(1)
+                add_var_to_lookups(id_to_var, vdict, var_type, var, id_to_dim[var['id']])
 
     return { "id_to_var": id_to_var, "type_name_cg_to_var": type_name_cg_to_var }
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import ccmm.dbgap.public_metadata
+import ccmm.dbgap.study_files
 import csv
 import logging
 import os 
@@ -54,26 +54,24 @@ def read_dbgap_restricted_metadata_txt(txt_file):
 
 def read_study_metadata(dir):
     study_md = {}
-    fileype = []
-    study_files = ccmm.dbgap.public_metadata.get_study_metadata_files(dir, "txt")
+    catalog = ccmm.dbgap.study_files.find_study_metadata_files(dir, "txt")
+    study_ids = catalog.get_study_ids()
 
-    n_studies = len(study_files)
+    n_studies = len(study_ids)
     logging.info("found restricted metadata file(s) for " + str(n_studies) + " study/studies in " + dir)
 
     # process one study at a time
-    for study_id in study_files:
+    for study_id in study_ids:
         logging.info("processing restricted metadata for study " + study_id)
-        sd = study_files[study_id]
         md = { 'files': {} }
         study_md[study_id] = md
 
         # study_name may include a consent group prefix
         # TODO - ignoring consent group in this iteration
-        for study_name in sd:
-            ssd = sd[study_name]
+        for study_name in catalog.get_keys(study_id):
         
             for datatype in ('Subject', 'Sample', 'Sample_Attributes', 'Subject_Phenotypes'):
-                if datatype not in ssd:
+                if not catalog.has_path(study_id, study_name, datatype):
                     logging.info("no XML found for " + datatype)
                     continue
 
@@ -83,11 +81,31 @@ def read_study_metadata(dir):
                     continue
 
                 # consent_type e.g., MULTI, HMB
-                consent_type = list(ssd[datatype].keys())[0]
-                file_path = ssd[datatype][consent_type]['path']
+                consent_type = catalog.get_keys(study_id, study_name, datatype)[0]
+                file_path = catalog.get_file(study_id, study_name, datatype, consent_type)['path']
                 txt_data = read_dbgap_restricted_metadata_txt(file_path)
                 md[datatype] = { 'file': file_path, 'data': txt_data }
-                md['files'][datatype] = ssd[datatype]
+                md['files'][datatype] = catalog.get_subtree(study_id, study_name, datatype)
 
     return study_md
 
+# Restrict the rows of each table in the restricted metadata for a single study to the given
+# subjects and samples. Tables are filtered on subject_col and/or sample_col, whichever they have.
+def subset_study_metadata(md, subject_col, subject_ids, sample_col, sample_ids):
+    for datatype in ('Subject', 'Sample', 'Sample_Attributes', 'Subject_Phenotypes'):
+        if datatype not in md:
+            continue
+        data = md[datatype]['data']
+        headers = data.get('headers', [])
+        rows = data['rows']
+        n_rows = len(rows)
+        filtered = False
+        if subject_ids is not None and subject_col in headers:
+            rows = [r for r in rows if r[subject_col] in subject_ids]
+            filtered = True
+        if sample_ids is not None and sample_col in headers:
+            rows = [r for r in rows if r[sample_col] in sample_ids]
+            filtered = True
+        if filtered:
+            data['rows'] = rows
+            logging.info("subset includes " + str(len(rows)) + "/" + str(n_rows) + " row(s) of restricted " + datatype + " metadata")
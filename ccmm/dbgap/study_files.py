@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Discovery of dbGaP metadata files (e.g., *.data_dict.xml, *.var_report.xml, restricted *.txt)
+
+import ccmm.util as util
+import logging
+import os
+import re
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# list of permitted file types
+FILE_TYPES = [
+    'Subject',
+    'Sample',
+    'Sample_Attributes',
+    'Subject_Phenotypes',
+    'Subject_Images'
+]
+
+FILE_TYPES_RE = '|'.join(FILE_TYPES)
+
+# list of permitted metadata types
+METADATA_TYPES = [
+    'data_dict',
+    'var_report',
+    'MULTI',
+    # TODO - handle use codes separately and ensure all combinations are handled:
+    'DS-CS-RD',
+    'DS-LD',
+    'GRU',
+    'HMB',
+    'DS-LD-RD',
+    ''
+]
+
+METADATA_TYPES_RE = '|'.join(METADATA_TYPES)
+
+# keys used to index the files, from the top level down
+LEVEL_KEYS = ["study_id", "study_name", "metadata_type", "file_type"]
+
+# compiled filename regexes, indexed by file suffix
+FILENAME_REGEXES = {}
+
+# ------------------------------------------------------
+# StudyFileCatalog
+# ------------------------------------------------------
+
+# Indexed collection of dbGaP metadata files. Each file is a dict with the following keys:
+#  name, path, study_id, phenotype_id, participant_set_version, study_name, metadata_type, file_type
+#
+# Files are also arranged in a tree whose levels are given by LEVEL_KEYS. A node of the tree is
+# identified by its path from the root e.g., (study_id, study_name, metadata_type), and the
+# following lookups are all constant time:
+#  has_path - whether a node exists
+#  get_keys - child keys of a node, in the order in which they were added
+#  has_key - whether a given value appears at a given level, optionally restricted to one study
+class StudyFileCatalog:
+    files = None
+    by_path = None
+    by_study_id = None
+    children = None
+    leaves = None
+    key_index = None
+    tree = None
+
+    def __init__(self):
+        self.files = []
+        self.by_path = {}
+        self.by_study_id = {}
+        # maps node path -> dict of child keys
+        self.children = { (): {} }
+        # maps leaf path -> file
+        self.leaves = {}
+        # maps (level key, value) -> dict of study_ids
+        self.key_index = {}
+        # cached result of get_multilevel_dict
+        self.tree = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def add_file(self, file):
+        path = file['path']
+        if path in self.by_path:
+            logging.fatal("duplicate dbGaP metadata file " + path)
+            sys.exit(1)
+        self.files.append(file)
+        self.by_path[path] = file
+        study_id = file['study_id']
+        if study_id not in self.by_study_id:
+            self.by_study_id[study_id] = []
+        self.by_study_id[study_id].append(file)
+
+        # add to tree
+        node_path = tuple([file[k] for k in LEVEL_KEYS])
+        n_levels = len(LEVEL_KEYS)
+        for i in range(n_levels):
+            prefix = node_path[0:i]
+            key = node_path[i]
+            if prefix not in self.children:
+                self.children[prefix] = {}
+            self.children[prefix][key] = True
+            ik = (LEVEL_KEYS[i], key)
+            if ik not in self.key_index:
+                self.key_index[ik] = {}
+            self.key_index[ik][study_id] = True
+        # as in util.make_multilevel_dict, a later file with the same keys replaces an earlier one
+        self.leaves[node_path] = file
+        self.tree = None
+
+    def get_study_ids(self):
+        return list(self.by_study_id.keys())
+
+    def get_study_files(self, study_id):
+        return self.by_study_id.get(study_id, [])
+
+    # whether value appears at the given level (one of LEVEL_KEYS) of the tree, either anywhere or under study_id
+    def has_key(self, level, value, study_id=None):
+        ik = (level, value)
+        if ik not in self.key_index:
+            return False
+        if study_id is None:
+            return True
+        return study_id in self.key_index[ik]
+
+    # whether the node at the given path exists e.g., has_path(study_id, study_name, 'Subject')
+    def has_path(self, *path):
+        return (path in self.children) or (path in self.leaves)
+
+    # child keys of the node at the given path
+    def get_keys(self, *path):
+        if path not in self.children:
+            return []
+        return list(self.children[path].keys())
+
+    # file at the given leaf path e.g., get_file(study_id, study_name, 'Subject', 'data_dict')
+    def get_file(self, *path):
+        return self.leaves.get(path)
+
+    # files indexed by study_id, study_name, metadata_type and file_type
+    def get_multilevel_dict(self):
+        if self.tree is None:
+            self.tree = util.make_multilevel_dict(self.files, LEVEL_KEYS)
+        return self.tree
+
+    # subtree of get_multilevel_dict() at the given path
+    def get_subtree(self, *path):
+        d = self.get_multilevel_dict()
+        for k in path:
+            d = d[k]
+        return d
+
+# ------------------------------------------------------
+# File discovery
+# ------------------------------------------------------
+
+# Returns the compiled regexes used to recognize and parse dbGaP metadata filenames with the given suffix.
+def get_filename_regexes(suffix):
+    if suffix not in FILENAME_REGEXES:
+        # ignore anything that doesn't start with a study id and end with suffix
+        study_file_re = re.compile(r'^phs\d+\..*\.' + suffix + '$')
+        # list of possible file types (Subject, Sample, etc.) may vary from study to study
+        # phsXXXXXX - study accession
+        # phtXXXXXX - phenotype trait table accession
+        # v = data version, p = participant set version, c = consent group version
+        file_type_re = re.compile(r'^(phs\d+\.v\d+)\.(pht\d+\.v\d+)(\.p\d+)?\.(\S+)_(' + FILE_TYPES_RE + ').(' + METADATA_TYPES_RE + ')\.' + suffix + '$')
+        FILENAME_REGEXES[suffix] = (study_file_re, file_type_re)
+    return FILENAME_REGEXES[suffix]
+
+# Find all dbGaP metadata files with the given suffix in dir, descending into subdirectories
+# (e.g., one per accession) if recursive is True. Files are added to catalog if one is given.
+def find_study_metadata_files(dir, suffix, recursive=False, catalog=None):
+    (study_file_re, file_type_re) = get_filename_regexes(suffix)
+    if catalog is None:
+        catalog = StudyFileCatalog()
+
+    dirs = [dir]
+    while len(dirs) > 0:
+        d = dirs.pop()
+        with os.scandir(d) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        subdirs = []
+
+        for e in entries:
+            f = e.name
+            if e.is_dir():
+                if recursive:
+                    subdirs.append(e.path)
+                continue
+            if study_file_re.match(f) is None:
+                logging.debug("ignoring metadata file " + f)
+                continue
+            m = file_type_re.match(f)
+            if m is None:
+                logging.fatal("unable to parse file type and study name from dbGaP file " + f)
+                sys.exit(1)
+
+            catalog.add_file({
+                "name": f,
+                "path": e.path,
+                "study_id": m.group(1),
+                "phenotype_id": m.group(2),
+                "participant_set_version": m.group(3),
+                "study_name": m.group(4),
+                "metadata_type": m.group(5),
+                "file_type": m.group(6)
+                })
+
+        # visit subdirectories in alphabetical order
+        dirs.extend(reversed(subdirs))
+
+    return catalog
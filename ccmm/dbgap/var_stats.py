@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Numeric summary statistics from the <stats> sections of dbGaP var_report XML files.
+
+from array import array
+import logging
+import re
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# <stat> attributes stored as numbers (see ccmm.dbgap.public_metadata.STAT_ATTRIBS)
+NUMERIC_STATS = [
+    "n", "nulls",
+    "mean_count", "median_count", "min_count", "max_count",
+    "mean", "median", "min", "max", "sd", "distinct_vals"
+]
+
+NAN = float('nan')
+
+# <stat> attributes reported for each variable Dimension (see ccmm.dbgap.public_metadata.add_study_vars)
+DIMENSION_STATS = ["n", "nulls", "mean", "median", "min", "max", "sd"]
+
+# ------------------------------------------------------
+# VarReportStats
+# ------------------------------------------------------
+
+# Convert a <stat> attribute value to a float, returning NaN if it is missing or non-numeric.
+def stat_to_float(value):
+    if value is None:
+        return NAN
+    try:
+        return float(value)
+    except ValueError:
+        return NAN
+
+# Returns a <stat> value as an int if it is integral, otherwise unchanged.
+def get_number(value):
+    if value is not None and value.is_integer():
+        return int(value)
+    return value
+
+# Array-backed store of the statistics for a list of variables parsed by
+# ccmm.dbgap.public_metadata.read_dbgap_data_dict_or_var_report_xml. Variables are
+# addressed either by position in the original list or by dbGaP variable id.
+#
+# Each <stat> attribute in NUMERIC_STATS is held in an array('d') with NaN for missing
+# values. <enum> values are held in CSR form: the values for the variable at position i
+# are enum_names[enum_offsets[i]:enum_offsets[i+1]], with counts in enum_counts.
+# The modal (most frequent) value of each variable is computed once, with ties broken
+# alphanumerically.
+class VarReportStats:
+    var_ids = None
+    var_index = None
+    # data dictionary variable id (e.g., phv00169061.v7) -> position
+    data_dict_index = None
+    stats = None
+    enum_offsets = None
+    enum_names = None
+    enum_counts = None
+    modal_index = None
+
+    def __init__(self, vars, subsection="total"):
+        self.var_ids = []
+        self.var_index = {}
+        self.stats = dict([(s, array('d')) for s in NUMERIC_STATS])
+        self.enum_offsets = array('l', [0])
+        self.enum_names = []
+        self.enum_counts = array('q')
+        self.modal_index = array('l')
+
+        for var in vars:
+            self.add_var(var, subsection)
+
+    def __len__(self):
+        return len(self.var_ids)
+
+    def add_var(self, var, subsection="total"):
+        pos = len(self.var_ids)
+        var_id = var['id']
+        self.var_ids.append(var_id)
+        if var_id in self.var_index:
+            logging.warn("duplicate variable id " + var_id + " in var_report stats")
+        else:
+            self.var_index[var_id] = pos
+
+        stats = {}
+        if subsection in var and 'stats' in var[subsection]:
+            stats = var[subsection]['stats']
+
+        for s in NUMERIC_STATS:
+            self.stats[s].append(stat_to_float(stats.get(s)))
+
+        # enumerated values
+        modal = -1
+        values = stats.get('values')
+        if values is not None:
+            modal_key = None
+            for v in values:
+                name = v['name']
+                count = int(v['count'])
+                key = (-count, "" if name is None else name)
+                if modal_key is None or key < modal_key:
+                    modal_key = key
+                    modal = len(self.enum_names)
+                self.enum_names.append(name)
+                self.enum_counts.append(count)
+        self.enum_offsets.append(len(self.enum_names))
+        self.modal_index.append(modal)
+
+    def get_pos(self, var_id):
+        return self.var_index[var_id]
+
+    # Returns the position of the variable with data dictionary id var_id, or None. var_report ids may
+    # add the participant set (e.g., phv00169061.v7.p2) to the data dictionary id; variables specific
+    # to a consent group (e.g., phv00169061.v7.p2.c1) are not matched.
+    def get_data_dict_pos(self, var_id):
+        if self.data_dict_index is None:
+            self.data_dict_index = {}
+            for (pos, vid) in enumerate(self.var_ids):
+                dd_id = re.sub(r'\.p\d+$', '', vid)
+                if dd_id not in self.data_dict_index:
+                    self.data_dict_index[dd_id] = pos
+        return self.data_dict_index.get(var_id)
+
+    # numeric value of <stat> attribute name for the variable at pos, or None
+    def get_stat_at(self, pos, name):
+        value = self.stats[name][pos]
+        if value != value:
+            return None
+        return value
+
+    def get_stat(self, var_id, name):
+        return self.get_stat_at(self.get_pos(var_id), name)
+
+    def get_median_at(self, pos):
+        return self.get_stat_at(pos, "median")
+
+    def get_median(self, var_id):
+        return self.get_median_at(self.get_pos(var_id))
+
+    # list of (name, count) for the enumerated values of the variable at pos
+    def get_values_at(self, pos):
+        start = self.enum_offsets[pos]
+        end = self.enum_offsets[pos + 1]
+        return list(zip(self.enum_names[start:end], self.enum_counts[start:end]))
+
+    def get_values(self, var_id):
+        return self.get_values_at(self.get_pos(var_id))
+
+    # most frequent enumerated value of the variable at pos, or None if it has none
+    def get_modal_value_at(self, pos):
+        modal = self.modal_index[pos]
+        if modal < 0:
+            return None
+        return self.enum_names[modal]
+
+    def get_modal_value(self, var_id):
+        return self.get_modal_value_at(self.get_pos(var_id))
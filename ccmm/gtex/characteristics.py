@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Characteristic profiles for GTEx subject and sample Materials.
+#
+# A profile is a list of the GTEx Portal variables to encode as characteristics (DATS Dimensions)
+# of each subject or sample Material, optionally with the name and description to use for each.
+# Profiles are resolved once against the dbGaP study variables into CharacteristicTemplates, so
+# that building the characteristics of each Material is a simple loop over the templates.
+
+from ccmm.dats.datsobj import DatsObj
+import ccmm.dats.util as util
+import ccmm.gtex.parsers.portal_files as portal_files
+import logging
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# id    - GTEx Portal column name, also the dbGaP variable name
+# name  - value of the Annotation used as the Dimension name (defaults to id)
+# description - optional Dimension description
+
+SUBJECT_PROFILES = {
+    "default": [
+        { "id": "SEX", "name": "Gender", "description": "Gender of the subject" },
+        { "id": "AGE", "name": "Age range", "description": "Age range of the subject" },
+        { "id": "DTHHRDY", "name": "Hardy scale", "description": "Hardy scale death classification for the subject" }
+    ]
+}
+
+SAMPLE_PROFILES = {
+    # small subset of the available values, for demonstration purposes
+    "demo": [
+        { "id": "SMATSSCR" },
+        { "id": "SMRIN" },
+        { "id": "SMMAPRT" },
+        { "id": "SMGNSDTC" }
+    ],
+    # every sample attribute other than the sample id
+    "all": [ { "id": c['id'] } for c in portal_files.SAMPLE_ATT_COLS if c['id'] != 'SAMPID' ]
+}
+
+DEFAULT_SUBJECT_PROFILE = "default"
+DEFAULT_SAMPLE_PROFILE = "demo"
+
+# ------------------------------------------------------
+# CharacteristicTemplate
+# ------------------------------------------------------
+
+# A single characteristic resolved against the dbGaP study variables.
+class CharacteristicTemplate:
+    id = None
+    name = None
+    description = None
+    var_id = None
+
+    def __init__(self, id, name, description, var_id):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.var_id = var_id
+
+    # create the Dimension for this characteristic in row, a dict of {'raw_value', 'mapped_value'}
+    def make_dimension(self, cache, row):
+        atts = [("name", util.get_value_annotation(self.name, cache))]
+        if self.description is not None:
+            atts.append(("description", self.description))
+        if self.var_id is not None:
+            atts.append(("identifier", { "@id": self.var_id }))
+        atts.append(("values", [ row[self.id]['mapped_value'] ]))
+        return DatsObj("Dimension", atts)
+
+# Resolve the named profile against var_lookup (as in type_name_cg_to_var) into a list of CharacteristicTemplates.
+def get_templates(profiles, profile_name, var_lookup):
+    if profile_name not in profiles:
+        logging.fatal("unknown characteristic profile " + profile_name + ", expected one of " + ",".join(sorted(profiles.keys())))
+        sys.exit(1)
+
+    templates = []
+    for c in profiles[profile_name]:
+        var_id = None
+        # use id of the Identifier of the DATS Dimension for the "all subjects" consent group version of the variable
+        if c['id'] in var_lookup:
+            var_id = var_lookup[c['id']]['dim'].get("identifier").get("@id")
+        else:
+            logging.warn("no dbGaP variable found for characteristic " + c['id'] + ", omitting identifier")
+        templates.append(CharacteristicTemplate(c['id'], c.get('name', c['id']), c.get('description'), var_id))
+
+    return templates
+
+def get_subject_templates(profile_name, var_lookup):
+    return get_templates(SUBJECT_PROFILES, profile_name, var_lookup)
+
+def get_sample_templates(profile_name, var_lookup):
+    return get_templates(SAMPLE_PROFILES, profile_name, var_lookup)
+
+# create the characteristics for a single row of a GTEx Portal file
+def make_characteristics(cache, templates, row):
+    return [t.make_dimension(cache, row) for t in templates]
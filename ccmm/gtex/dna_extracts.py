@@ -2,6 +2,7 @@
 
 from ccmm.dats.datsobj import DatsObj
 import ccmm.dats.util as util
+import ccmm.dbgap.var_stats as var_stats
 from collections import OrderedDict
 import csv
 import json
@@ -18,11 +19,21 @@ import sys
 # DATS JSON Output
 # ------------------------------------------------------
 
+# Returns the median of the variable at pos in stats as a string, like the other variable values, or None.
+def get_median_value(stats, pos):
+    median = stats.get_median_at(pos)
+    if median is None:
+        return None
+    return str(var_stats.get_number(median))
+
 # Pick representative and/or legal value for each variable
-def pick_var_values(vars):
+# stats - VarReportStats for vars, built here if not supplied
+def pick_var_values(vars, stats=None):
     res = {}
+    if stats is None:
+        stats = var_stats.VarReportStats(vars)
 
-    for var in vars:
+    for (pos, var) in enumerate(vars):
         vname = var['var_name']
         values = None
         value = None
@@ -39,18 +50,16 @@ def pick_var_values(vars):
             values = var['total']['stats']['values']
         # take the median if defined
         elif (var['reported_type'] == 'integer') or (var['calculated_type'] == 'integer'):
-            value = var['total']['stats']['median']
+            value = get_median_value(stats, pos)
         elif (var['reported_type'] == 'decimal') or (var['calculated_type'] == 'decimal'):
-            value = var['total']['stats']['median']
+            value = get_median_value(stats, pos)
         else:
             logging.fatal("unexpected variable reported_type=" + var['reported_type'])
             sys.exit(1)
 
         if values is not None:
-            # sort values by count and then alphanumerically
-            sorted_values = sorted(values, key=lambda x: int(x['count']), reverse=True)
-            sorted_values.sort(key=lambda x: x['name'])
-            value = sorted_values[0]['name']
+            # most frequent value, ties broken alphanumerically
+            value = stats.get_modal_value_at(pos)
         
         res[vname] = { "value": value, "var": var }
 
@@ -391,19 +400,19 @@ def get_synthetic_single_dna_extract_json_from_public_metadata(study, study_md):
 
     # Subject summary data
     if 'Subject_Phenotypes' in study_md:
-        subj_data = study_md['Subject_Phenotypes']['var_report']['data']
-        subj_vars = subj_data['vars']
+        subj_report = study_md['Subject_Phenotypes']['var_report']
+        subj_vars = subj_report['data']['vars']
         # pick representative and/or legal value for each variable
-        subj_var_values = pick_var_values(subj_vars)
+        subj_var_values = pick_var_values(subj_vars, subj_report.get('stats'))
         logging.debug("subj_var_values=" + json.dumps(subj_var_values, indent=2))
     else:
         subj_var_values = {}
 
     # Sample summary data
-    samp_data = study_md['Sample_Attributes']['var_report']['data']
-    samp_vars = samp_data['vars']
+    samp_report = study_md['Sample_Attributes']['var_report']
+    samp_vars = samp_report['data']['vars']
     # pick representative and/or legal value for each variable
-    samp_var_values = pick_var_values(samp_vars)
+    samp_var_values = pick_var_values(samp_vars, samp_report.get('stats'))
     logging.debug("samp_var_values=" + json.dumps(samp_var_values, indent=2))
 
     # assign dummy ids: subject and sample ids are protected data
@@ -129,18 +129,41 @@ def read_sample_attributes_file(samp_att_file):
     logging.info("Read " + str(len(samples)) + " sample(s) from " + samp_att_file)
     return samples
 
+# Read only the named columns of the subject phenotype file (see util.read_csv_metadata_columns)
+def read_subject_phenotypes_columns(subj_phen_file, columns=None):
+    subjects = util.read_csv_metadata_columns(subj_phen_file, SUBJ_PHEN_COLS, columns)
+    logging.info("Read " + str(get_column_length(subjects)) + " subject(s) from " + subj_phen_file)
+    return subjects
+
+# Read only the named columns of the sample attributes file (see util.read_csv_metadata_columns)
+def read_sample_attributes_columns(samp_att_file, columns=None):
+    samples = util.read_csv_metadata_columns(samp_att_file, SAMPLE_ATT_COLS, columns)
+    logging.info("Read " + str(get_column_length(samples)) + " sample(s) from " + samp_att_file)
+    return samples
+
+def get_column_length(columns):
+    for c in columns:
+        return len(columns[c])
+    return 0
+
+# Returns the subject id encoded in a sample id, or None if it can't be parsed.
+def get_sample_subject_id(sampid):
+    # sample id begins with the subject id
+    # all subject ids except one (K-562) begin with "GTEX-"
+    m = re.search(r'^((GTEX|K)-[^\-]+)', sampid)
+    if m is None:
+        return None
+    return m.group(1)
+
 # Parse subject id from each sample id and link sample with subject
 def link_samples_to_subjects(samples, subjects):
     for s in samples:
         sample = samples[s]
         sampid = sample['SAMPID']['raw_value']
-        # sample id begins with the subject id
-        # all subject ids except one (K-562) begin with "GTEX-"
-        m = re.search(r'^((GTEX|K)-[^\-]+)', sampid)
-        if m is None:
+        subjid = get_sample_subject_id(sampid)
+        if subjid is None:
             util.fatal_error("Unable to parse subject id from SAMPID '" + sampid + "'")
-        subjid = m.group(1)
         sample['SUBJID'] = { "raw_value": sampid, "mapped_value": subjid }
         if subjid not in subjects:
-            util.fatal_error("Found reference to nonexistent SUBJID '" + subjid + "' from SAMPID '" + + "'")
+            util.fatal_error("Found reference to nonexistent SUBJID '" + subjid + "' from SAMPID '" + sampid + "'")
         sample['subject'] = subjects[subjid]
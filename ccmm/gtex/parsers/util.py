@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from collections import OrderedDict
 import csv
 import logging
 import re
@@ -17,6 +18,70 @@ def fatal_parse_error(err_msg, file, lnum):
     msg = err_msg + " at line " + str(lnum) + " of " + file
     fatal_error(msg)
 
+# Parse and check a single row of a subject/phenotype or sample/attribute metadata file.
+#
+# line - list of column values
+# column_metadata - as in read_csv_metadata_file
+# file_path, lnum - file and line number, for error messages
+#
+# Returns a dict mapping each column name to a dict of {'raw_value', 'mapped_value'}.
+def parse_metadata_row(line, column_metadata, file_path, lnum):
+    cnum = 0
+    parsed_row = {}
+
+    for col in column_metadata:
+        colname = col['id']
+        colval = line[cnum]
+        parsed_col = { "raw_value": colval }
+
+        # check for empty value
+        if colval == '':
+            if col['empty_ok']:
+                parsed_col['mapped_value'] = None
+            else:
+                fatal_parse_error("Missing value in column " + str(cnum+1) + "/" + colname + " but empty_ok = False.", file_path, lnum)
+
+        # check regex if present
+        elif 'regex' in col:
+            regex = col['regex']
+            m = re.match(regex, colval)
+            if m is None:
+                fatal_parse_error("Value in column '" + str(cnum+1) + "' ('" + colval+ "') does not match regex " + str(regex), file_path, lnum)
+
+        # integer_cv
+        elif 'integer_cv' in col:
+            m = re.match(r'^(\d+)', colval)
+            if m is None:
+                fatal_parse_error("Value in column '" + str(cnum+1) + "' ('" + colval+ "') is not an integer.", file_path, lnum)
+                
+            iv = int(m.group(1))
+            icv = col['integer_cv']
+            if iv not in icv:
+                fatal_parse_error("No mapping defined for integer value " + str(iv) + " in column " + str(cnum+1) + "/" + colname + " ", file_path, lnum)
+            val = icv[iv]
+            parsed_col["mapped_value"] = val
+
+        # cv
+        elif 'cv' in col:
+            # check that value is one of the allowed values
+            cv = col['cv']
+
+        if 'mapped_value' not in parsed_col:
+            parsed_col['mapped_value'] = parsed_col['raw_value']
+
+        cnum += 1
+        parsed_row[colname] = parsed_col
+
+    return parsed_row
+
+# check that the column headings in line match those in column_metadata
+def check_metadata_header(line, column_metadata, file_path):
+    cnum = 0
+    for col in column_metadata:
+        if line[cnum] != col['id']:
+            fatal_parse_error("Unexpected column header '" + line[cnum] + "' in column " + str(cnum+1) + " ", file_path, 1)
+        cnum += 1
+
 # Generic parser for subject/phenotype and sample/attribute metadata files
 #
 # file_path - path to the file to be read
@@ -40,66 +105,75 @@ def read_csv_metadata_file(file_path, column_metadata, id_column):
 
             # check column headings match expected values
             if lnum == 1:
-                cnum = 0
-                for col in column_metadata:
-                    if line[cnum] != col['id']:
-                        fatal_parse_error("Unexpected column header '" + line[cnum] + "' in column " + str(cnum+1) + " ", file_path, lnum)
-                    cnum += 1
+                check_metadata_header(line, column_metadata, file_path)
 
             # parse column values
             else:
-                cnum = 0
-                parsed_row = {}
-
-                for col in column_metadata:
-                    colname = col['id']
-                    colval = line[cnum]
-                    parsed_col = { "raw_value": colval }
-
-                    # check for empty value
-                    if colval == '':
-                        if col['empty_ok']:
-                            parsed_col['mapped_value'] = None
-                        else:
-                            fatal_parse_error("Missing value in column " + str(cnum+1) + "/" + colname + " but empty_ok = False.", file_path, lnum)
-
-                    # check regex if present
-                    elif 'regex' in col:
-                        regex = col['regex']
-                        m = re.match(regex, colval)
-                        if m is None:
-                            fatal_parse_error("Value in column '" + str(cnum+1) + "' ('" + colval+ "') does not match regex " + str(regex), file_path, lnum)
-
-                    # integer_cv
-                    elif 'integer_cv' in col:
-                        m = re.match(r'^(\d+)', colval)
-                        if m is None:
-                            fatal_parse_error("Value in column '" + str(cnum+1) + "' ('" + colval+ "') is not an integer.", file_path, lnum)
-                            
-                        iv = int(m.group(1))
-                        icv = col['integer_cv']
-                        if iv not in icv:
-                            fatal_parse_error("No mapping defined for integer value " + str(iv) + " in column " + str(cnum+1) + "/" + colname + " ", file_path, lnum)
-                        val = icv[iv]
-                        parsed_col["mapped_value"] = val
-
-                    # cv
-                    elif 'cv' in col:
-                        # check that value is one of the allowed values
-                        cv = col['cv']
-
-                    if 'mapped_value' not in parsed_col:
-                        parsed_col['mapped_value'] = parsed_col['raw_value']
-
-                    cnum += 1
-                    parsed_row[colname] = parsed_col
+                parsed_row = parse_metadata_row(line, column_metadata, file_path, lnum)
 
                 # set row id
                 row_id = parsed_row[id_column]['mapped_value']
                 parsed_row['id'] = row_id
 #                logging.debug("read row " + str(parsed_row) + " from line " + str(lnum) + " of " + file_path)
                 if row_id in rows:
-                    fatal_parse_error("Duplicate " + id_column + " '" + rowid + "'", subj_phen_file, lnum)
+                    fatal_parse_error("Duplicate " + id_column + " '" + row_id + "'", file_path, lnum)
                 rows[row_id] = parsed_row
 
     return rows
+
+# Columnar variant of read_csv_metadata_file for callers that only need the (mapped) values of a few
+# columns and not per-row dicts, e.g., to compute summary statistics. Values are mapped as in
+# read_csv_metadata_file (empty values to None, integer_cv codes to their labels) and regexes are
+# checked, but only for the requested columns.
+#
+# columns - names of the columns to return, or None for all columns
+#
+# Returns an OrderedDict mapping each column name to a list of values, one per row.
+def read_csv_metadata_columns(file_path, column_metadata, columns=None):
+    col_md = dict([(col['id'], col) for col in column_metadata])
+    if columns is None:
+        columns = [col['id'] for col in column_metadata]
+    for c in columns:
+        if c not in col_md:
+            fatal_error("Unknown column '" + c + "' requested from " + file_path)
+
+    # (column index, column name, compiled regex, integer_cv, empty_ok) for each requested column
+    col_info = []
+    for c in columns:
+        cnum = [col['id'] for col in column_metadata].index(c)
+        col = col_md[c]
+        regex = re.compile(col['regex']) if 'regex' in col else None
+        col_info.append((cnum, c, regex, col.get('integer_cv'), col.get('empty_ok', True)))
+
+    values = OrderedDict([(c, []) for c in columns])
+    int_regex = re.compile(r'^(\d+)')
+
+    with open(file_path) as fh:
+        reader = csv.reader(fh, delimiter='\t')
+
+        # check column headings match expected values
+        check_metadata_header(next(reader), column_metadata, file_path)
+
+        lnum = 1
+        for line in reader:
+            lnum += 1
+            for (cnum, colname, regex, icv, empty_ok) in col_info:
+                colval = line[cnum]
+                if colval == '':
+                    if not empty_ok:
+                        fatal_parse_error("Missing value in column " + str(cnum+1) + "/" + colname + " but empty_ok = False.", file_path, lnum)
+                    colval = None
+                elif regex is not None:
+                    if regex.match(colval) is None:
+                        fatal_parse_error("Value in column '" + str(cnum+1) + "' ('" + colval+ "') does not match regex " + regex.pattern, file_path, lnum)
+                elif icv is not None:
+                    m = int_regex.match(colval)
+                    if m is None:
+                        fatal_parse_error("Value in column '" + str(cnum+1) + "' ('" + colval+ "') is not an integer.", file_path, lnum)
+                    iv = int(m.group(1))
+                    if iv not in icv:
+                        fatal_parse_error("No mapping defined for integer value " + str(iv) + " in column " + str(cnum+1) + "/" + colname + " ", file_path, lnum)
+                    colval = icv[iv]
+                values[colname].append(colval)
+
+    return values
@@ -9,3 +9,6 @@ def read_study_metadata(dir):
 
 def add_study_vars(study, study_md):
     return ccmm.dbgap.public_metadata.add_study_vars(study, study_md)
+
+def index_study_vars(study, study_md):
+    return ccmm.dbgap.public_metadata.index_study_vars(study, study_md)
@@ -1,60 +1,34 @@
 #!/usr/bin/env python3
 
-from ccmm.dats.datsobj import DatsObj
+from ccmm.dats.datsobj import DatsObj, DATSEncoder
 import ccmm.dats.util as util
-from collections import OrderedDict
+import ccmm.util
+from collections import OrderedDict, deque
 import csv
+import io
 import json
 import logging
+import multiprocessing
 import os
+import queue
 import re
 import sys
+import tarfile
+import threading
+import time
+import zipfile
 
 def print_subject_sample_count_histogram(samples):
-    print("Histogram of number of subjects that have a given number of samples")
-
-    # count samples per subject
-    subject_sample_count = {}
-    for s in samples:
-        sample = samples[s]
-        subject = sample['subject']['SUBJID']['mapped_value']
-        if subject in subject_sample_count:
-            subject_sample_count[subject] += 1
-        else:
-            subject_sample_count[subject] = 1
-
-    # convert to histogram
-    ssc_hist = {}
-    for s in subject_sample_count:
-        ct = subject_sample_count[s]
-        if ct in ssc_hist:
-            ssc_hist[ct] += 1
-        else:
-            ssc_hist[ct] = 1
-#        print(s + " has " + str(ct) + " sample(s)")
-
-    # print histogram
-    n_total_samples = 0
-    n_total_subjects = 0
-    print("n_samples\tn_subjects")
-    for n_samples in sorted(ssc_hist):
-        n_subjects = ssc_hist[n_samples]
-        print(str(n_samples) + "\t" + str(n_subjects))
-        n_total_subjects += n_subjects
-        n_total_samples += (n_subjects * n_samples)
-    print("n_total_samples=" + str(n_total_samples))
-    print("n_total_subjects=" + str(n_total_subjects))
+    ccmm.util.print_subject_sample_count_histogram([samples[s]['subject']['SUBJID']['mapped_value'] for s in samples])
 
 
 # ------------------------------------------------------
 # DATS JSON Output
 # ------------------------------------------------------
 
-def get_single_sample_json(sample, dats_obj_cache):
-#    print("converting sample to json: " + str(sample))
+# Returns the AnatomicalPart for the tissue of a sample, creating it if it's not in dats_obj_cache.
+def get_sample_anatomical_part(sample, dats_obj_cache):
     samp_id = sample['SAMPID']['mapped_value']
-    subj_id = sample['SUBJID']['mapped_value']
-    subject = sample['subject']
 
     # Uberon id (or EFO id, contrary to the documentation)
     anat_id = sample['SMUBRID']['mapped_value']
@@ -67,6 +41,11 @@ def get_single_sample_json(sample, dats_obj_cache):
     # TODO - query anatomy term from UBERON/EFO instead?
     anatomy_name = sample['SMTSD']['mapped_value']
 
+    # anatomical part
+    anat_part_key = ":".join(["AnatomicalPart", anatomy_name])
+    if anat_part_key in dats_obj_cache:
+        return dats_obj_cache[anat_part_key]
+
     # EFO id
     if re.match(r'^EFO_\d+', anat_id):
         anatomy_identifier = OrderedDict([
@@ -84,17 +63,22 @@ def get_single_sample_json(sample, dats_obj_cache):
                     ("identifier", "http://purl.obolibrary.org/obo/UBERON_" + str(anat_id)),
                     ("identifierSource", "UBERON")])]
 
-    # anatomical part
-    anat_part_key = ":".join(["AnatomicalPart", anatomy_name])
-    if anat_part_key in dats_obj_cache:
-        anatomical_part = dats_obj_cache[anat_part_key]
-    else:
-        anatomical_part = DatsObj("AnatomicalPart", [
-                ("name", anatomy_name),
-                ("identifier", anatomy_identifier),
-                ("alternateIdentifiers", anatomy_alt_ids)
-                ])
-        dats_obj_cache[anat_part_key] = anatomical_part
+    anatomical_part = DatsObj("AnatomicalPart", [
+            ("name", anatomy_name),
+            ("identifier", anatomy_identifier),
+            ("alternateIdentifiers", anatomy_alt_ids)
+            ])
+    dats_obj_cache[anat_part_key] = anatomical_part
+    return anatomical_part
+
+# Returns the subject Material for a sample, creating it if it's not in dats_obj_cache.
+def get_sample_subject_material(sample, dats_obj_cache):
+    subj_id = sample['SUBJID']['mapped_value']
+    subject = sample['subject']
+
+    subj_key = ":".join(["Material", subj_id])
+    if subj_key in dats_obj_cache:
+        return dats_obj_cache[subj_key]
 
     # human experimental subject/patient
     subject_sex = DatsObj("Dimension", [
@@ -124,23 +108,28 @@ def get_single_sample_json(sample, dats_obj_cache):
         subject_hardy_scale
         ]
 
-    # human experimental subject/patient
-    subj_key = ":".join(["Material", subj_id])
-    if subj_key in dats_obj_cache:
-        subject_material = dats_obj_cache[subj_key]
-    else:
-        subject_material = DatsObj("Material", [
-                ("name", subj_id),
-                ("identifier", { "identifier": subj_id }),
-                ("description", "GTEx subject " + subj_id),
-                ("characteristics", subject_characteristics),
-                ("taxonomy", [ util.get_taxon_human(dats_obj_cache) ]),
-                ("roles", util.get_donor_roles(dats_obj_cache))
-                ])
-        dats_obj_cache[subj_key] = subject_material
-
-    specimen_annot = util.get_annotation("specimen", dats_obj_cache)
-    rna_extract_annot = util.get_annotation("RNA extract", dats_obj_cache)
+    # each sample is written as a standalone document, so shared objects are embedded in full (no DatsObjCache)
+    subject_material = DatsObj("Material", [
+            ("name", subj_id),
+            ("identifier", { "identifier": subj_id }),
+            ("description", "GTEx subject " + subj_id),
+            ("characteristics", subject_characteristics),
+            ("taxonomy", [ util.get_taxon_human(None) ]),
+            ("roles", util.get_donor_roles(None))
+            ])
+    dats_obj_cache[subj_key] = subject_material
+    return subject_material
+
+def get_single_sample_json(sample, dats_obj_cache):
+#    print("converting sample to json: " + str(sample))
+    samp_id = sample['SAMPID']['mapped_value']
+    subj_id = sample['SUBJID']['mapped_value']
+    anatomical_part = get_sample_anatomical_part(sample, dats_obj_cache)
+    anatomy_name = anatomical_part.get("name")
+    subject_material = get_sample_subject_material(sample, dats_obj_cache)
+
+    specimen_annot = util.get_annotation("specimen")
+    rna_extract_annot = util.get_annotation("RNA extract")
 
     # biological/tissue sample
     sample_name = samp_id
@@ -148,7 +137,7 @@ def get_single_sample_json(sample, dats_obj_cache):
             ("name", sample_name),
             ("identifier", { "identifier": samp_id }),
             ("description", anatomy_name + " specimen collected from subject " + subj_id),
-            ("taxonomy", [ util.get_taxon_human(dats_obj_cache) ]),
+            ("taxonomy", [ util.get_taxon_human(None) ]),
             ("roles", [ specimen_annot ]),
             ("derivesFrom", [ subject_material, anatomical_part ])
             ])
@@ -157,17 +146,20 @@ def get_single_sample_json(sample, dats_obj_cache):
     rna_material = DatsObj("Material", [
             ("name", "RNA from " + sample_name),
             ("description", "total RNA extracted from " + anatomy_name + " specimen collected from subject " + subj_id),
-            ("taxonomy", [ util.get_taxon_human(dats_obj_cache) ]),
+            ("taxonomy", [ util.get_taxon_human(None) ]),
             ("roles", [ rna_extract_annot ]),
             ("derivesFrom", [ biological_sample_material ])
             ])
 
     return rna_material
 
-def write_single_sample_json(sample, output_file, dats_obj_cache):
+def get_single_sample_json_bytes(sample, dats_obj_cache):
     rna_material = get_single_sample_json(sample, dats_obj_cache)
-    with open(output_file, mode="w") as jf:
-        jf.write(json.dumps(rna_material, indent=2))
+    return json.dumps(rna_material, indent=2, cls=DATSEncoder).encode('utf-8')
+
+def write_single_sample_json(sample, output_file, dats_obj_cache):
+    with open(output_file, mode="wb") as jf:
+        jf.write(get_single_sample_json_bytes(sample, dats_obj_cache))
 
 def get_samples_json(samples, subjects):
     samples_json = []
@@ -179,16 +171,183 @@ def get_samples_json(samples, subjects):
         samples_json.append(sample_json)
     return samples_json
 
-# write separate JSON file for each sample
-def write_samples_json(subjects, samples, output_dir):
-    # track which DATS objects have already been added to the structure
-    # maps ":".join([<type>, <name>]<) to DatsObj
+# ------------------------------------------------------
+# Bulk per-sample JSON export
+# ------------------------------------------------------
+
+# maximum number of serialized sample documents waiting to be written
+WRITER_QUEUE_SIZE = 2000
+# number of samples serialized by each worker task
+EXPORT_CHUNK_SIZE = 250
+# maximum number of chunks per worker process that are serialized but not yet queued for writing
+EXPORT_CHUNKS_PER_PROC = 2
+
+# archive file suffix -> (archive type, tarfile mode)
+ARCHIVE_FORMATS = OrderedDict([
+    (".tar", ("tar", "w")),
+    (".tar.gz", ("tar", "w:gz")),
+    (".tgz", ("tar", "w:gz")),
+    (".zip", ("zip", None))
+])
+
+# per-process state set by init_export_worker
+EXPORT_WORKER_STATE = None
+
+# Writes (filename, bytes) documents from a queue to a directory or an open archive, until None is read.
+# Errors are recorded rather than raised so that the queue keeps draining and the producer can't block.
+class SampleJsonWriter:
+    queue = None
+    output_dir = None
+    archive_type = None
+    archive = None
+    thread = None
+    n_written = None
+    n_bytes = None
+    error = None
+
+    def __init__(self, output_dir=None, archive_file=None, queue_size=WRITER_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.output_dir = output_dir
+        self.n_written = 0
+        self.n_bytes = 0
+
+        if archive_file is not None:
+            (self.archive_type, mode) = get_archive_format(archive_file)
+            if self.archive_type == "zip":
+                self.archive = zipfile.ZipFile(archive_file, mode="w", compression=zipfile.ZIP_DEFLATED)
+            else:
+                self.archive = tarfile.open(archive_file, mode=mode)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write_doc(self, filename, data):
+        if self.archive is None:
+            with open(os.path.join(self.output_dir, filename), mode="wb") as jf:
+                jf.write(data)
+        elif self.archive_type == "zip":
+            self.archive.writestr(filename, data)
+        else:
+            ti = tarfile.TarInfo(filename)
+            ti.size = len(data)
+            ti.mtime = time.time()
+            self.archive.addfile(ti, io.BytesIO(data))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            (filename, data) = item
+            try:
+                self.write_doc(filename, data)
+                self.n_written += 1
+                self.n_bytes += len(data)
+            except Exception as e:
+                self.error = e
+
+    def put(self, filename, data):
+        self.queue.put((filename, data))
+
+    # wait for all queued documents to be written and close the archive, if any
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.archive is not None:
+            self.archive.close()
+        if self.error is not None:
+            logging.fatal("failed writing sample JSON: " + str(self.error))
+            sys.exit(1)
+
+# Returns (archive type, tarfile mode) for an archive file name.
+def get_archive_format(archive_file):
+    for suffix in ARCHIVE_FORMATS:
+        if archive_file.endswith(suffix):
+            return ARCHIVE_FORMATS[suffix]
+    logging.fatal("unsupported archive type for " + archive_file + ", expected one of " + ",".join(ARCHIVE_FORMATS.keys()))
+    sys.exit(1)
+
+# Create the subject Materials and AnatomicalParts of all samples up front, so that each is created
+# only once and has the same @id in every file, regardless of which process writes the file.
+def get_shared_dats_objs(samples):
     dats_obj_cache = {}
     for s in sorted(samples):
-        sample = samples[s]
-        samp_id = sample['SAMPID']['mapped_value']
-        output_file = os.path.join(output_dir, samp_id + ".json")
-        write_single_sample_json(sample, output_file, dats_obj_cache)
+        get_sample_anatomical_part(samples[s], dats_obj_cache)
+        get_sample_subject_material(samples[s], dats_obj_cache)
+    return dats_obj_cache
+
+def init_export_worker(samples, dats_obj_cache):
+    global EXPORT_WORKER_STATE
+    EXPORT_WORKER_STATE = { "samples": samples, "dats_obj_cache": dats_obj_cache }
+
+# Serialize a list of samples to (filename, bytes). Returns None if a fatal error was logged, since
+# exiting from a worker would stall the pool.
+def get_samples_json_chunk(sample_ids):
+    samples = EXPORT_WORKER_STATE['samples']
+    dats_obj_cache = EXPORT_WORKER_STATE['dats_obj_cache']
+    docs = []
+    try:
+        for s in sample_ids:
+            sample = samples[s]
+            samp_id = sample['SAMPID']['mapped_value']
+            docs.append((samp_id + ".json", get_single_sample_json_bytes(sample, dats_obj_cache)))
+    except SystemExit:
+        return None
+    return docs
+
+# Queue the documents returned by get_samples_json_chunk for writing. Returns the number of failed chunks.
+def put_samples_json_chunk(writer, docs):
+    if docs is None:
+        return 1
+    for (filename, data) in docs:
+        writer.put(filename, data)
+    return 0
+
+# Write a separate JSON file for each sample, either to output_dir or to a single tar or zip archive_file.
+# Sample documents are serialized by num_procs worker processes and written by a separate thread
+# through a bounded queue, so serialization and I/O overlap without holding every document in memory.
+def write_samples_json(subjects, samples, output_dir, num_procs=1, archive_file=None):
+    if archive_file is None and output_dir is None:
+        logging.fatal("either an output directory or an archive file must be given")
+        sys.exit(1)
+    if archive_file is None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    sample_ids = sorted(samples)
+    dats_obj_cache = get_shared_dats_objs(samples)
+    chunks = [sample_ids[i:i + EXPORT_CHUNK_SIZE] for i in range(0, len(sample_ids), EXPORT_CHUNK_SIZE)]
+    dest = output_dir if archive_file is None else archive_file
+    logging.info("writing JSON for " + str(len(sample_ids)) + " sample(s) to " + dest + " using " + str(num_procs) + " process(es)")
+
+    t0 = time.perf_counter()
+    writer = SampleJsonWriter(output_dir, archive_file)
+    n_failed = 0
+    try:
+        if num_procs > 1:
+            with multiprocessing.Pool(num_procs, initializer=init_export_worker, initargs=(samples, dats_obj_cache)) as pool:
+                # limit the chunks submitted ahead of the writer, since the pool keeps every finished chunk until it is collected
+                window = deque()
+                for chunk in chunks:
+                    window.append(pool.apply_async(get_samples_json_chunk, (chunk,)))
+                    if len(window) >= EXPORT_CHUNKS_PER_PROC * num_procs:
+                        n_failed += put_samples_json_chunk(writer, window.popleft().get())
+                while len(window) > 0:
+                    n_failed += put_samples_json_chunk(writer, window.popleft().get())
+        else:
+            init_export_worker(samples, dats_obj_cache)
+            for chunk in chunks:
+                n_failed += put_samples_json_chunk(writer, get_samples_json_chunk(chunk))
+    finally:
+        writer.close()
+
+    if n_failed > 0:
+        logging.fatal("failed to serialize " + str(n_failed) + " chunk(s) of samples")
+        sys.exit(1)
+
+    elapsed = time.perf_counter() - t0
+    logging.info("wrote " + str(writer.n_written) + " sample JSON file(s) (" + str(writer.n_bytes) + " bytes) in " + "{:.1f}".format(elapsed) + "s")
 
 def filter_samples(samples, smafrze):
     if smafrze is None:
@@ -1,21 +1,124 @@
 #!/usr/bin/env python3
 
-from ccmm.dats.datsobj import DatsObj
+from ccmm.dats.datsobj import DatsObj, DatsObjCacheShard
+import ccmm.dats.datsobj as datsobj
 import ccmm.dats.util as util
+import ccmm.gtex.characteristics as characteristics
 from collections import OrderedDict
 import logging
+import multiprocessing
 import re
 import sys
 
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# expected sequence type for each analysis freeze classification (SMAFRZE)
+SMAFRZE_SEQ_TYPES = {
+    "RNASEQ": "RNA",
+    "WGS": "DNA",
+    "WES": "DNA",
+    # Illumina OMNI SNP Array
+    "OMNI": "DNA",
+    "EXCLUDE": None
+}
+
+# sequence type implied by the nucleic acid isolation batch type (SMNABTCHT), first match wins
+SMNABTCHT_SEQ_TYPES = [
+    (re.compile(r'^DNA ([iI]solation|[eE]xtraction).*'), 'DNA'),
+    (re.compile(r'^RNA ([iI]solation|[eE]xtraction).*'), 'RNA'),
+    (re.compile(r'DNA or RNA Extraction from Paxgene-derived Lysate Plate Based'), 'RNA'),
+    (re.compile(r'Transfer To Matrix \(Manual\)'), 'DNA')
+]
+
+# ------------------------------------------------------
+# Sample type (DNA or RNA) classification
+# ------------------------------------------------------
+
+# Classify a single (SMAFRZE, SMNABTCHT) pair. Returns (sequence type, error message), where the
+# sequence type is 'DNA', 'RNA' or None if it can't be determined, and the error message is None
+# unless the pair is inconsistent.
+def classify_sample_type(smafrze, smnabtcht):
+    if smafrze not in SMAFRZE_SEQ_TYPES:
+        return (None, "unknown SMAFRZE " + smafrze)
+    # expected sequence type depending on data freeze classification
+    expected_stype = SMAFRZE_SEQ_TYPES[smafrze]
+
+    # sample type - DNA or RNA
+    stype = None
+    for (regex, st) in SMNABTCHT_SEQ_TYPES:
+        if regex.match(smnabtcht):
+            stype = st
+            break
+
+    if stype is None:
+        return (expected_stype, None)
+    if (expected_stype is not None) and (stype != expected_stype):
+        return (None, "seq type " + stype + " doesn't match expected stype " + expected_stype)
+    return (stype, None)
+
+# Classify each distinct (SMAFRZE, SMNABTCHT) pair in p_samples and return a dict that maps each
+# pair to 'DNA', 'RNA' or None (undetermined.) Logs the number of samples in each class and exits
+# if any of the pairs are inconsistent.
+def get_sample_type_table(p_samples):
+    pair_counts = {}
+    for s in p_samples:
+        p_sample = p_samples[s]
+        pair = (p_sample['SMAFRZE']['mapped_value'], p_sample['SMNABTCHT']['mapped_value'])
+        pair_counts[pair] = pair_counts.get(pair, 0) + 1
+
+    table = {}
+    class_counts = {}
+    errors = []
+    for pair in sorted(pair_counts.keys()):
+        (stype, err) = classify_sample_type(pair[0], pair[1])
+        table[pair] = stype
+        if err is not None:
+            errors.append(err + " for smafrze=" + pair[0] + " smnabtcht=" + pair[1] + " (" + str(pair_counts[pair]) + " sample(s))")
+            continue
+        sclass = "undetermined" if stype is None else stype
+        class_counts[sclass] = class_counts.get(sclass, 0) + pair_counts[pair]
+        if stype is None:
+            logging.warn("couldn't determine sequence type for smafrze=" + pair[0] + " smnabtcht=" + pair[1] + " (" + str(pair_counts[pair]) + " sample(s))")
+
+    logging.info("classified " + str(len(p_samples)) + " sample(s) from " + str(len(pair_counts)) + " distinct SMAFRZE/SMNABTCHT pair(s): " +
+                 ", ".join([c + "=" + str(class_counts[c]) for c in sorted(class_counts.keys())]))
+
+    if len(errors) > 0:
+        for err in errors:
+            logging.error(err)
+        logging.fatal("found " + str(len(errors)) + " inconsistent SMAFRZE/SMNABTCHT pair(s)")
+        sys.exit(1)
+
+    return table
+
+# Returns 'DNA', 'RNA' or None for a single sample, using sample_types from get_sample_type_table if given.
+def get_sample_type(p_sample, sample_types=None):
+    pair = (p_sample['SMAFRZE']['mapped_value'], p_sample['SMNABTCHT']['mapped_value'])
+    if sample_types is not None and pair in sample_types:
+        return sample_types[pair]
+    (stype, err) = classify_sample_type(pair[0], pair[1])
+    if err is not None:
+        logging.fatal(err)
+        sys.exit(1)
+    return stype
+
+# ------------------------------------------------------
+# Sample Materials
+# ------------------------------------------------------
+
 # Produce a DATS Material for a single sample.
 
-def get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, var_lookup):
+def get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, char_templates, sample_types=None):
     samp_id = p_sample['SAMPID']['mapped_value']
     subj_id = p_sample['SUBJID']['mapped_value']
 
-    # retrieve id reference for the Identifier of the DATS Dimension for the "all subjects" consent group version of the variable
-    def get_var_id(name):
-        return var_lookup[name]['dim'].get("identifier").getIdRef()
+    # sample type - DNA or RNA. checked first so that skipped samples don't use any cached objects
+    stype = get_sample_type(p_sample, sample_types)
+    if stype is None:
+        logging.debug("couldn't determine sequence type for sample " + samp_id)
+        return None
 
     # Uberon id (or EFO id, contrary to the documentation)
     anat_id = p_sample['SMUBRID']['mapped_value']
@@ -68,22 +171,7 @@ def get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, var_looku
     dats_subj = cache.get_obj_or_ref(subj_key, lambda: dats_subject)
 
     # add sample characteristics from p_sample metadata
-    sample_chars = []
-    for key in p_sample:
-        if re.match(r'^(subject|id)$', key):
-            continue
-        # TODO - currently including only a small subset of the available values for demonstration purposes
-        if not re.match(r'^(SMATSSCR|SMRIN|SMMAPRT|SMGNSDTC)$',key):
-            continue
-        var = p_sample[key]
-#        print("got key=" + key + " var=" + str(var))
-        mapped_val = var['mapped_value']
-        char = DatsObj("Dimension", [
-                ("name", util.get_value_annotation(key, cache)),
-                ("identifier", get_var_id(key)),
-                ("values", [mapped_val])
-                ])
-        sample_chars.append(char)
+    sample_chars = characteristics.make_characteristics(cache, char_templates, p_sample)
 
     # biological/tissue sample
     biological_sample_material = DatsObj("Material", [
@@ -96,50 +184,6 @@ def get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, var_looku
             ("derivesFrom", [ dats_subj, anatomical_part ])
             ])
 
-    # analysis freeze classification
-    smafrze = p_sample['SMAFRZE']['mapped_value']
-    # expected sequence type depending on data freeze classification
-    expected_stype = None
-
-    stype = None
-    if smafrze == "RNASEQ":
-        expected_stype = "RNA"
-    elif smafrze == "WGS":
-        expected_stype = "DNA"
-    elif smafrze == "WES":
-        expected_stype = "DNA"
-    # Illumina OMNI SNP Array
-    elif smafrze == "OMNI": 
-        expected_stype = "DNA"
-    elif smafrze == "EXCLUDE":
-        pass
-    else:
-        logging.fatal("unknown SMAFRZE " + smafrze)
-        sys.exit(1)
-
-    # sample type - DNA or RNA
-    stype = None
-    smnabtcht = p_sample['SMNABTCHT']['mapped_value']
-    if re.match(r'^DNA ([iI]solation|[eE]xtraction).*', smnabtcht):
-        stype = 'DNA'
-    elif re.match(r'^RNA ([iI]solation|[eE]xtraction).*', smnabtcht):
-        stype = 'RNA'
-    elif re.match(r'DNA or RNA Extraction from Paxgene-derived Lysate Plate Based', smnabtcht):
-        stype = 'RNA'
-    elif re.match(r'Transfer To Matrix \(Manual\)', smnabtcht):
-        stype = 'DNA'
-
-    if stype is None:
-        if expected_stype is not None:
-            stype = expected_stype
-        else:
-            print("couldn't determine sequence type for smafrze=" + smafrze + " smnabtcht=" + smnabtcht)
-            return None
-    else:
-        if (expected_stype is not None) and (stype != expected_stype):
-            logging.fatal("seq type " + stype + " doesn't match expected stype " + expected_stype)
-            sys.exit(1)
-
     # DNA or RNA extract
     dna_or_rna_material = DatsObj("Material", [
             ("name", stype + " from " + samp_id),
@@ -153,7 +197,12 @@ def get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, var_looku
 
 # Produce a dict of DATS subject/donor Materials, indexed by GTEx sample id.
 
-def get_samples_dats_materials(cache, dats_subjects, p_samples, gh_samples, var_lookup):
+def get_samples_dats_materials(cache, dats_subjects, p_samples, gh_samples, var_lookup, num_procs=1, profile=characteristics.DEFAULT_SAMPLE_PROFILE):
+    char_templates = characteristics.get_sample_templates(profile, var_lookup)
+    sample_types = get_sample_type_table(p_samples)
+    if num_procs > 1 and not datsobj.DEBUG_NO_ID_REFS:
+        return get_samples_dats_materials_parallel(cache, dats_subjects, p_samples, gh_samples, char_templates, sample_types, num_procs)
+
     dats_samples = {}
 
     for s in p_samples:
@@ -161,124 +210,172 @@ def get_samples_dats_materials(cache, dats_subjects, p_samples, gh_samples, var_
         p_sample = p_samples[s]
         # sample info from GTEx GitHub id dump (may be None)
         gh_sample = None
-        if gh_sample in gh_samples:
+        if s in gh_samples:
             gh_sample = gh_samples[s]
         samp_id = p_sample['SAMPID']['mapped_value']
         subj_id = p_sample['SUBJID']['mapped_value']
         dats_subject = dats_subjects[subj_id]
-        samp_material = get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, var_lookup)
+        samp_material = get_sample_dats_material(cache, dats_subject, p_sample, gh_sample, char_templates, sample_types)
         if samp_material is None:
             continue
         dats_samples[samp_id] = samp_material
     
     return dats_samples
 
-# create Datasets for file-level links based on GitHub manifest files
-def get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, protected_cram_files, dois, no_circular_links):
-    file_datasets = []
+# ------------------------------------------------------
+# Parallel sample Material construction
+# ------------------------------------------------------
+
+# number of chunks of samples per worker process
+CHUNKS_PER_PROC = 4
+
+# per-process state set by init_samples_worker
+WORKER_STATE = None
+
+def init_samples_worker(dats_subjects, char_templates, sample_types, parent_ids):
+    global WORKER_STATE
+    WORKER_STATE = { "dats_subjects": dats_subjects, "char_templates": char_templates, "sample_types": sample_types, "parent_ids": parent_ids }
+
+# Build sample Materials for a list of (sample id, p_sample, gh_sample) using a cache shard.
+# Returns None if a fatal error was logged, since exiting from a worker would stall the pool.
+def get_samples_chunk(chunk):
+    shard = DatsObjCacheShard(WORKER_STATE['parent_ids'])
+    samples = []
+    try:
+        for (s, p_sample, gh_sample) in chunk:
+            subj_id = p_sample['SUBJID']['mapped_value']
+            dats_subject = WORKER_STATE['dats_subjects'][subj_id]
+            samp_material = get_sample_dats_material(shard, dats_subject, p_sample, gh_sample, WORKER_STATE['char_templates'], WORKER_STATE['sample_types'])
+            samples.append((p_sample['SAMPID']['mapped_value'], samp_material))
+    except SystemExit:
+        return None
+    return (samples, shard)
+
+# Same as get_samples_dats_materials, but with the samples split into consecutive chunks that are
+# processed by a pool of num_procs worker processes. Objects that more than one chunk creates for
+# the same cache key are reconciled by merge_cache_shards, so the result is equivalent to that of a
+# serial run. Subject Materials must already be in the cache.
+def get_samples_dats_materials_parallel(cache, dats_subjects, p_samples, gh_samples, char_templates, sample_types, num_procs):
+    sample_ids = list(p_samples.keys())
+
+    for s in sample_ids:
+        subj_name = dats_subjects[p_samples[s]['SUBJID']['mapped_value']].get("name")
+        if ":".join(["Material", subj_name]) not in cache.cache:
+            logging.fatal("subject " + subj_name + " must be cached before building samples in parallel")
+            sys.exit(1)
 
-    rnaseq_datatype = DatsObj("DataType", [
-            ("information", util.get_annotation("transcription profiling", cache)),
-            ("method", util.get_annotation("RNA-seq assay", cache)),
-            ("platform", util.get_annotation("Illumina", cache))
-            ])
+    n_chunks = num_procs * CHUNKS_PER_PROC
+    chunk_size = max(1, (len(sample_ids) + n_chunks - 1) // n_chunks)
+    chunks = []
+    for i in range(0, len(sample_ids), chunk_size):
+        chunks.append([(s, p_samples[s], gh_samples.get(s)) for s in sample_ids[i:i + chunk_size]])
 
-    def get_rnaseq_datatype():
-        dkey = ".".join(["DataType", "RNA-seq"])
-        return cache.get_obj_or_ref(dkey, lambda: rnaseq_datatype)
+    logging.info("building " + str(len(sample_ids)) + " sample Material(s) in " + str(len(chunks)) + " chunk(s) using " + str(num_procs) + " processes")
+    with multiprocessing.Pool(num_procs, initializer=init_samples_worker, initargs=(dats_subjects, char_templates, sample_types, cache.get_ids())) as pool:
+        results = pool.map(get_samples_chunk, chunks)
 
-    wgs_datatype = DatsObj("DataType", [
-            ("information", util.get_annotation("DNA sequencing", cache)),
-            ("method", util.get_annotation("whole genome sequencing assay", cache)),
-            ("platform", util.get_annotation("Illumina", cache))
-            ])
+    if None in results:
+        logging.fatal("failed to build sample Materials in worker process")
+        sys.exit(1)
 
-    def get_wgs_datatype():
-        dkey = ".".join(["DataType", "WGS"])
-        return cache.get_obj_or_ref(dkey, lambda: wgs_datatype)
+    datsobj.merge_cache_shards(cache, [shard for (samples, shard) in results])
 
+    dats_samples = {}
+    for (samples, shard) in results:
+        for (samp_id, samp_material) in samples:
+            if samp_material is None:
+                continue
+            dats_samples[samp_id] = samp_material
+
+    return dats_samples
+
+# ------------------------------------------------------
+# File Datasets
+# ------------------------------------------------------
+
+# DataType for the files in each GitHub manifest
+FILE_DATATYPES = {
+    "WGS": [("information", "DNA sequencing"), ("method", "whole genome sequencing assay"), ("platform", "Illumina")],
+    "RNA-Seq": [("information", "transcription profiling"), ("method", "RNA-seq assay"), ("platform", "Illumina")]
+}
+
+def get_file_datatype(cache, manifest_type):
+    dkey = ".".join(["DataType", manifest_type])
+    return cache.get_obj_or_ref(dkey, lambda: DatsObj("DataType", [(k, util.get_annotation(v, cache)) for (k, v) in FILE_DATATYPES[manifest_type]]))
+
+def get_file_data_standard(cache, format):
+    dkey = ":".join(["DataStandard", format])
+    return cache.get_obj_or_ref(dkey, lambda: DatsObj("DataStandard", [
+                ("name", format),
+                ("type", util.get_value_annotation("format", cache)),
+                ("description", format + " file format")
+                ]))
+
+def get_file_creators(cache):
     broad_key = ":".join(["Organization", "Broad Institute"])
-    broad = cache.get_obj_or_ref(broad_key, lambda: DatsObj("Organization", [("name", "Broad Institute")]))
-    creators = [broad]
-
-    def make_data_standard(format):
-        return DatsObj("DataStandard", [
-            ("name", format),
-            ("type", util.get_value_annotation("format", cache)),
-            ("description", format + " file format")
-            ])
-    
-    cram_ds_key = ":".join(["DataStandard", "CRAM"])
-    cram_ds = cache.get_obj_or_ref(cram_ds_key, lambda: make_data_standard("CRAM"))
-
-    crai_ds_key = ":".join(["DataStandard", "CRAI"])
-    crai_ds = cache.get_obj_or_ref(crai_ds_key, lambda: make_data_standard("CRAI"))
-
-    for sample_id in protected_cram_files:
-        file = protected_cram_files[sample_id]
-        material_type = None
-        ds_types = None
-        
-        # determine file type
-        if re.search(r'wgs\/', file['cram_file_aws']['raw_value']):
-            material_type = 'DNA'
-            ds_types = get_wgs_datatype()
-        elif re.search(r'rnaseq\/', file['cram_file_aws']['raw_value']):
-            material_type = 'RNA'
-            ds_types = get_rnaseq_datatype()
-        else:
-            logging.fatal("unable to determine material/sequence type from cram_file_aws=" + file['cram_file_aws']['raw_value'])
+    return [cache.get_obj_or_ref(broad_key, lambda: DatsObj("Organization", [("name", "Broad Institute")]))]
+
+# Join each manifest with its DOI table. manifests is a list of (manifest type, CRAM files, DOIs),
+# with manifest type "WGS" or "RNA-Seq" and both CRAM files and DOIs indexed by sample id. Returns
+# a list of (manifest type, sample id, CRAM file, CRAM DOI, CRAI DOI) in manifest order.
+def join_manifests_and_dois(manifests):
+    joined = []
+    for (manifest_type, protected_cram_files, dois) in manifests:
+        if manifest_type not in FILE_DATATYPES:
+            logging.fatal("unsupported manifest type " + manifest_type)
             sys.exit(1)
+        for sample_id in protected_cram_files:
+            if sample_id not in dois:
+                logging.fatal("no DOIs found for " + manifest_type + " CRAM file for sample " + sample_id)
+                sys.exit(1)
+            sample_dois = dois[sample_id]
+            joined.append((manifest_type, sample_id, protected_cram_files[sample_id], sample_dois['Sodium_GUID_cram']['raw_value'], sample_dois['Sodium_GUID_crai']['raw_value']))
+    return joined
+
+# TODO - review the following encoding decisions:
+#  - storing .crai URI as relatedIdentifier of the DatasetDistribution for the .cram file
+#  - storing MD5 checksum of the .cram file as an extraProperty of the DatasetDistribution
+#  - storing firecloud_id as a relatedIdentifier of the Dataset (not the DatasetDistribution)
+
+def make_cram_distribution(cache, access_url, size, cram_doi, crai_doi):
+    return DatsObj("DatasetDistribution", [
+            ("access", DatsObj("Access", [("accessURL", access_url)])),
+            ("identifier", DatsObj("Identifier", [("identifier", cram_doi)])),
+            ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", crai_doi), ("relationType", "cram_index") ])]),
+            ("size", size),
+            # TODO - add unit for bytes, include IRI?
+#            ("unit", util.get_value_annotation("bytes", cache))
+            ("conformsTo", [ get_file_data_standard(cache, "CRAM") ])
+            ])
 
-        # retrieve DOIs
-        sample_dois = dois[sample_id]
-        cram_doi = sample_dois['Sodium_GUID_cram']
-        crai_doi = sample_dois['Sodium_GUID_crai']
+# create Datasets for file-level links based on GitHub manifest files, in a single pass over all
+# the manifests. see join_manifests_and_dois for the format of manifests.
+def get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, manifests, no_circular_links):
+    file_datasets = []
+    counts = OrderedDict([(m[0], 0) for m in manifests])
 
+    for (manifest_type, sample_id, file, cram_doi, crai_doi) in join_manifests_and_dois(manifests):
         # RNA-Seq keys = sample_id	cram_file	cram_file_md5	cram_file_size	cram_index	cram_file_aws	cram_index_aws
         # WGS keys = same as above + firecloud_id
         cram_file = file['cram_file_gcp']['raw_value']
-        cram_file_md5 = file['cram_file_md5']['raw_value']
-
-        # TODO - review the following encoding decisions:
-        #  - storing .crai URI as relatedIdentifier of the DatasetDistribution for the .cram file
-        #  - storing MD5 checksum of the .cram file as an extraProperty of the DatasetDistribution
-        #  - storing firecloud_id as a relatedIdentifier of the Dataset (not the DatasetDistribution)
-
-        # Google Cloud Platform / Google Storage copy
-        gs_access = DatsObj("Access", [
-                ("accessURL", file['cram_file_gcp']['raw_value'])
-                ])
-        gs_distro = DatsObj("DatasetDistribution", [
-                ("access", gs_access),
-                ("identifier", DatsObj("Identifier", [("identifier", cram_doi['raw_value'])])),
-                ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", crai_doi['raw_value']), ("relationType", "cram_index") ])]),
-                ("size", int(file['cram_file_size']['raw_value'])),
-                # TODO - add unit for bytes, include IRI?
-#                ("unit", util.get_value_annotation("bytes", cache))
-                ("conformsTo", [cache.get_obj_or_ref(cram_ds_key, lambda: make_data_standard("CRAM"))])
-                ])
+        cram_file_size = int(file['cram_file_size']['raw_value'])
 
-        # AWS / S3 copy
-        s3_access = DatsObj("Access", [
-                ("accessURL", file['cram_file_aws']['raw_value'])
-                ])
-        s3_distro = DatsObj("DatasetDistribution", [
-                ("access", s3_access),
-                ("identifier", DatsObj("Identifier", [("identifier", cram_doi['raw_value'])])),
-                ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", crai_doi['raw_value']), ("relationType", "cram_index") ])]),
-                ("size", int(file['cram_file_size']['raw_value'])),
-                # TODO - add unit for bytes, include IRI?
-#                ("unit", util.get_value_annotation("bytes", cache))
-                ("conformsTo", [cache.get_obj_or_ref(cram_ds_key, lambda: make_data_standard("CRAM"))])
-                ])
+        # input RNA/DNA extract that was sequenced
+        if sample_id not in dats_samples_d:
+            logging.fatal("no sample exists for " + sample_id + " found in file " + file['cram_file_aws']['raw_value'])
+            sys.exit(1)
 
         m = re.match(r'^.*\/([^\/]+)$', cram_file)
         if m is None:
             logging.fatal("unable to parse filename from CRAM file URI " + cram_file)
             sys.exit(1)
         filename = m.group(1)
-        
+
+        # Google Cloud Platform / Google Storage copy
+        gs_distro = make_cram_distribution(cache, cram_file, cram_file_size, cram_doi, crai_doi)
+        # AWS / S3 copy
+        s3_distro = make_cram_distribution(cache, file['cram_file_aws']['raw_value'], cram_file_size, cram_doi, crai_doi)
+
         # TODO - replace this with DATS-specific MD5 checksum encoding (TBD)
         md5_dimension = DatsObj("Dimension", [
                 ("name", util.get_value_annotation("MD5", cache)),
@@ -289,8 +386,8 @@ def get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, protec
                 ("distributions", [gs_distro, s3_distro]),
                 ("dimensions", [ md5_dimension ]),
                 ("title", filename),
-                ("types", [ ds_types ]),
-                ("creators", creators),
+                ("types", [ get_file_datatype(cache, manifest_type) ]),
+                ("creators", get_file_creators(cache)),
                 ])
 
         # add firecloud_id for WGS
@@ -301,11 +398,6 @@ def get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, protec
                     ])
             ds.set("relatedIdentifiers", [f_id])
 
-        # input RNA/DNA extract that was sequenced
-        if sample_id not in dats_samples_d:
-            logging.fatal("no sample exists for " + sample_id + " found in file " + file['cram_file_aws']['raw_value'])
-            sys.exit(1)
-
         dats_sample = dats_samples_d[sample_id]
         dats_samp_key = ":".join(["Material", dats_sample.get("name")])
         dats_samp = cache.get_obj_or_ref(dats_samp_key, lambda: dats_sample)
@@ -322,6 +414,9 @@ def get_files_dats_datasets(cache, dats_samples_d, p_samples, gh_samples, protec
             
         ds.set("producedBy", da)
         file_datasets.append(ds)
+        counts[manifest_type] += 1
+
+    for manifest_type in counts:
+        logging.info("adding Datasets for " + str(counts[manifest_type]) + " " + manifest_type + " CRAM files")
 
     return file_datasets
-    
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Write the GTEx DATS instance as a root file plus a set of sample/file Dataset shards.
+#
+# The root file contains the top-level Dataset, the dbGaP study Dataset with its Study, StudyGroups
+# and subjects, and the study variable Dimensions. The sample Materials (isAbout) and file Datasets
+# (hasPart) of the study Dataset are partitioned into shards, each of which is written to a separate
+# file as a Dataset that the study Dataset lists by id reference in its hasPart. Each file Dataset is
+# placed in the shard of the sample it was produced from. Any cached object that a shard refers to but
+# that is defined in neither the root file nor the shard itself is embedded in the shard, so that
+# every shard can be read together with the root file alone.
+
+from ccmm.dats.datsobj import DatsObj, DATSEncoder
+import ccmm.dats.idrefs as idrefs
+from collections import OrderedDict
+import json
+import logging
+import os
+import re
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+SHARD_BY = ['tissue', 'count']
+DEFAULT_SHARD_SIZE = 1000
+
+# ------------------------------------------------------
+# Shard assignment
+# ------------------------------------------------------
+
+def get_shard_name_for_tissue(tissue):
+    return re.sub(r'[^A-Za-z0-9]+', '_', tissue).strip('_')
+
+# Returns a dict mapping each sample id in dats_samples_d to a shard name.
+def get_sample_shards(dats_samples_d, p_samples, shard_by, shard_size):
+    sample_to_shard = {}
+    sample_ids = sorted(dats_samples_d.keys())
+
+    if shard_by == 'tissue':
+        for samp_id in sample_ids:
+            tissue = p_samples[samp_id]['SMTSD']['mapped_value']
+            sample_to_shard[samp_id] = get_shard_name_for_tissue(tissue)
+    elif shard_by == 'count':
+        if shard_size < 1:
+            logging.fatal("shard size must be at least 1")
+            sys.exit(1)
+        for (i, samp_id) in enumerate(sample_ids):
+            sample_to_shard[samp_id] = "samples_" + "{:04d}".format((i // shard_size) + 1)
+    else:
+        logging.fatal("unsupported shard type " + shard_by)
+        sys.exit(1)
+
+    return sample_to_shard
+
+# returns the @id of the sample Material that a file Dataset was produced from
+def get_file_dataset_sample_id(file_ds):
+    inputs = file_ds.get("producedBy").get("input")
+    if len(inputs) != 1:
+        logging.fatal("expected one input for file Dataset " + file_ds.get("title") + ", found " + str(len(inputs)))
+        sys.exit(1)
+    inp = inputs[0]
+    if isinstance(inp, DatsObj):
+        return inp.get("@id")
+    return inp["@id"]
+
+# ------------------------------------------------------
+# Output
+# ------------------------------------------------------
+
+def get_shard_path(output_file, shard_name):
+    (base, ext) = os.path.splitext(output_file)
+    if ext == "":
+        ext = ".jsonld"
+    return base + ".shard." + shard_name + ext
+
+def get_index_path(output_file):
+    (base, ext) = os.path.splitext(output_file)
+    return base + ".shard_index.json"
+
+def write_json(path, obj):
+    with open(path, mode="w") as jf:
+        jf.write(json.dumps(obj, indent=2, cls=DATSEncoder))
+
+# Write gtex_dataset to output_file, with the samples and file Datasets of dbgap_study_dataset
+# split into shards, plus an index that maps sample and subject ids to shards.
+def write_sharded_dataset(output_file, gtex_dataset, dbgap_study_dataset, dats_samples_d, p_samples, shard_by, shard_size):
+    samples_l = dbgap_study_dataset.get("isAbout")
+    file_datasets_l = dbgap_study_dataset.get("hasPart")
+    sample_to_shard = get_sample_shards(dats_samples_d, p_samples, shard_by, shard_size)
+
+    # map sample Material @id to sample id
+    sample_obj_id_to_id = {}
+    for samp_id in dats_samples_d:
+        sample_obj_id_to_id[dats_samples_d[samp_id].get("@id")] = samp_id
+
+    # partition samples and file Datasets, keeping shards in order of first appearance
+    shards = {}
+    shard_names = []
+
+    def get_shard(name):
+        if name not in shards:
+            shards[name] = { "name": name, "samples": [], "file_datasets": [], "sample_ids": [] }
+            shard_names.append(name)
+        return shards[name]
+
+    for s in samples_l:
+        samp_id = sample_obj_id_to_id[s.get("@id")]
+        shard = get_shard(sample_to_shard[samp_id])
+        shard['samples'].append(s)
+        shard['sample_ids'].append(samp_id)
+
+    for fds in file_datasets_l:
+        sample_obj_id = get_file_dataset_sample_id(fds)
+        if sample_obj_id not in sample_obj_id_to_id:
+            logging.fatal("file Dataset " + fds.get("title") + " was not produced from a known sample")
+            sys.exit(1)
+        get_shard(sample_to_shard[sample_obj_id_to_id[sample_obj_id]])['file_datasets'].append(fds)
+
+    # create shard Datasets
+    shard_datasets = []
+    for name in shard_names:
+        shard = shards[name]
+        shard['dataset'] = DatsObj("Dataset", [
+            ("title", "GTEx v7 " + name),
+            ("description", "GTEx v7 samples and files in shard " + name),
+            ("isAbout", shard['samples']),
+            ("hasPart", shard['file_datasets'])
+            ])
+        shard_datasets.append(shard['dataset'])
+
+    # index all objects by @id, to resolve references that cross files
+    id_to_obj = idrefs.index_objs(gtex_dataset)
+    for sds in shard_datasets:
+        idrefs.index_objs(sds, id_to_obj)
+
+    # root file: study Dataset refers to shard Datasets instead of containing samples and files
+    shard_ids = [sds.get("@id") for sds in shard_datasets]
+    study_data = dbgap_study_dataset.data
+    root_study_data = OrderedDict([(k, v) for (k, v) in study_data.items() if k != "isAbout"])
+    root_study_data["hasPart"] = [sds.getIdRef() for sds in shard_datasets]
+    dbgap_study_dataset.data = root_study_data
+    swaps = []
+    try:
+        swaps = idrefs.inline_missing_id_refs(gtex_dataset, id_to_obj, shard_ids)
+        root_ids = idrefs.index_objs(gtex_dataset)
+        logging.info("writing root Dataset to " + output_file)
+        write_json(output_file, gtex_dataset)
+    finally:
+        idrefs.restore_id_refs(swaps)
+        dbgap_study_dataset.data = study_data
+
+    # shards
+    index = { "root": os.path.basename(output_file), "shard_by": shard_by, "shards": [], "samples": {}, "subjects": {} }
+
+    for name in shard_names:
+        shard = shards[name]
+        path = get_shard_path(output_file, name)
+        swaps = idrefs.inline_missing_id_refs(shard['dataset'], id_to_obj, root_ids)
+        try:
+            logging.info("writing shard " + name + " with " + str(len(shard['samples'])) + " sample(s) and " + str(len(shard['file_datasets'])) + " file Dataset(s) to " + path)
+            write_json(path, shard['dataset'])
+        finally:
+            idrefs.restore_id_refs(swaps)
+
+        index['shards'].append({
+            "name": name,
+            "file": os.path.basename(path),
+            "@id": shard['dataset'].get("@id"),
+            "n_samples": len(shard['samples']),
+            "n_file_datasets": len(shard['file_datasets'])
+            })
+        for samp_id in shard['sample_ids']:
+            index['samples'][samp_id] = name
+            subj_id = p_samples[samp_id]['SUBJID']['mapped_value']
+            if subj_id not in index['subjects']:
+                index['subjects'][subj_id] = []
+            if name not in index['subjects'][subj_id]:
+                index['subjects'][subj_id].append(name)
+
+    index_path = get_index_path(output_file)
+    logging.info("writing index of " + str(len(shard_names)) + " shard(s) to " + index_path)
+    with open(index_path, mode="w") as jf:
+        jf.write(json.dumps(index, indent=2))
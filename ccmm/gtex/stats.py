@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Summary statistics for the GTEx Portal subject phenotype and sample attribute files.
+#
+# Statistics are computed directly from the columns of the parsed files (see
+# ccmm.gtex.parsers.portal_files.read_sample_attributes_columns), without building per-row dicts
+# or DATS objects.
+
+import ccmm.gtex.parsers.portal_files as portal_files
+import ccmm.util as util
+from collections import OrderedDict
+import json
+import logging
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# variables whose distributions are reported by default
+DEFAULT_SUBJECT_VARS = ['SEX', 'AGE', 'DTHHRDY']
+DEFAULT_SAMPLE_VARS = ['SMAFRZE', 'SMCENTER', 'SMATSSCR', 'SMRIN', 'SMTSISCH']
+
+# columns needed for the subject/sample histograms and tissue counts
+SAMPLE_STATS_COLS = ['SAMPID', 'SMTS', 'SMTSD', 'SMAFRZE']
+
+OUTPUT_FORMATS = ['tsv', 'json']
+
+# ------------------------------------------------------
+# Statistics
+# ------------------------------------------------------
+
+# Returns a summary of the distribution of values: counts of each value for categorical variables,
+# or n/min/max/mean/median for variables whose non-empty values are all numeric.
+def get_distribution(values):
+    present = [v for v in values if v is not None]
+    n_missing = len(values) - len(present)
+    try:
+        nums = sorted([float(v) for v in present])
+    except ValueError:
+        nums = None
+
+    if nums is not None and len(nums) > 0:
+        n = len(nums)
+        if n % 2 == 1:
+            median = nums[n // 2]
+        else:
+            median = (nums[n // 2 - 1] + nums[n // 2]) / 2.0
+        return OrderedDict([
+            ("type", "numeric"),
+            ("n", n),
+            ("n_missing", n_missing),
+            ("min", nums[0]),
+            ("max", nums[-1]),
+            ("mean", sum(nums) / n),
+            ("median", median)
+        ])
+
+    counts = util.count_values(present)
+    return OrderedDict([
+        ("type", "categorical"),
+        ("n", len(present)),
+        ("n_missing", n_missing),
+        ("counts", OrderedDict([(v, counts[v]) for v in sorted(counts, key=lambda v: (-counts[v], v))]))
+    ])
+
+# Returns the indexes of the entries in column that have value, or all indexes if value is None.
+def get_selected_rows(column, value):
+    if value is None:
+        return list(range(len(column)))
+    return [i for (i, v) in enumerate(column) if v == value]
+
+# Compute statistics from the GTEx subject phenotype and sample attribute files.
+#
+# smafrze - restrict to samples with this analysis freeze (SMAFRZE) value and their subjects
+def get_stats(subject_phenotypes_path, sample_attributes_path, smafrze=None, subject_vars=DEFAULT_SUBJECT_VARS, sample_vars=DEFAULT_SAMPLE_VARS):
+    subj_cols = ['SUBJID'] + [v for v in subject_vars if v != 'SUBJID']
+    samp_cols = SAMPLE_STATS_COLS + [v for v in sample_vars if v not in SAMPLE_STATS_COLS]
+    p_subjects = portal_files.read_subject_phenotypes_columns(subject_phenotypes_path, subj_cols)
+    p_samples = portal_files.read_sample_attributes_columns(sample_attributes_path, samp_cols)
+
+    # subject id of each sample
+    samp_subj_ids = []
+    for sampid in p_samples['SAMPID']:
+        subjid = portal_files.get_sample_subject_id(sampid)
+        if subjid is None:
+            logging.fatal("Unable to parse subject id from SAMPID '" + sampid + "'")
+            sys.exit(1)
+        samp_subj_ids.append(subjid)
+
+    # selected samples and subjects
+    samp_rows = get_selected_rows(p_samples['SMAFRZE'], smafrze)
+    if smafrze is not None:
+        logging.info("Found " + str(len(samp_rows)) + "/" + str(len(samp_subj_ids)) + " sample(s) with SMAFRZE=" + smafrze)
+        subj_ids_selected = dict([(samp_subj_ids[i], True) for i in samp_rows])
+        subj_rows = [i for (i, s) in enumerate(p_subjects['SUBJID']) if s in subj_ids_selected]
+    else:
+        subj_rows = list(range(len(p_subjects['SUBJID'])))
+
+    histogram = util.get_subject_sample_count_histogram([samp_subj_ids[i] for i in samp_rows])
+    n_subjects_with_samples = sum([h[1] for h in histogram])
+
+    stats = OrderedDict()
+    stats['smafrze'] = smafrze
+    stats['n_subjects'] = len(subj_rows)
+    stats['n_subjects_with_samples'] = n_subjects_with_samples
+    stats['n_samples'] = len(samp_rows)
+    stats['subject_sample_count_histogram'] = [OrderedDict([("n_samples", h[0]), ("n_subjects", h[1])]) for h in histogram]
+
+    # tissue counts
+    for col in ('SMTS', 'SMTSD'):
+        counts = util.count_values([p_samples[col][i] for i in samp_rows])
+        stats['tissue_counts_' + col] = OrderedDict([(t, counts[t]) for t in sorted(counts)])
+
+    # per-variable distributions
+    stats['subject_variables'] = OrderedDict([(v, get_distribution([p_subjects[v][i] for i in subj_rows])) for v in subject_vars])
+    stats['sample_variables'] = OrderedDict([(v, get_distribution([p_samples[v][i] for i in samp_rows])) for v in sample_vars])
+
+    return stats
+
+# ------------------------------------------------------
+# Output
+# ------------------------------------------------------
+
+def write_stats_json(stats, fh):
+    fh.write(json.dumps(stats, indent=2))
+    fh.write("\n")
+
+# Write stats as a series of tab-delimited tables, each preceded by a "# title" line.
+def write_stats_tsv(stats, fh):
+    def write_table(title, header, rows):
+        fh.write("# " + title + "\n")
+        fh.write("\t".join(header) + "\n")
+        for r in rows:
+            fh.write("\t".join([str(x) for x in r]) + "\n")
+        fh.write("\n")
+
+    write_table("summary", ["statistic", "value"], [(k, stats[k]) for k in ('smafrze', 'n_subjects', 'n_subjects_with_samples', 'n_samples')])
+    write_table("histogram of number of subjects that have a given number of samples", ["n_samples", "n_subjects"], [(h['n_samples'], h['n_subjects']) for h in stats['subject_sample_count_histogram']])
+    for col in ('SMTS', 'SMTSD'):
+        counts = stats['tissue_counts_' + col]
+        write_table("sample counts by tissue (" + col + ")", ["tissue", "n_samples"], [(t, counts[t]) for t in counts])
+
+    for vtype in ('subject_variables', 'sample_variables'):
+        for v in stats[vtype]:
+            dist = stats[vtype][v]
+            if dist['type'] == 'numeric':
+                write_table(v + " distribution", ["statistic", "value"], [(k, dist[k]) for k in dist if k != 'type'])
+            else:
+                rows = [(val, dist['counts'][val]) for val in dist['counts']]
+                rows.append(("(missing)", dist['n_missing']))
+                write_table(v + " distribution", ["value", "count"], rows)
+
+def write_stats(stats, fh, format):
+    if format == 'json':
+        write_stats_json(stats, fh)
+    elif format == 'tsv':
+        write_stats_tsv(stats, fh)
+    else:
+        logging.fatal("unsupported output format " + format)
+        sys.exit(1)
@@ -2,45 +2,17 @@
 
 from ccmm.dats.datsobj import DatsObj
 import ccmm.dats.util as util
+import ccmm.gtex.characteristics as characteristics
 import logging
 import sys
 
 # Produce a DATS Material for a single subject/donor.
 
-def get_subject_dats_material(cache, p_subject, gh_subject, var_lookup):
+def get_subject_dats_material(cache, p_subject, gh_subject, char_templates):
     subj_id = p_subject['SUBJID']['mapped_value']
 
-    # retrieve id reference for the Identifier of the DATS Dimension for the "all subjects" consent group version of the variable
-    def get_var_id(name):
-        return var_lookup[name]['dim'].get("identifier").getIdRef()
-
     # human experimental subject/patient
-    subject_sex = DatsObj("Dimension", [
-            ("name", util.get_value_annotation("Gender", cache)),
-            ("description", "Gender of the subject"),
-            ("identifier", get_var_id("SEX")),
-            ("values", [ p_subject['SEX']['mapped_value'] ])
-            ])
-
-    subject_age = DatsObj("Dimension", [
-            ("name", util.get_value_annotation("Age range", cache)),
-            ("description", "Age range of the subject"),
-            ("identifier", get_var_id("AGE")),
-            ("values", [ p_subject['AGE']['mapped_value'] ])
-            ])
-
-    subject_hardy_scale = DatsObj("Dimension", [
-            ("name", util.get_value_annotation("Hardy scale", cache)),
-            ("description", "Hardy scale death classification for the subject"),
-            ("identifier", get_var_id("DTHHRDY")),
-            ("values", [ p_subject['DTHHRDY']['mapped_value'] ])
-            ])
-
-    subject_characteristics = [
-        subject_sex,
-        subject_age,
-        subject_hardy_scale
-        ]
+    subject_characteristics = characteristics.make_characteristics(cache, char_templates, p_subject)
 
     # use URI from GTEx id dump if present
     identifier = subj_id
@@ -65,8 +37,9 @@ def get_subject_dats_material(cache, p_subject, gh_subject, var_lookup):
 
 # Produce a dict of DATS subject/donor Materials, indexed by GTEx subject id.
 
-def get_subjects_dats_materials(cache, p_subjects, gh_subjects, var_lookup):
+def get_subjects_dats_materials(cache, p_subjects, gh_subjects, var_lookup, profile=characteristics.DEFAULT_SUBJECT_PROFILE):
     dats_subjects = {}
+    char_templates = characteristics.get_subject_templates(profile, var_lookup)
 
     for s in p_subjects:
         # subject phenotype info from GTEx Portal file
@@ -74,7 +47,7 @@ def get_subjects_dats_materials(cache, p_subjects, gh_subjects, var_lookup):
         # subject info from GTEx GitHub id dump
         gh_subject = gh_subjects[s]
         subj_id = p_subject['SUBJID']['mapped_value']
-        subj_material = get_subject_dats_material(cache, p_subject, gh_subject, var_lookup)
+        subj_material = get_subject_dats_material(cache, p_subject, gh_subject, char_templates)
         dats_subjects[subj_id] = subj_material
     
     return dats_subjects
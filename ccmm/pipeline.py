@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+# Minimal stage-based pipeline runner with per-stage timing, memory sampling and on-disk checkpoints.
+#
+# A pipeline is an ordered list of Stages that share a context dict. Each Stage names the context
+# entries it reads (inputs) and writes (outputs), along with the command-line arguments it depends
+# on. Stages must be listed in dependency order, i.e., every input must either be in the initial
+# context or be an output of an earlier stage.
+#
+# If a checkpoint directory is given then the whole context is pickled after each checkpointed
+# stage. The context is saved as a single pickle (rather than one pickle per output) so that objects
+# shared between outputs (e.g., DatsObjs referenced by both a Study and a Dataset) remain shared
+# after a resume. Each checkpoint carries a fingerprint that covers the names, code and argument
+# values of its stage and all preceding stages, so a checkpoint is only reused if nothing upstream
+# of it has changed. The code of a stage includes the source of the file that defines its function
+# and of every module in the ccmm package, since stages do most of their work in library code. The
+# argument values include the size and modification time of input files and of every file in input
+# directories.
+
+import hashlib
+import logging
+import os
+import pickle
+import resource
+import sys
+import time
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+CHECKPOINT_SUFFIX = ".ckpt"
+
+# directory of the ccmm package, whose source is included in every stage fingerprint
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ------------------------------------------------------
+# Fingerprints
+# ------------------------------------------------------
+
+# Update hash h with the names (relative to base_dir) and contents of the files in paths.
+def hash_files(h, paths, base_dir):
+    for path in paths:
+        h.update(os.path.relpath(path, base_dir).encode('utf-8'))
+        with open(path, "rb") as fh:
+            h.update(fh.read())
+
+# Returns the paths of the .py files under dir, in a fixed order.
+def get_source_files(dir):
+    paths = []
+    for (dirpath, dirnames, filenames) in os.walk(dir):
+        dirnames.sort()
+        for f in sorted(filenames):
+            if f.endswith(".py"):
+                paths.append(os.path.join(dirpath, f))
+    return paths
+
+# Returns a fingerprint of the source of the ccmm package.
+def get_package_fingerprint():
+    h = hashlib.sha1()
+    hash_files(h, get_source_files(PACKAGE_DIR), PACKAGE_DIR)
+    return h.hexdigest()
+
+# Update hash h with the bytecode, constants and names of code object co, including those of any
+# nested functions (whose code objects appear in co_consts.)
+def hash_code(h, co):
+    h.update(co.co_code)
+    h.update(",".join(co.co_names).encode('utf-8'))
+    for c in co.co_consts:
+        if hasattr(c, 'co_code'):
+            hash_code(h, c)
+        else:
+            h.update(repr(c).encode('utf-8'))
+
+# Update hash h with the size and modification time of the file at path or, if path is a directory,
+# of every file under it.
+def hash_file_stats(h, path):
+    paths = [path]
+    if os.path.isdir(path):
+        paths = []
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames.sort()
+            paths.extend([os.path.join(dirpath, f) for f in sorted(filenames)])
+    for p in paths:
+        st = os.stat(p)
+        h.update((os.path.relpath(p, path) + ":" + str(st.st_size) + ":" + str(st.st_mtime)).encode('utf-8'))
+
+# ------------------------------------------------------
+# Memory usage
+# ------------------------------------------------------
+
+# Returns (current RSS, peak RSS) of this process in MB. Current RSS is None where /proc is unavailable.
+def get_memory_usage():
+    # ru_maxrss is in KB on Linux and bytes on Mac OS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_mb = peak / (1024.0 * 1024.0)
+    else:
+        peak_mb = peak / 1024.0
+
+    current_mb = None
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+            current_mb = pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError):
+        pass
+
+    return (current_mb, peak_mb)
+
+# ------------------------------------------------------
+# Stage
+# ------------------------------------------------------
+
+# A single pipeline stage. fn is called as fn(args, ctx) and must return a dict containing exactly
+# the keys listed in outputs (or None if there are no outputs.)
+class Stage:
+    name = None
+    fn = None
+    inputs = None
+    outputs = None
+    args = None
+    checkpoint = None
+
+    def __init__(self, name, fn, inputs=[], outputs=[], args=[], checkpoint=True):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.args = list(args)
+        self.checkpoint = checkpoint
+
+    # fingerprint of this stage, given the fingerprint of the preceding stage, which includes that
+    # of the ccmm package source (see get_package_fingerprint)
+    def get_fingerprint(self, args, prev_fingerprint):
+        h = hashlib.sha1()
+        h.update(prev_fingerprint.encode('utf-8'))
+        h.update(self.name.encode('utf-8'))
+        h.update(",".join(self.inputs).encode('utf-8'))
+        h.update(",".join(self.outputs).encode('utf-8'))
+        hash_code(h, self.fn.__code__)
+        # the file that defines the stage function, including any helpers that it calls
+        fn_file = self.fn.__code__.co_filename
+        if os.path.isfile(fn_file):
+            hash_files(h, [fn_file], os.path.dirname(fn_file))
+        for a in self.args:
+            value = getattr(args, a)
+            h.update((a + "=" + repr(value)).encode('utf-8'))
+            # include size and modification time of input files and of the files in input directories
+            if isinstance(value, str) and os.path.exists(value):
+                hash_file_stats(h, value)
+        return h.hexdigest()
+
+# ------------------------------------------------------
+# Pipeline
+# ------------------------------------------------------
+
+class Pipeline:
+    name = None
+    stages = None
+    checkpoint_dir = None
+    timings = None
+
+    def __init__(self, name, stages, checkpoint_dir=None):
+        self.name = name
+        self.stages = stages
+        self.checkpoint_dir = checkpoint_dir
+        self.timings = []
+
+    # check that stage names are unique and that stages are listed in dependency order
+    def check_stages(self, initial_keys=[]):
+        names = {}
+        available = dict([(k, True) for k in initial_keys])
+        for s in self.stages:
+            if s.name in names:
+                logging.fatal("duplicate pipeline stage name " + s.name)
+                sys.exit(1)
+            names[s.name] = True
+            for i in s.inputs:
+                if i not in available:
+                    logging.fatal("pipeline stage " + s.name + " input '" + i + "' is not an output of any earlier stage")
+                    sys.exit(1)
+            for o in s.outputs:
+                available[o] = True
+
+    def get_checkpoint_path(self, index, stage):
+        filename = self.name + "." + "{:02d}".format(index) + "." + stage.name + CHECKPOINT_SUFFIX
+        return os.path.join(self.checkpoint_dir, filename)
+
+    def get_fingerprints(self, args):
+        fingerprints = []
+        fp = self.name + ":" + get_package_fingerprint()
+        for s in self.stages:
+            fp = s.get_fingerprint(args, fp)
+            fingerprints.append(fp)
+        return fingerprints
+
+    # write context to checkpoint file. the header is pickled separately so that it can be checked without loading the context
+    def write_checkpoint(self, index, stage, fingerprint, ctx):
+        path = self.get_checkpoint_path(index, stage)
+        tmp_path = path + ".tmp"
+        t0 = time.perf_counter()
+        with open(tmp_path, "wb") as fh:
+            pickle.dump({ "pipeline": self.name, "stage": stage.name, "fingerprint": fingerprint }, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(ctx, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        elapsed = time.perf_counter() - t0
+        logging.info("wrote checkpoint " + path + " (" + str(os.path.getsize(path)) + " bytes) in " + "{:.1f}".format(elapsed) + "s")
+
+    # returns True if the checkpoint at index exists and matches fingerprint
+    def checkpoint_is_valid(self, index, stage, fingerprint):
+        path = self.get_checkpoint_path(index, stage)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "rb") as fh:
+                header = pickle.load(fh)
+        except Exception as e:
+            logging.warn("unable to read checkpoint " + path + ": " + str(e))
+            return False
+        if header.get("fingerprint") != fingerprint:
+            logging.info("checkpoint " + path + " is out of date")
+            return False
+        return True
+
+    def read_checkpoint(self, index, stage):
+        path = self.get_checkpoint_path(index, stage)
+        t0 = time.perf_counter()
+        with open(path, "rb") as fh:
+            pickle.load(fh)
+            ctx = pickle.load(fh)
+        elapsed = time.perf_counter() - t0
+        logging.info("read checkpoint " + path + " in " + "{:.1f}".format(elapsed) + "s")
+        return ctx
+
+    # index of the last stage with a valid checkpoint, or -1 if there is none
+    def find_resume_point(self, fingerprints):
+        if self.checkpoint_dir is None:
+            return -1
+        for i in range(len(self.stages) - 1, -1, -1):
+            s = self.stages[i]
+            if s.checkpoint and self.checkpoint_is_valid(i, s, fingerprints[i]):
+                return i
+        return -1
+
+    # run the pipeline, optionally resuming from the last valid checkpoint
+    def run(self, args, ctx=None, resume=False):
+        if ctx is None:
+            ctx = {}
+        self.check_stages(ctx.keys())
+        self.timings = []
+        fingerprints = self.get_fingerprints(args)
+
+        if self.checkpoint_dir is not None and not os.path.isdir(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+
+        start = 0
+        if resume:
+            last = self.find_resume_point(fingerprints)
+            if last >= 0:
+                ctx = self.read_checkpoint(last, self.stages[last])
+                start = last + 1
+                logging.info("resuming " + self.name + " after stage " + self.stages[last].name)
+            else:
+                logging.info("no valid checkpoint found for " + self.name + ", running all stages")
+
+        for i in range(start, len(self.stages)):
+            s = self.stages[i]
+            for inp in s.inputs:
+                if inp not in ctx:
+                    logging.fatal("pipeline stage " + s.name + " is missing input '" + inp + "'")
+                    sys.exit(1)
+
+            logging.info("starting stage " + s.name)
+            t0 = time.perf_counter()
+            result = s.fn(args, ctx)
+            elapsed = time.perf_counter() - t0
+            (current_mb, peak_mb) = get_memory_usage()
+
+            if result is None:
+                result = {}
+            if sorted(result.keys()) != sorted(s.outputs):
+                logging.fatal("pipeline stage " + s.name + " returned " + ",".join(sorted(result.keys())) + " but declares outputs " + ",".join(sorted(s.outputs)))
+                sys.exit(1)
+            ctx.update(result)
+
+            mem_str = "peak RSS " + "{:.0f}".format(peak_mb) + " MB"
+            if current_mb is not None:
+                mem_str = "RSS " + "{:.0f}".format(current_mb) + " MB, " + mem_str
+            logging.info("finished stage " + s.name + " in " + "{:.1f}".format(elapsed) + "s (" + mem_str + ")")
+            self.timings.append({ "stage": s.name, "secs": elapsed, "rss_mb": current_mb, "peak_rss_mb": peak_mb })
+
+            if self.checkpoint_dir is not None and s.checkpoint:
+                self.write_checkpoint(i, s, fingerprints[i], ctx)
+
+        self.log_timings()
+        return ctx
+
+    def log_timings(self):
+        if len(self.timings) == 0:
+            return
+        total = 0
+        logging.info("{:<20s} {:>10s} {:>10s} {:>10s}".format("stage", "secs", "RSS_MB", "peak_MB"))
+        for t in self.timings:
+            total += t['secs']
+            rss = "-" if t['rss_mb'] is None else "{:.0f}".format(t['rss_mb'])
+            logging.info("{:<20s} {:>10.1f} {:>10s} {:>10.0f}".format(t['stage'], t['secs'], rss, t['peak_rss_mb']))
+        logging.info("{:<20s} {:>10.1f}".format("total", total))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Subject/sample subset selection for partial and test builds.
+#
+# A Subset is applied to the parsed input files before any DATS objects are created, so that
+# subject Materials, sample Materials and file Datasets are only built for the selected subjects
+# and samples. Random selection is done per subject (so that a selected subject keeps all of
+# its selected samples) and is reproducible for a given seed and set of subject ids.
+
+import logging
+import os
+import random
+import sys
+
+# ------------------------------------------------------
+# Subset
+# ------------------------------------------------------
+
+class Subset:
+    subject_ids = None
+    sample_ids = None
+    tissues = None
+    analysis_freezes = None
+    fraction = None
+    seed = None
+
+    def __init__(self, subject_ids=None, sample_ids=None, tissues=None, analysis_freezes=None, fraction=None, seed=0):
+        self.subject_ids = list_to_dict(subject_ids)
+        self.sample_ids = list_to_dict(sample_ids)
+        self.tissues = list_to_dict(tissues)
+        self.analysis_freezes = list_to_dict(analysis_freezes)
+        self.fraction = fraction
+        self.seed = seed
+
+        if fraction is not None and (fraction <= 0 or fraction > 1):
+            logging.fatal("subset fraction must be greater than 0 and at most 1")
+            sys.exit(1)
+
+    # whether any sample-level filter is in effect
+    def has_sample_filter(self):
+        return (self.sample_ids is not None) or (self.tissues is not None) or (self.analysis_freezes is not None)
+
+    def __str__(self):
+        descrs = []
+        if self.subject_ids is not None:
+            descrs.append(str(len(self.subject_ids)) + " subject id(s)")
+        if self.sample_ids is not None:
+            descrs.append(str(len(self.sample_ids)) + " sample id(s)")
+        if self.tissues is not None:
+            descrs.append("tissue(s) " + ",".join(self.tissues.keys()))
+        if self.analysis_freezes is not None:
+            descrs.append("SMAFRZE " + ",".join(self.analysis_freezes.keys()))
+        if self.fraction is not None:
+            descrs.append("fraction " + str(self.fraction) + " of subjects with seed " + str(self.seed))
+        return "; ".join(descrs)
+
+    # whether a subject identified by any of ids (e.g., study and dbGaP subject id) passes the subject id filter
+    def subject_id_selected(self, ids):
+        if self.subject_ids is None:
+            return True
+        for i in ids:
+            if i in self.subject_ids:
+                return True
+        return False
+
+    # whether a sample identified by any of ids passes the sample id filter
+    def sample_id_selected(self, ids):
+        if self.sample_ids is None:
+            return True
+        for i in ids:
+            if i in self.sample_ids:
+                return True
+        return False
+
+    # whether a tissue (e.g., GTEx SMTS or SMTSD) passes the tissue filter
+    def tissue_selected(self, tissues):
+        if self.tissues is None:
+            return True
+        for t in tissues:
+            if t in self.tissues:
+                return True
+        return False
+
+    def analysis_freeze_selected(self, afrze):
+        if self.analysis_freezes is None:
+            return True
+        return afrze in self.analysis_freezes
+
+    # Returns a dict of the ids in subject_ids that are chosen by the random fraction filter.
+    def select_fraction(self, subject_ids):
+        ids = sorted(subject_ids)
+        if self.fraction is None:
+            return list_to_dict(ids)
+        rng = random.Random(self.seed)
+        selected = {}
+        for i in ids:
+            if rng.random() < self.fraction:
+                selected[i] = True
+        return selected
+
+# ------------------------------------------------------
+# Command-line options
+# ------------------------------------------------------
+
+def add_subset_args(parser, gtex_filters=False):
+    parser.add_argument('--subset_subjects', required=False, help ='Comma-delimited list of subject ids, or path to a file with one subject id per line. Only these subjects will be included in the output.')
+    parser.add_argument('--subset_samples', required=False, help ='Comma-delimited list of sample ids, or path to a file with one sample id per line. Only these samples will be included in the output.')
+    if gtex_filters:
+        parser.add_argument('--subset_tissues', required=False, help ='Comma-delimited list of tissues (SMTS or SMTSD values). Only samples from these tissues will be included in the output.')
+        parser.add_argument('--subset_smafrze', required=False, help ='Comma-delimited list of analysis freezes (SMAFRZE values) e.g., RNASEQ,WGS. Only samples in these freezes will be included in the output.')
+    parser.add_argument('--subset_fraction', required=False, type=float, help ='Include only a random fraction (0-1] of the subjects, and only their samples, in the output.')
+    parser.add_argument('--subset_seed', required=False, type=int, default=0, help ='Random seed used with --subset_fraction.')
+
+# Returns the Subset specified by the options added by add_subset_args, or None if there are none.
+def get_subset_from_args(args):
+    subject_ids = parse_id_list(args.subset_subjects)
+    sample_ids = parse_id_list(args.subset_samples)
+    tissues = None
+    analysis_freezes = None
+    if hasattr(args, 'subset_tissues'):
+        tissues = parse_list(args.subset_tissues)
+        analysis_freezes = parse_list(args.subset_smafrze)
+
+    if subject_ids is None and sample_ids is None and tissues is None and analysis_freezes is None and args.subset_fraction is None:
+        return None
+
+    subset = Subset(subject_ids, sample_ids, tissues, analysis_freezes, args.subset_fraction, args.subset_seed)
+    logging.warn("restricting output to subset: " + str(subset))
+    return subset
+
+# ------------------------------------------------------
+# Utility functions
+# ------------------------------------------------------
+
+def list_to_dict(l):
+    if l is None:
+        return None
+    return dict([(x, True) for x in l])
+
+def parse_list(value):
+    if value is None:
+        return None
+    return [v.strip() for v in value.split(",") if v.strip() != ""]
+
+# parse comma-delimited list or file with one id per line
+def parse_id_list(value):
+    if value is None:
+        return None
+    if os.path.isfile(value):
+        with open(value) as fh:
+            return [line.strip() for line in fh if line.strip() != "" and not line.startswith("#")]
+    return parse_list(value)
+
+# Returns a copy of d that contains only the keys in keep, in the original order.
+def filter_dict(d, keep):
+    return dict([(k, d[k]) for k in d if k in keep])
@@ -2,6 +2,9 @@
 
 from ccmm.dats.datsobj import DatsObj
 import ccmm.dats.util as util
+import ccmm.util
+import ccmm.dbgap.var_stats as var_stats
+import ccmm.topmed.harmonized
 from collections import OrderedDict
 import csv
 import json
@@ -18,9 +21,20 @@ import sys
 # DATS JSON Output
 # ------------------------------------------------------
 
+# Returns the median of the variable at pos in stats as a string, like the other variable values, or None.
+def get_median_value(stats, pos):
+    median = stats.get_median_at(pos)
+    if median is None:
+        return None
+    return str(var_stats.get_number(median))
+
 # Pick representative and/or legal value for each variable in vars and place it in vdict
-def pick_var_values(vars, vdict):
-    for var in vars:
+# stats - VarReportStats for vars, built here if not supplied
+def pick_var_values(vars, vdict, stats=None):
+    if stats is None:
+        stats = var_stats.VarReportStats(vars)
+
+    for (pos, var) in enumerate(vars):
         vname = var['var_name']
         values = None
         value = None
@@ -37,18 +51,16 @@ def pick_var_values(vars, vdict):
             values = var['total']['stats']['values']
         # take the median if defined
         elif (var['reported_type'] == 'integer') or (var['calculated_type'] == 'integer'):
-            value = var['total']['stats']['median']
+            value = get_median_value(stats, pos)
         elif (var['reported_type'] == 'decimal') or (var['calculated_type'] == 'decimal'):
-            value = var['total']['stats']['median']
+            value = get_median_value(stats, pos)
         else:
             logging.fatal("unexpected variable reported_type=" + var['reported_type'])
             sys.exit(1)
 
         if values is not None:
-            # sort values by count and then alphanumerically
-            sorted_values = sorted(values, key=lambda x: int(x['count']), reverse=True)
-            sorted_values.sort(key=lambda x: x['name'])
-            value = sorted_values[0]['name']
+            # most frequent value, ties broken alphanumerically
+            value = stats.get_modal_value_at(pos)
         
         if (vname in vdict) and (vdict[vname] is not None) and (value is not None) and (vdict[vname]["value"] != value):
             logging.warn("previous value (" + vdict[vname]["value"] + ") for variable " + vname + " overwritten with " + value)
@@ -59,7 +71,10 @@ def pick_var_values(vars, vdict):
     return vdict
 
 # Generate DATS JSON for a single sample/DNA extract
-def get_single_dna_extract_json(cache, study, study_md, subj_var_values, samp_var_values):
+#
+# subj_harmonized - harmonized variable values for the subject (see ccmm.topmed.harmonized.) These
+# are computed from subj_var_values if not given.
+def get_single_dna_extract_json(cache, study, study_md, subj_var_values, samp_var_values, subj_harmonized=None):
     # Almost all samples in TOPMed WGS phase are blood samples, named "Blood", "Peripheral Blood"...
     # Few samples are saliva samples probably due to sample collection issues
     name = None
@@ -92,33 +107,6 @@ def get_single_dna_extract_json(cache, study, study_md, subj_var_values, samp_va
             ("identifier", "http://purl.obolibrary.org/obo/UBERON_" + str(anat_id)),
             ("identifierSource", "UBERON")])]
 
-    # extract subject attributes
-    gender = None
-    age = None
-    visit_year = None
-    sys_bp = None
-    dias_bp = None
-    disease = {}
-    disease['hypertension'] = "unknown"
-    
-    for name in subj_var_values:
-        name_upper = name.upper()
-        if name_upper == "GENDER" or name_upper == "SEX":
-            gender = subj_var_values[name]['value'].lower()
-        elif name_upper == "VISIT_AGE" or name_upper == "AGE" or name_upper == "AGE_ENROLL": #need to confirm that these  allmean the same thing
-            age = subj_var_values[name]['value']
-        elif name_upper == "VISIT_YEAR":
-            visit_year =  subj_var_values[name]['value']
-        elif name_upper == "SYSBP":
-            sys_bp = subj_var_values[name]['value']
-        elif name_upper == "DIASBP":
-            dias_bp = subj_var_values[name]['value']
-        elif name_upper == "HYPERTENSION" or name_upper == "HIGHBLOODPRES":
-            if subj_var_values[name]['value'].lower() == "yes" or subj_var_values[name]['value'] == '1':
-                disease['hypertension'] = "yes"
-            elif re.match(r'\S', subj_var_values[name]['value']):
-                disease['hypertension'] = "no"
-
     # anatomical part
     anatomical_part = None
     if anatomy_name is not None:
@@ -128,66 +116,10 @@ def get_single_dna_extract_json(cache, study, study_md, subj_var_values, samp_va
             ("alternateIdentifiers", anatomy_alt_ids)
         ])
 
-    subject_characteristics = []
-    subject_bearerOfDisease = []
-
     # harmonized/standardized characteristics
-    if gender is not None:
-        subject_sex = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Gender")])),
-                ("description", "Gender of the subject"),
-                ("values", [ gender ])
-                ])
-        subject_characteristics.append(subject_sex)
-
-    if age is not None:
-        subject_age = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Age")])),
-                ("description", "Age of the subject"),
-                ("values", [ age ])
-                ])
-        subject_characteristics.append(subject_age)
-    
-    if visit_year is not None:
-        subject_visitYear = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Visit year")])),
-                ("description", "Year of visit, to use for longitudinal analysis"),
-                ("values", [ visit_year ])
-                ])
-        subject_characteristics.append(subject_visitYear)
-    
-    if sys_bp is not None:
-        subject_sysBP = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Systolic blood pressure")])),
-                ("description", "Systolic blood pressure of subject, measured in mmHg"),
-                ("values", [ sys_bp ])
-                ])
-        subject_characteristics.append(subject_sysBP)
-        
-    if dias_bp is not None:
-        subject_diasBP = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Diastolic blood pressure")])),
-                ("description", "Diastolic blood pressure of subject, measured in mmHg"),
-                ("values", [ dias_bp ])
-                ])
-        subject_characteristics.append(subject_diasBP)                                      
-    
-    if disease['hypertension'] != "unknown":
-        disease_name = "hypertension"
-        disease_id = "10763"
-        disease_identifier = OrderedDict([
-            ("identifier",  "DOID:" + str(disease_id)),
-            ("identifierSource", "Disease Ontology")])
-        disease_alt_ids = [OrderedDict([
-            ("identifier", "http://purl.obolibrary.org/obo/DOID_" + str(disease_id)),
-            ("identifierSource", "Disease Ontology")])]
-        subject_hypertension = DatsObj("Disease", [
-            ("name", "Hypertension"),
-            ("identifier", disease_identifier),
-            ("alternateIdentifiers", disease_alt_ids),
-            ("diseaseStatus", DatsObj("Annotation", [("value", disease['hypertension'] ), ("valueIRI", "")])), 
-            ])
-        subject_bearerOfDisease.append(subject_hypertension)
+    if subj_harmonized is None:
+        subj_harmonized = ccmm.topmed.harmonized.get_var_values(subj_var_values)
+    (subject_characteristics, subject_bearerOfDisease) = ccmm.topmed.harmonized.get_harmonized_characteristics(subj_harmonized)
 
     # create a DATS Dimension from a dbGaP variable value
     def make_var_dimension(name, var_value):
@@ -282,20 +214,20 @@ def get_synthetic_single_dna_extract_json_from_public_metadata(cache, study, stu
     for var_type in ('Subject', 'Subject_Phenotypes'):
         if var_type not in study_md:
             continue
-        subj_data = study_md[var_type]['var_report']['data']
-        subj_vars = subj_data['vars']
+        subj_report = study_md[var_type]['var_report']
+        subj_vars = subj_report['data']['vars']
         # pick representative and/or legal value for each variable
-        pick_var_values(subj_vars, subj_var_values)
+        pick_var_values(subj_vars, subj_var_values, subj_report.get('stats'))
 
     # Sample summary data
     samp_var_values = {}
     for var_type in ('Sample', 'Sample_Attributes'):
         if var_type not in study_md:
             continue
-        samp_data = study_md[var_type]['var_report']['data']
-        samp_vars = samp_data['vars']
+        samp_report = study_md[var_type]['var_report']
+        samp_vars = samp_report['data']['vars']
         # pick representative and/or legal value for each variable
-        samp_var_values = pick_var_values(samp_vars, samp_var_values)
+        samp_var_values = pick_var_values(samp_vars, samp_var_values, samp_report.get('stats'))
 
     # assign dummy ids: subject and sample ids are protected data
     samp_var_values['dbGaP_Sample_ID'] = { "value": "0000000" }
@@ -322,41 +254,8 @@ def link_samples_to_subjects(samples, subjects):
         dbgap_subj_id = sample['dbGaP_Subject_ID']
         sample['subject'] = subjects[dbgap_subj_id]
 
-# TODO - cut and paste from ccmm.gtex.rna_extracts
 def print_subject_sample_count_histogram(samples):
-    print("Histogram of number of subjects that have a given number of samples")
-
-    # count samples per subject
-    subject_sample_count = {}
-    for s in samples:
-        sample = samples[s]
-        subject = sample['dbGaP_Subject_ID']
-        if subject in subject_sample_count:
-            subject_sample_count[subject] += 1
-        else:
-            subject_sample_count[subject] = 1
-
-    # convert to histogram
-    ssc_hist = {}
-    for s in subject_sample_count:
-        ct = subject_sample_count[s]
-        if ct in ssc_hist:
-            ssc_hist[ct] += 1
-        else:
-            ssc_hist[ct] = 1
-#        print(s + " has " + str(ct) + " sample(s)")
-
-    # print histogram
-    n_total_samples = 0
-    n_total_subjects = 0
-    print("n_samples\tn_subjects")
-    for n_samples in sorted(ssc_hist):
-        n_subjects = ssc_hist[n_samples]
-        print(str(n_samples) + "\t" + str(n_subjects))
-        n_total_subjects += n_subjects
-        n_total_samples += (n_subjects * n_samples)
-    print("n_total_samples=" + str(n_total_samples))
-    print("n_total_subjects=" + str(n_total_subjects))
+    ccmm.util.print_subject_sample_count_histogram([samples[s]['dbGaP_Subject_ID'] for s in samples])
 
 def add_properties(o1, o2):
     for p in o2:
@@ -402,6 +301,9 @@ def get_dna_extracts_json_from_restricted_metadata(cache, study, pub_md, restric
     else:
         subject_phens = {}
 
+    # harmonized variables, resolved once per table
+    harmonized = ccmm.topmed.harmonized.get_subject_values(subject_md, restricted_md.get('Subject_Phenotypes'))
+
     # link subjects and samples
     link_samples_to_subjects(samples, subjects)
 
@@ -433,7 +335,7 @@ def get_dna_extracts_json_from_restricted_metadata(cache, study, pub_md, restric
         for sa in subject:
             subject_atts[sa] = { "value" : subject[sa] } # TODO - add corresponding dbgap var identifier from pub md
 
-        dna_extract = get_single_dna_extract_json(cache, study, pub_md, subject_atts, sample_atts)
+        dna_extract = get_single_dna_extract_json(cache, study, pub_md, subject_atts, sample_atts, harmonized[subject['dbGaP_Subject_ID']])
         dna_extracts.append(dna_extract)
 
     return dna_extracts
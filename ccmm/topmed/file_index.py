@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Index of the TOPMed file-level Datasets in a DATS instance, used to update the instance in place
+# when a new manifest or set of GUID files is released.
+#
+# The index records, for each study, the samples that have file Datasets, the @id of each sample
+# Material and its file Datasets, and a signature of the manifest row and GUID file rows from which
+# those Datasets were built. It also records the @ids of the study-independent objects (DataTypes,
+# DataStandards, etc.) in the instance, by cache key. update_file_datasets compares the signatures
+# against a new manifest and GUID set and regenerates only the file Datasets of samples whose
+# signature has changed, leaving the rest of the instance as it was.
+
+from ccmm.dats.datsobj import DatsObj, DatsObjCacheShard
+import ccmm.dats.idrefs as idrefs
+import ccmm.topmed.samples
+import ccmm.topmed.parsers.manifest_files as manifest_files
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# manifest columns from which file Datasets are built
+SIGNATURE_MANIFEST_COLS = ['s3_cram', 's3_crai', 's3_vcf', 's3_csi', 'gs_cram', 'gs_crai', 'gs_vcf', 'gs_csi']
+
+# GUID file columns from which file Datasets are built
+SIGNATURE_GUID_COLS = ['Sodium_GUID', 'File size', 'md5sum']
+
+# ------------------------------------------------------
+# Index construction
+# ------------------------------------------------------
+
+# Returns an MD5 signature of the manifest and GUID file values used to build the file Datasets for
+# manifest sample ms, or None if not all of the sample's files have GUIDs.
+def get_sample_signature(ms, file_guids):
+    values = [[col, ms[col]['mapped_value']] for col in SIGNATURE_MANIFEST_COLS]
+    for filename in manifest_files.get_sample_filenames(ms):
+        guids = file_guids.get(filename)
+        if guids is None:
+            return None
+        values.append([filename] + [guids[col]['raw_value'] for col in SIGNATURE_GUID_COLS])
+    return hashlib.md5(json.dumps(values).encode('utf-8')).hexdigest()
+
+# returns the @id of the sample Material that a file Dataset was produced from
+def get_file_dataset_sample_id(file_ds):
+    inputs = file_ds.get("producedBy").get("input")
+    if len(inputs) != 1:
+        logging.fatal("expected one input for file Dataset " + file_ds.get("title") + ", found " + str(len(inputs)))
+        sys.exit(1)
+    inp = inputs[0]
+    if isinstance(inp, DatsObj):
+        return inp.get("@id")
+    return inp["@id"]
+
+# Returns the index entries for the samples in dats_samples_d (keyed by sample id, as passed to
+# ccmm.topmed.samples.get_files_dats_datasets) that have file Datasets in file_datasets_l, in the
+# order in which their file Datasets appear.
+def get_study_file_index(dats_samples_d, file_datasets_l, sample_manifest, file_guids):
+    sample_ids = dict([(dats_samples_d[s].get("@id"), s) for s in dats_samples_d])
+    entries = OrderedDict()
+    for file_ds in file_datasets_l:
+        samp_oid = get_file_dataset_sample_id(file_ds)
+        if samp_oid not in entries:
+            sample_id = sample_ids[samp_oid]
+            entries[samp_oid] = OrderedDict([
+                ("sample_id", sample_id),
+                ("sample", samp_oid),
+                ("signature", get_sample_signature(sample_manifest[sample_id], file_guids)),
+                ("datasets", [])
+                ])
+        entries[samp_oid]["datasets"].append(file_ds.get("@id"))
+    return list(entries.values())
+
+# ------------------------------------------------------
+# Index input/output
+# ------------------------------------------------------
+
+# global_ids - dict mapping cache key to @id for the study-independent objects in the instance
+# studies - dict mapping dbGaP study identifier to the list of entries from get_study_file_index
+def write_file_index(path, global_ids, studies):
+    index = OrderedDict([
+        ("global_ids", OrderedDict([(k, global_ids[k]) for k in sorted(global_ids)])),
+        ("studies", studies)
+        ])
+    n_samples = sum([len(studies[s]) for s in studies])
+    logging.info("writing file index for " + str(n_samples) + " sample(s) in " + str(len(studies)) + " study/studies to " + path)
+    with open(path, mode="w") as jf:
+        jf.write(json.dumps(index, indent=2))
+
+def read_file_index(path):
+    with open(path) as jf:
+        index = json.load(jf, object_pairs_hook=OrderedDict)
+    if "global_ids" not in index or "studies" not in index:
+        logging.fatal(path + " is not a TOPMed file index")
+        sys.exit(1)
+    return index
+
+# ------------------------------------------------------
+# Incremental update
+# ------------------------------------------------------
+
+# Update the file Datasets in topmed_dataset, an instance read with ccmm.dats.datsobj.read_dats_json,
+# to match sample_manifest and file_guids. Only the studies and samples in file_index are updated:
+#  - a sample whose signature is unchanged keeps its existing file Datasets
+#  - a sample whose manifest row or GUIDs have changed has its file Datasets regenerated in place
+#  - a sample that is no longer in the manifest, or whose files no longer all have GUIDs, loses its file Datasets
+# Samples in the manifest that are not in the instance are not added; that requires a full rebuild.
+# Returns the updated file index.
+def update_file_datasets(topmed_dataset, file_index, sample_manifest, file_guids, no_circular_links):
+    # objects in the original instance, including any that are only defined in file Datasets that will be replaced
+    id_to_obj = idrefs.index_objs(topmed_dataset)
+    # study-independent objects are referenced by id if they're already in the instance
+    cache = DatsObjCacheShard(file_index['global_ids'])
+
+    studies = OrderedDict()
+    indexed_sample_ids = {}
+    n_unchanged = 0
+    n_changed = 0
+    n_removed = 0
+
+    for study_ds in topmed_dataset.get("hasPart"):
+        study_id = study_ds.get("identifier").get("identifier")
+        if study_id not in file_index['studies']:
+            continue
+        entries = file_index['studies'][study_id]
+        file_datasets_l = study_ds.get("hasPart") if study_ds.hasProperty("hasPart") else []
+
+        # samples whose file Datasets must be regenerated, and those whose file Datasets must be removed
+        changed_samples_d = OrderedDict()
+        removed = {}
+        for e in entries:
+            indexed_sample_ids[e['sample_id']] = True
+            if e['sample'] not in id_to_obj:
+                logging.fatal("sample Material " + e['sample'] + " for " + e['sample_id'] + " not found in instance")
+                sys.exit(1)
+            ms = sample_manifest.get(e['sample_id'])
+            signature = None if ms is None else get_sample_signature(ms, file_guids)
+            if signature is None:
+                removed[e['sample']] = True
+                n_removed += 1
+            elif signature != e['signature']:
+                changed_samples_d[e['sample_id']] = id_to_obj[e['sample']]
+                n_changed += 1
+            else:
+                n_unchanged += 1
+
+        # regenerate file Datasets for changed samples
+        new_file_datasets = ccmm.topmed.samples.get_files_dats_datasets(cache, changed_samples_d, sample_manifest, file_guids, no_circular_links)
+        new_by_sample = OrderedDict()
+        for fd in new_file_datasets:
+            new_by_sample.setdefault(get_file_dataset_sample_id(fd), []).append(fd)
+
+        # each changed sample's file Datasets replace its old ones at the position of the first of them
+        updated_l = []
+        for fd in file_datasets_l:
+            samp_oid = get_file_dataset_sample_id(fd)
+            if samp_oid in removed:
+                continue
+            if samp_oid in new_by_sample:
+                updated_l.extend(new_by_sample.pop(samp_oid))
+                removed[samp_oid] = True
+                continue
+            updated_l.append(fd)
+        if study_ds.hasProperty("hasPart") or len(updated_l) > 0:
+            study_ds.set("hasPart", updated_l)
+
+        samples_d = dict([(e['sample_id'], id_to_obj[e['sample']]) for e in entries])
+        studies[study_id] = get_study_file_index(samples_d, updated_l, sample_manifest, file_guids)
+
+    # any study-independent object defined only in a replaced file Dataset is embedded where it is next used
+    idrefs.inline_missing_id_refs(topmed_dataset, id_to_obj, [])
+
+    n_not_indexed = len([s for s in sample_manifest if s not in indexed_sample_ids])
+    logging.info("file Datasets: " + str(n_unchanged) + " sample(s) unchanged, " + str(n_changed) + " regenerated, " + str(n_removed) + " removed")
+    if n_not_indexed > 0:
+        logging.warn(str(n_not_indexed) + " sample(s) in the manifest are not in the instance; a full rebuild is needed to add them")
+
+    global_ids = dict(file_index['global_ids'])
+    for k in cache.new_keys:
+        global_ids[k] = cache.cache[k].get("@id")
+    return { "global_ids": global_ids, "studies": studies }
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Harmonized subject variables for TOPMed studies.
+#
+# Studies use different dbGaP variable names for the same subject attributes (e.g., GENDER or SEX),
+# so each harmonized variable has a list of aliases. The aliases are resolved once per table from
+# its column headings, and harmonized values are computed a column at a time for the whole table,
+# so that building each subject only requires looking up its precomputed values. When a subject has
+# more than one column that maps to the same harmonized variable, the value from the last such
+# column in the subject's (merged) attributes is used, ignoring columns whose value can't be
+# decoded.
+
+from ccmm.dats.datsobj import DatsObj
+from collections import OrderedDict
+import re
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+# decode functions return None for values that should be ignored
+def decode_lower(value):
+    return value.lower()
+
+def decode_value(value):
+    return value
+
+def decode_yes_no(value):
+    if value.lower() == "yes" or value == '1':
+        return "yes"
+    elif re.match(r'\S', value):
+        return "no"
+    return None
+
+# id      - harmonized variable
+# aliases - upper-case dbGaP variable names
+# decode  - maps dbGaP variable value to harmonized value
+HARMONIZED_VARS = [
+    { "id": "gender", "aliases": ["GENDER", "SEX"], "decode": decode_lower },
+    # need to confirm that these all mean the same thing
+    { "id": "age", "aliases": ["VISIT_AGE", "AGE", "AGE_ENROLL"], "decode": decode_value },
+    { "id": "visit_year", "aliases": ["VISIT_YEAR"], "decode": decode_value },
+    { "id": "sys_bp", "aliases": ["SYSBP"], "decode": decode_value },
+    { "id": "dias_bp", "aliases": ["DIASBP"], "decode": decode_value },
+    { "id": "hypertension", "aliases": ["HYPERTENSION", "HIGHBLOODPRES"], "decode": decode_yes_no }
+]
+
+# maps each alias to its harmonized variable
+ALIAS_TO_VAR = dict([(a, hv) for hv in HARMONIZED_VARS for a in hv['aliases']])
+
+# harmonized characteristics: (harmonized variable, Dimension name, Dimension description)
+HARMONIZED_DIMENSIONS = [
+    ("gender", "Gender", "Gender of the subject"),
+    ("age", "Age", "Age of the subject"),
+    ("visit_year", "Visit year", "Year of visit, to use for longitudinal analysis"),
+    ("sys_bp", "Systolic blood pressure", "Systolic blood pressure of subject, measured in mmHg"),
+    ("dias_bp", "Diastolic blood pressure", "Diastolic blood pressure of subject, measured in mmHg")
+]
+
+# ------------------------------------------------------
+# Alias resolution
+# ------------------------------------------------------
+
+# Returns a list of (harmonized variable, column name) for the columns in headers that are aliases
+# of a harmonized variable, in column order.
+def resolve_columns(headers):
+    return [(ALIAS_TO_VAR[h.upper()], h) for h in headers if h.upper() in ALIAS_TO_VAR]
+
+# Compute harmonized values for every row of a table.
+#
+# headers - columns of the table to use
+# rows - list of dicts, each of which has a value for every column in headers
+#
+# Returns a dict mapping each harmonized variable id to a list with the value for each row, or None
+# where the row has no value for the variable.
+def get_table_values(headers, rows):
+    n_rows = len(rows)
+    values = dict([(hv['id'], [None] * n_rows) for hv in HARMONIZED_VARS])
+
+    for (hv, col) in resolve_columns(headers):
+        decode = hv['decode']
+        decoded = [decode(r[col]) for r in rows]
+        # later columns take precedence
+        prev = values[hv['id']]
+        values[hv['id']] = [p if d is None else d for (d, p) in zip(decoded, prev)]
+
+    return values
+
+# Returns a dict of harmonized values for a single subject's var_values (as passed to
+# subjects.get_subject_dats_material), in which each entry has a "value".
+def get_var_values(var_values):
+    headers = list(var_values.keys())
+    row = dict([(h, var_values[h]['value']) for h in headers])
+    values = get_table_values(headers, [row])
+    return dict([(v, values[v][0]) for v in values])
+
+# Compute harmonized values for the subjects in the restricted Subject metadata, merged with the
+# Subject_Phenotypes metadata, if any, in the same way as the subject attributes are merged.
+#
+# Returns a dict mapping dbGaP_Subject_ID to a dict of harmonized values.
+def get_subject_values(subject_md, subject_phen_md=None):
+    subj_headers = subject_md['data']['headers']
+    subj_rows = subject_md['data']['rows']
+    subj_values = get_table_values(subj_headers, subj_rows)
+
+    # columns in Subject_Phenotypes that are not already in Subject follow those in Subject
+    phen_values = None
+    phen_index = {}
+    if subject_phen_md is not None:
+        phen_headers = [h for h in subject_phen_md['data']['headers'] if h not in subj_headers]
+        phen_rows = subject_phen_md['data']['rows']
+        phen_values = get_table_values(phen_headers, phen_rows)
+        phen_index = dict([(r['dbGaP_Subject_ID'], i) for (i, r) in enumerate(phen_rows)])
+
+    var_ids = [hv['id'] for hv in HARMONIZED_VARS]
+    subject_values = {}
+    for (i, r) in enumerate(subj_rows):
+        values = dict([(v, subj_values[v][i]) for v in var_ids])
+        j = phen_index.get(r['dbGaP_Subject_ID'])
+        if j is not None:
+            for v in var_ids:
+                if phen_values[v][j] is not None:
+                    values[v] = phen_values[v][j]
+        subject_values[r['dbGaP_Subject_ID']] = values
+
+    return subject_values
+
+# ------------------------------------------------------
+# DATS encoding
+# ------------------------------------------------------
+
+# Returns (characteristics, bearerOfDisease) for a subject with the given harmonized values.
+def get_harmonized_characteristics(values):
+    characteristics = []
+    bearer_of_disease = []
+
+    for (v, name, description) in HARMONIZED_DIMENSIONS:
+        if values[v] is not None:
+            characteristics.append(DatsObj("Dimension", [
+                ("name", DatsObj("Annotation", [("value", name)])),
+                ("description", description),
+                ("values", [ values[v] ])
+                ]))
+
+    if values['hypertension'] is not None:
+        disease_id = "10763"
+        disease_identifier = OrderedDict([
+            ("identifier",  "DOID:" + str(disease_id)),
+            ("identifierSource", "Disease Ontology")])
+        disease_alt_ids = [OrderedDict([
+            ("identifier", "http://purl.obolibrary.org/obo/DOID_" + str(disease_id)),
+            ("identifierSource", "Disease Ontology")])]
+        subject_hypertension = DatsObj("Disease", [
+            ("name", "Hypertension"),
+            ("identifier", disease_identifier),
+            ("alternateIdentifiers", disease_alt_ids),
+            ("diseaseStatus", DatsObj("Annotation", [("value", values['hypertension'] ), ("valueIRI", "")])),
+            ])
+        bearer_of_disease.append(subject_hypertension)
+
+    return (characteristics, bearer_of_disease)
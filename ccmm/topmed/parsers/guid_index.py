@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# Persistent SQLite index of the TOPMed GUID files (see manifest_files.GUID_COLS).
+#
+# The GUID files are large, grow with each TOPMed freeze and rarely change otherwise, so rather than
+# parsing and checking every row of every file on each run they are loaded into an on-disk index
+# that is updated incrementally:
+#  - a GUID file whose size and modification time are unchanged is skipped
+#  - a GUID file that has only been appended to (checked using a hash of the previously-indexed
+#    prefix of the file) is read from the end of the previously-indexed prefix
+#  - any other GUID file is rescanned in full, and rows are inserted, updated, or deleted based on
+#    a per-row checksum
+# Only new and changed rows are checked against GUID_COLS. The index is then queried by filename
+# and returns the same per-file dicts of {'raw_value', 'mapped_value'} as manifest_files.read_guid_file.
+
+import ccmm.gtex.parsers.util as util
+import ccmm.topmed.parsers.manifest_files as manifest_files
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+
+# ------------------------------------------------------
+# Global variables
+# ------------------------------------------------------
+
+GUID_ID_COLUMN = 'File_Name'
+
+# block size used when hashing the indexed prefix of a GUID file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS guid_files (source TEXT PRIMARY KEY, size INTEGER, mtime REAL, n_bytes INTEGER, n_lines INTEGER, prefix_md5 TEXT)",
+    "CREATE TABLE IF NOT EXISTS guids (file_name TEXT PRIMARY KEY, source TEXT, lnum INTEGER, checksum TEXT, line TEXT)",
+    "CREATE INDEX IF NOT EXISTS guids_source ON guids (source)"
+]
+
+# ------------------------------------------------------
+# GuidIndex
+# ------------------------------------------------------
+
+# Read-only dict-like view of an index, keyed by filename. A GuidIndex can be pickled (e.g., to pass
+# it to worker processes), in which case each process opens its own connection to the index.
+class GuidIndex:
+    db_path = None
+    conn = None
+    conn_pid = None
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.get_connection()
+
+    def __getstate__(self):
+        return { "db_path": self.db_path }
+
+    def __setstate__(self, state):
+        self.db_path = state['db_path']
+        self.conn = None
+        self.conn_pid = None
+
+    # sqlite3 connections can't be shared across processes, so reconnect after a fork
+    def get_connection(self):
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.conn = sqlite3.connect(self.db_path)
+            self.conn_pid = os.getpid()
+            for stmt in SCHEMA:
+                self.conn.execute(stmt)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None and self.conn_pid == os.getpid():
+            self.conn.close()
+        self.conn = None
+        self.conn_pid = None
+
+    def __len__(self):
+        return self.get_connection().execute("SELECT COUNT(*) FROM guids").fetchone()[0]
+
+    def __contains__(self, file_name):
+        return self.get_connection().execute("SELECT 1 FROM guids WHERE file_name = ?", (file_name,)).fetchone() is not None
+
+    def __getitem__(self, file_name):
+        r = self.get_connection().execute("SELECT source, lnum, line FROM guids WHERE file_name = ?", (file_name,)).fetchone()
+        if r is None:
+            raise KeyError(file_name)
+        (source, lnum, line) = r
+        parsed_row = util.parse_metadata_row(split_line(line), manifest_files.GUID_COLS, source, lnum)
+        parsed_row['id'] = file_name
+        return parsed_row
+
+    def get(self, file_name, default=None):
+        try:
+            return self[file_name]
+        except KeyError:
+            return default
+
+    # ------------------------------------------------------
+    # Incremental update
+    # ------------------------------------------------------
+
+    # Bring the index up to date with the GUID file at guid_file_path. Filenames must be unique
+    # across all the GUID files in the index.
+    def update(self, guid_file_path):
+        conn = self.get_connection()
+        source = os.path.abspath(guid_file_path)
+        st = os.stat(source)
+        r = conn.execute("SELECT size, mtime, n_bytes, n_lines, prefix_md5 FROM guid_files WHERE source = ?", (source,)).fetchone()
+
+        if r is not None:
+            (size, mtime, n_bytes, n_lines, prefix_md5) = r
+            if size == st.st_size and mtime == st.st_mtime:
+                logging.info("GUID index is up to date for " + guid_file_path)
+                return
+            # rows can only be appended if the indexed prefix ends with a complete line
+            if st.st_size >= n_bytes and get_prefix_md5(source, n_bytes) == prefix_md5 and ends_with_newline(source, n_bytes):
+                logging.info("appending to GUID index from line " + str(n_lines + 1) + " of " + guid_file_path)
+                with conn:
+                    self.scan_rows(source, st, n_bytes, n_lines)
+                return
+            logging.info("GUID file " + guid_file_path + " has changed, rescanning")
+
+        with conn:
+            self.scan_rows(source, st)
+
+    # Index the rows of source starting at byte offset n_bytes, which is the start of line n_lines + 1.
+    # If n_bytes is 0 the entire file is rescanned, rows that are no longer present are deleted, and
+    # rows whose checksums have not changed are not parsed again.
+    def scan_rows(self, source, st, n_bytes=0, n_lines=0):
+        conn = self.get_connection()
+        rescan = (n_bytes == 0)
+        # file_name -> (checksum, lnum) of rows previously indexed from source
+        old_rows = {}
+        if rescan:
+            for (file_name, checksum, lnum) in conn.execute("SELECT file_name, checksum, lnum FROM guids WHERE source = ?", (source,)):
+                old_rows[file_name] = (checksum, lnum)
+        seen = {}
+        n_new = 0
+        n_changed = 0
+        lnum = n_lines
+
+        with open(source, 'rb') as fh:
+            fh.seek(n_bytes)
+            for raw_line in fh:
+                lnum += 1
+                n_bytes += len(raw_line)
+                line = decode_line(raw_line)
+                if lnum == 1:
+                    util.check_metadata_header(split_line(line), manifest_files.GUID_COLS, source)
+                    continue
+
+                checksum = hashlib.md5(raw_line).hexdigest()
+                # the filename is the first column
+                file_name = split_line(line)[0]
+                old_row = old_rows.get(file_name)
+
+                # unchanged row
+                if old_row is not None and old_row[0] == checksum and file_name not in seen:
+                    seen[file_name] = True
+                    if old_row[1] != lnum:
+                        conn.execute("UPDATE guids SET lnum = ? WHERE file_name = ?", (lnum, file_name))
+                    continue
+
+                parsed_row = util.parse_metadata_row(split_line(line), manifest_files.GUID_COLS, source, lnum)
+                file_name = parsed_row[GUID_ID_COLUMN]['mapped_value']
+                if file_name in seen:
+                    util.fatal_parse_error("Duplicate " + GUID_ID_COLUMN + " '" + file_name + "'", source, lnum)
+                seen[file_name] = True
+
+                if file_name in old_rows:
+                    conn.execute("UPDATE guids SET lnum = ?, checksum = ?, line = ? WHERE file_name = ?", (lnum, checksum, line, file_name))
+                    n_changed += 1
+                else:
+                    self.check_unique(file_name, source, lnum)
+                    conn.execute("INSERT INTO guids (file_name, source, lnum, checksum, line) VALUES (?, ?, ?, ?, ?)", (file_name, source, lnum, checksum, line))
+                    n_new += 1
+
+        removed = [f for f in old_rows if f not in seen]
+        conn.executemany("DELETE FROM guids WHERE file_name = ?", [(f,) for f in removed])
+        self.set_file_info(source, st, n_bytes, lnum)
+        logging.info("GUID index: " + str(n_new) + " new, " + str(n_changed) + " changed, " + str(len(removed)) + " removed row(s) from " + source)
+
+    # filenames must be unique across GUID files
+    def check_unique(self, file_name, source, lnum):
+        r = self.get_connection().execute("SELECT source FROM guids WHERE file_name = ?", (file_name,)).fetchone()
+        if r is not None:
+            if r[0] == source:
+                util.fatal_parse_error("Duplicate " + GUID_ID_COLUMN + " '" + file_name + "'", source, lnum)
+            logging.fatal("duplicate filename " + file_name + " in GUID files " + r[0] + " and " + source)
+            sys.exit(1)
+
+    def set_file_info(self, source, st, n_bytes, n_lines):
+        prefix_md5 = get_prefix_md5(source, n_bytes)
+        self.get_connection().execute("INSERT OR REPLACE INTO guid_files (source, size, mtime, n_bytes, n_lines, prefix_md5) VALUES (?, ?, ?, ?, ?, ?)",
+                                      (source, st.st_size, st.st_mtime, n_bytes, n_lines, prefix_md5))
+
+# ------------------------------------------------------
+# Utility functions
+# ------------------------------------------------------
+
+def decode_line(raw_line):
+    return raw_line.decode('utf-8').rstrip('\r\n')
+
+def split_line(line):
+    return next(csv.reader([line], delimiter='\t'))
+
+# MD5 checksum of the first n_bytes of path
+def get_prefix_md5(path, n_bytes):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fh:
+        while n_bytes > 0:
+            block = fh.read(min(HASH_BLOCK_SIZE, n_bytes))
+            if len(block) == 0:
+                break
+            md5.update(block)
+            n_bytes -= len(block)
+    return md5.hexdigest()
+
+# whether the first n_bytes of path are empty or end with a newline
+def ends_with_newline(path, n_bytes):
+    if n_bytes == 0:
+        return True
+    with open(path, 'rb') as fh:
+        fh.seek(n_bytes - 1)
+        return fh.read(1) == b'\n'
+
+# Open the index at db_path and update it from each of guid_file_paths.
+def update_guid_index(db_path, guid_file_paths):
+    index = GuidIndex(db_path)
+    for path in guid_file_paths:
+        index.update(path)
+    logging.info("GUID index " + db_path + " contains " + str(len(index)) + " file(s)")
+    return index
+
+# Returns a lookup of the GUID file rows by filename for the topmed-<suffix>.tsv GUID files in
+# guid_files_dir (see manifest_files.GUID_FILE_SUFFIXES.) If db_path is given the persistent index at
+# db_path is updated from the GUID files, if any, and returned in place of a dict.
+def read_file_guids(guid_files_dir, db_path=None):
+    guid_file_paths = []
+    if guid_files_dir is not None:
+        guid_file_paths = [guid_files_dir + "/" + "topmed-" + suffix + ".tsv" for suffix in manifest_files.GUID_FILE_SUFFIXES]
+
+    if db_path is not None:
+        file_guids = update_guid_index(db_path, guid_file_paths)
+    else:
+        file_guids = {}
+        for guid_file in guid_file_paths:
+            guids = manifest_files.read_guid_file(guid_file)
+            # add guids to file_guids
+            for g in guids:
+                if g in file_guids:
+                    logging.fatal("duplicate filename " + g + " in GUID file " + guid_file)
+                    sys.exit(1)
+                file_guids[g] = guids[g]
+    logging.info("read GUIDs for " + str(len(file_guids)) + " file(s)")
+    return file_guids
@@ -5,6 +5,8 @@
 from ccmm.dats.datsobj import DatsObj
 import ccmm.gtex.parsers.util as util
 import logging
+import re
+import sys
 
 # ------------------------------------------------------
 # Global variables
@@ -46,8 +48,8 @@ MANIFEST_COLS = [
 SAMPLE_FILE_REGEX = r'^NWD\d+\..*(\.cram(\.crai)?|\.vcf.gz(\.csi)?)$'
 S3_REGEX = r's3:\/\/.*(\.cram(\.crai)?|\.vcf.gz(\.csi)?)$'
 GS_REGEX = r'gs:\/\/.*(\.cram(\.crai)?|\.vcf.gz(\.csi)?)$'
-# TODO - a handful of values contain "e":
-GUID_FILE_SIZE_REGEX = r'^[\d\e]+$'
+# TODO - a handful of values contain "e" (e.g., 1.5e+10):
+GUID_FILE_SIZE_REGEX = r'^[\d\.e\+]+$'
 DOS_URI_REGEX = r'^dos:\/\/.*$'
 DOI_REGEX = r'^https:\/\/doi.org.*$'
 GUID_REGEX = r'^.*$'
@@ -66,6 +68,9 @@ GUID_COLS = [
     {'id': 'Sodium_GUID', 'regex': DOI_REGEX, 'empty_ok': False }
 ]
 
+# GUID files are named topmed-<suffix>.tsv
+GUID_FILE_SUFFIXES = ['cram', 'crai', 'vcf', 'vcfcsi']
+
 # ------------------------------------------------------
 # Manifest file parsing
 # ------------------------------------------------------
@@ -79,3 +84,25 @@ def read_guid_file(guid_file):
     files = util.read_csv_metadata_file(guid_file, GUID_COLS, 'File_Name')
     logging.info("Read " + str(len(files)) + " file(s) from " + guid_file)
     return files
+
+# ------------------------------------------------------
+# Manifest lookups
+# ------------------------------------------------------
+
+# parse the filename from a gs:// or s3:// URI
+def get_uri_filename(uri):
+    m = re.match(r'^.*\/([^\/]+)$', uri)
+    if m is None:
+        logging.fatal("unable to parse filename from " + uri)
+        sys.exit(1)
+    return m.group(1)
+
+# Returns the names of the files listed for a sample in the manifest i.e., the CRAM and CRAI files
+# and, if present, the VCF and CSI files.
+def get_sample_filenames(manifest_sample):
+    filenames = []
+    for col in ('gs_cram', 'gs_crai', 'gs_vcf', 'gs_csi'):
+        uri = manifest_sample[col]['mapped_value']
+        if uri is not None:
+            filenames.append(get_uri_filename(uri))
+    return filenames
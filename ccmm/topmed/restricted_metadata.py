@@ -1,8 +1,68 @@
 #!/usr/bin/env python3
 
 import ccmm.dbgap.restricted_metadata 
+import ccmm.topmed.parsers.manifest_files as manifest_files
 import logging
 
 # Read all dbGaP restricted .txt metadata files in a given directory and parse their contents.
 def read_study_metadata(dir):
     return ccmm.dbgap.restricted_metadata.read_study_metadata(dir)
+
+# Restrict the restricted metadata for a single study to the subjects and samples selected by
+# subset (a ccmm.subset.Subset.) Returns the number of subjects selected.
+def subset_study_metadata(md, subset):
+    subj_rows = md['Subject']['data']['rows']
+    fraction_ids = subset.select_fraction([r['dbGaP_Subject_ID'] for r in subj_rows])
+    subjects = {}
+    for r in subj_rows:
+        subj_id = r['dbGaP_Subject_ID']
+        if subj_id in fraction_ids and subset.subject_id_selected([subj_id, r.get('SUBJECT_ID')]):
+            subjects[subj_id] = True
+
+    samples = {}
+    if 'Sample' in md:
+        for r in md['Sample']['data']['rows']:
+            if r['dbGaP_Subject_ID'] not in subjects:
+                continue
+            if not subset.sample_id_selected([r['dbGaP_Sample_ID'], r.get('SAMPLE_ID')]):
+                continue
+            samples[r['dbGaP_Sample_ID']] = r['dbGaP_Subject_ID']
+
+    # only keep subjects with at least one selected sample if samples were filtered directly
+    if subset.has_sample_filter():
+        subjects = dict([(samples[s], True) for s in samples])
+
+    ccmm.dbgap.restricted_metadata.subset_study_metadata(md, 'dbGaP_Subject_ID', subjects, 'dbGaP_Sample_ID', samples)
+    return len(subjects)
+
+# Restrict the Sample and Sample_Attributes metadata for a single study to the samples that have
+# TOPMed files i.e., those that appear in sample_manifest and whose files all appear in file_guids,
+# so that DATS Materials are only created for those samples. Subjects are not filtered. Returns
+# the number of samples that remain.
+def filter_non_topmed_samples(md, study_id, sample_manifest, file_guids):
+    if 'Sample' not in md:
+        return 0
+    sample_rows = md['Sample']['data']['rows']
+    samples = {}
+    n_no_manifest = 0
+    n_no_guids = 0
+
+    for r in sample_rows:
+        # samples are identified by SAMPLE_ID in the manifest, as in samples.get_samples_dats_materials_from_restricted_metadata
+        samp_id = r.get('SAMPLE_ID', r['dbGaP_Sample_ID'])
+        if samp_id not in sample_manifest:
+            n_no_manifest += 1
+            continue
+        missing = [f for f in manifest_files.get_sample_filenames(sample_manifest[samp_id]) if f not in file_guids]
+        if len(missing) > 0:
+            logging.warn("no GUID found for " + ",".join(missing) + ", skipping sample " + samp_id)
+            n_no_guids += 1
+            continue
+        samples[r['dbGaP_Sample_ID']] = r['dbGaP_Subject_ID']
+
+    n_skipped = len(sample_rows) - len(samples)
+    logging.info("skipping " + str(n_skipped) + "/" + str(len(sample_rows)) + " non-TOPMed sample(s) in " + study_id + ": " +
+                 str(n_no_manifest) + " not in manifest, " + str(n_no_guids) + " missing GUIDs")
+    if n_skipped > 0:
+        ccmm.dbgap.restricted_metadata.subset_study_metadata(md, 'dbGaP_Subject_ID', None, 'dbGaP_Sample_ID', samples)
+    return len(samples)
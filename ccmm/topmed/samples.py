@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
 from ccmm.dats.datsobj import DatsObj
+from ccmm.dats.template import DatsTemplate, Slot, TemplateObj
 import ccmm.dats.util as util
 import ccmm.topmed.dna_extracts as dna_extracts
+import ccmm.topmed.parsers.manifest_files as manifest_files
 from collections import OrderedDict
 import logging
 import re
@@ -13,6 +15,31 @@ NIH_NHLBI = DatsObj("Organization", [
         ("abbreviation", "NHLBI")
         ])
 
+# Google Storage or AWS S3 copy of a data file, with a link to its index file
+def make_distribution_template(url_slot):
+    return TemplateObj("DatasetDistribution", [
+            ("access", TemplateObj("Access", [ ("accessURL", Slot(url_slot)) ])),
+            ("identifier", TemplateObj("Identifier", [("identifier", Slot("doi"))])),
+            ("relatedIdentifiers", [ TemplateObj("RelatedIdentifier", [("identifier", Slot("index_doi")), ("relationType", Slot("relation_type")) ])]),
+            ("size", Slot("size")),
+            # TODO - add file size units
+            ("conformsTo", [ Slot("data_standard") ])
+            ])
+
+# Dataset for a single CRAM or VCF file and its index, produced from a sample Material
+FILE_DATASET_TEMPLATE = DatsTemplate(TemplateObj("Dataset", [
+        ("distributions", [ make_distribution_template("gs_url"), make_distribution_template("s3_url") ]),
+        ("dimensions", [ TemplateObj("Dimension", [ ("name", Slot("md5_name")), ("values", [ Slot("md5") ]) ]) ]),
+        ("title", Slot("title")),
+        ("types", Slot("types")),
+        ("creators", Slot("creators")),
+        ("producedBy", TemplateObj("DataAcquisition", [
+#            ("uses", [])                          # software used
+            ("name", Slot("title")),
+            ("input", [ Slot("sample_ref") ])
+            ]))
+        ]))
+
 # Produce a DATS Material for a single sample.
 
 def get_sample_dats_material(cache, dats_subject, study, study_md, samp_var_values):
@@ -151,8 +178,8 @@ def get_synthetic_sample_dats_material_from_public_metadata(cache, dats_subject,
     for var_type in ('Sample', 'Sample_Attributes'):
         if var_type not in pub_md:
             continue
-        samp_data = pub_md[var_type]['var_report']['data']
-        samp_vars = samp_data['vars']
+        samp_report = pub_md[var_type]['var_report']
+        samp_vars = samp_report['data']['vars']
         for sv in samp_vars:
             id = sv['id']
             m = re.match(r'^(phv\d+\.v\d+).*$', id)
@@ -162,7 +189,7 @@ def get_synthetic_sample_dats_material_from_public_metadata(cache, dats_subject,
                 logging.warn("failed to parse variable prefix from " + id)
 
         # pick representative and/or legal value for each variable
-        samp_var_values = dna_extracts.pick_var_values(samp_vars, samp_var_values)
+        samp_var_values = dna_extracts.pick_var_values(samp_vars, samp_var_values, samp_report.get('stats'))
 
     # assign dummy ids: subject and sample ids are protected data
     samp_var_values['dbGaP_Sample_ID'] = { "value": dbgap_samp_id }
@@ -189,6 +216,9 @@ def get_samples_dats_materials_from_restricted_metadata(cache, dats_subjects, st
     # Sample
     # e.g., ['dbGaP_Subject_ID', 'dbGaP_Sample_ID', 'BioSample Accession', 'SUBJECT_ID', 'SAMPLE_ID', 'SAMPLE_USE']
     sample_md = restricted_md['Sample']
+    # e.g., if all samples have been filtered out by restricted_metadata.filter_non_topmed_samples
+    if len(sample_md['data']['rows']) == 0:
+        return dats_samples_d
     # samples indexed by dbGaP ID
     logging.debug("indexing restricted Sample")
     samples = dna_extracts.index_dicts(sample_md['data']['rows'], 'dbGaP_Sample_ID')
@@ -199,7 +229,7 @@ def get_samples_dats_materials_from_restricted_metadata(cache, dats_subjects, st
 
     # Sample_Attributes
     # e.g., ['dbGaP_Sample_ID', 'SAMPLE_ID', 'BODY_SITE', 'ANALYTE_TYPE', 'IS_TUMOR', 'SEQUENCING_CENTER', 'Funding_Source', 'TOPMed_Phase', 'TOPMed_Project', 'Study_Name']
-    if 'Sample_Attributes' in restricted_md:
+    if 'Sample_Attributes' in restricted_md and len(restricted_md['Sample_Attributes']['data']['rows']) > 0:
         sample_atts_md = restricted_md['Sample_Attributes']
         logging.debug("indexing restricted Sample_Attributes file")
         sample_atts = dna_extracts.index_dicts(sample_atts_md['data']['rows'], 'dbGaP_Sample_ID')
@@ -237,41 +267,41 @@ def get_samples_dats_materials_from_restricted_metadata(cache, dats_subjects, st
 
     return dats_samples_d
 
+# handle file size values with "e" in them
+def filesize_to_int(size):
+    if re.match(r'.*e.*', size):
+        size = int(float(size))
+    else:
+        size = int(size)
+    return size
+
 # create Datasets for file-level links based on TOPMed manifest file
 def get_files_dats_datasets(cache, dats_samples_d, sample_manifest, file_guids, no_circular_links):
     file_datasets_l = []
 
-    wgs_datatype = DatsObj("DataType", [
+    # study-independent objects are only retrieved from the cache when first used, so that an object
+    # returned in full is always included in the output
+    def get_wgs_datatype():
+        dkey = ".".join(["DataType", "WGS"])
+        return cache.get_obj_or_ref(dkey, lambda: DatsObj("DataType", [
             ("information", util.get_annotation("DNA sequencing", cache)),
             ("method", util.get_annotation("whole genome sequencing assay", cache)),
             ("platform", util.get_annotation("Illumina", cache))
-            ])
-
-    def get_wgs_datatype():
-        dkey = ".".join(["DataType", "WGS"])
-        return cache.get_obj_or_ref(dkey, lambda: wgs_datatype)
-
-    snp_datatype = DatsObj("DataType", [
-            ("information", util.get_annotation("SNP", cache)),
-            ("method", util.get_annotation("SNP analysis", cache))
-            ])
-
-    cnv_datatype = DatsObj("DataType", [
-            ("information", util.get_annotation("CNV", cache)),
-            ("method", util.get_annotation("CNV analysis", cache))
-            ])
+            ]))
 
     def get_snp_datatype():
         dkey = ".".join(["DataType", "SNP"])
-        return cache.get_obj_or_ref(dkey, lambda: snp_datatype)
+        return cache.get_obj_or_ref(dkey, lambda: DatsObj("DataType", [
+            ("information", util.get_annotation("SNP", cache)),
+            ("method", util.get_annotation("SNP analysis", cache))
+            ]))
 
     def get_cnv_datatype():
         dkey = ".".join(["DataType", "CNV"])
-        return cache.get_obj_or_ref(dkey, lambda: cnv_datatype)
-
-    nhlbi_key = ":".join(["Organization", "NHLBI"])
-    nhlbi = cache.get_obj_or_ref(nhlbi_key, lambda: NIH_NHLBI)
-    creators = [nhlbi]
+        return cache.get_obj_or_ref(dkey, lambda: DatsObj("DataType", [
+            ("information", util.get_annotation("CNV", cache)),
+            ("method", util.get_annotation("CNV analysis", cache))
+            ]))
 
     def make_data_standard(format):
         return DatsObj("DataStandard", [
@@ -279,12 +309,50 @@ def get_files_dats_datasets(cache, dats_samples_d, sample_manifest, file_guids,
             ("type", util.get_value_annotation("format", cache)),
             ("description", format + " file format")
             ])
-    
-    cram_ds_key = ":".join(["DataStandard", "CRAM"])
-    cram_dstan = cache.get_obj_or_ref(cram_ds_key, lambda: make_data_standard("CRAM"))
 
-    vcf_ds_key = ":".join(["DataStandard", "VCF"])
-    vcf_dstan = cache.get_obj_or_ref(vcf_ds_key, lambda: make_data_standard("VCF"))
+    # the same creators list and DataStandards are used for every file
+    creators = None
+    dstans = {}
+
+    def get_data_standard(format):
+        if format not in dstans:
+            ds_key = ":".join(["DataStandard", format])
+            dstans[format] = cache.get_obj_or_ref(ds_key, lambda: make_data_standard(format))
+        return dstans[format]
+
+    # Returns the file Dataset for a data file, which is listed in the manifest under gs_col and
+    # s3_col, and its index file, which is listed under gs_index_col.
+    def make_file_dataset(dats_sample, ms, gs_col, s3_col, gs_index_col, format, relation_type, types):
+        gs_uri = ms[gs_col]['mapped_value']
+        filename = manifest_files.get_uri_filename(gs_uri)
+        index_filename = manifest_files.get_uri_filename(ms[gs_index_col]['mapped_value'])
+
+        # GUID lookup
+        guids = file_guids[filename]
+        index_guids = file_guids[index_filename]
+
+        return FILE_DATASET_TEMPLATE.fill({
+            "gs_url": gs_uri,
+            "s3_url": ms[s3_col]['mapped_value'],
+            "doi": guids['Sodium_GUID']['raw_value'],
+            "index_doi": index_guids['Sodium_GUID']['raw_value'],
+            "relation_type": relation_type,
+            "size": filesize_to_int(guids['File size']['raw_value']),
+            "data_standard": get_data_standard(format),
+            # TODO - replace this with DATS-specific MD5 checksum encoding (TBD)
+            "md5_name": util.get_value_annotation("MD5", cache),
+            "md5": guids['md5sum']['raw_value'],
+            "title": filename,
+            "types": types,
+            "creators": creators,
+            "sample_ref": dats_sample.getIdRef()
+            })
+
+    def add_file_dataset(file_dataset):
+        # circular link back to enclosing Dataset as the output
+        if not no_circular_links:
+            file_dataset.get("producedBy").set("output", [file_dataset.getIdRef()])
+        file_datasets_l.append(file_dataset)
 
     n_samples = len(dats_samples_d)
     n_samples_found = 0
@@ -300,177 +368,28 @@ def get_files_dats_datasets(cache, dats_samples_d, sample_manifest, file_guids,
         n_samples_found += 1
         ms = sample_manifest[sample_id]
 
-        material_type = 'DNA'
-        wgs_type = get_wgs_datatype()
-        snp_type = get_snp_datatype()
-        cnv_type = get_cnv_datatype()
+        if creators is None:
+            nhlbi_key = ":".join(["Organization", "NHLBI"])
+            creators = [cache.get_obj_or_ref(nhlbi_key, lambda: NIH_NHLBI)]
 
         # ------------------------------------------------
         # WGS sequence - CRAM and CRAI files
         # ------------------------------------------------
 
-        def get_filename(gs_uri):
-            m = re.match(r'^.*\/([^\/]+)$', gs_uri)
-            if m is None:
-                logging.fatal("unable to parse filename from " + gs_uri)
-                sys.exit(1)
-            filename = m.group(1)
-            return filename
-
-        gs_cram = ms['gs_cram']['mapped_value']
-        gs_crai = ms['gs_crai']['mapped_value']
-
-        # GUID lookup
-        cram_file = get_filename(gs_cram)
-        crai_file = get_filename(gs_crai)
-
-        cram_doi = file_guids[cram_file]['Sodium_GUID']['raw_value']
-        cram_size = file_guids[cram_file]['File size']['raw_value']
-        cram_md5 = file_guids[cram_file]['md5sum']['raw_value']
-
-        crai_doi = file_guids[crai_file]['Sodium_GUID']['raw_value']
-        crai_md5 = file_guids[crai_file]['md5sum']['raw_value']
-
-        # handle file size values with "e" in them
-        def filesize_to_int(size):
-            if re.match(r'.*e.*', size):
-                size = int(float(size))
-            else:
-                size = int(size)
-
-        # Google Cloud Platform / Google Storage copy
-        gs_cram_access = DatsObj("Access", [ ("accessURL", gs_cram) ])
-        gs_cram_distro = DatsObj("DatasetDistribution", [
-            ("access", gs_cram_access),
-            ("identifier", DatsObj("Identifier", [("identifier", cram_doi)])),
-            ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", crai_doi), ("relationType", "cram_index") ])]),
-            ("size", filesize_to_int(cram_size)),
-            # TODO - add file size units
-            ("conformsTo", [ cram_dstan ])
-        ])
-
-        # AWS / S3 copy
-        s3_cram = ms['s3_cram']['mapped_value']
-        s3_crai = ms['s3_crai']['mapped_value']
-        s3_cram_access = DatsObj("Access", [ ("accessURL", s3_cram) ])
-        s3_cram_distro = DatsObj("DatasetDistribution", [
-            ("access", s3_cram_access),
-            ("identifier", DatsObj("Identifier", [("identifier", cram_doi)])),
-            ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", crai_doi), ("relationType", "cram_index") ])]),
-            ("size", filesize_to_int(cram_size)),
-            # TODO - add file size units
-            ("conformsTo", [ cram_dstan ])
-        ])
-
-        m = re.match(r'^.*\/([^\/]+)$', gs_cram)
-        if m is None:
-            logging.fatal("unable to parse filename from CRAM file URI " + gs_cram)
-            sys.exit(1)
-        filename = m.group(1)
-
-        # TODO - replace this with DATS-specific MD5 checksum encoding (TBD)
-        md5_dimension = DatsObj("Dimension", [
-                ("name", util.get_value_annotation("MD5", cache)),
-                ("values", [ cram_md5 ])
-                ])
-
-        cram_dataset = DatsObj("Dataset", [
-            ("distributions", [gs_cram_distro, s3_cram_distro]),
-            ("dimensions", [ md5_dimension ]),
-            ("title", filename),
-            ("types", [ wgs_type ]),
-            ("creators", creators),
-        ])
-
-        cram_da = DatsObj("DataAcquisition", [
-            ("name", filename),
-            ("input", [dats_sample.getIdRef()])
-#            ("uses", [])                          # software used
-        ])
-
-        cram_dataset.set("producedBy", cram_da)
-        # circular link back to enclosing Dataset as the output
-        if not no_circular_links:
-            cram_da.set("output", [cram_dataset.getIdRef()])
-        file_datasets_l.append(cram_dataset)
+        wgs_type = get_wgs_datatype()
+        add_file_dataset(make_file_dataset(dats_sample, ms, 'gs_cram', 's3_cram', 'gs_crai', "CRAM", "cram_index", [ wgs_type ]))
 
         # ------------------------------------------------
         # Variant calls - VCF and CSI files
         # ------------------------------------------------
 
-        gs_vcf = ms['gs_vcf']['mapped_value']
-        gs_csi = ms['gs_csi']['mapped_value']
-
-        if gs_vcf is None:
+        if ms['gs_vcf']['mapped_value'] is None:
             logging.warn("no VCF file found for " + sample_id)
             continue
 
-        # GUID lookup
-        vcf_file = get_filename(gs_vcf)
-        csi_file = get_filename(gs_csi)
-
-        vcf_doi = file_guids[vcf_file]['Sodium_GUID']['raw_value']
-        vcf_size = file_guids[vcf_file]['File size']['raw_value']
-        vcf_md5 = file_guids[vcf_file]['md5sum']['raw_value']
-
-        csi_doi = file_guids[csi_file]['Sodium_GUID']['raw_value']
-        csi_md5 = file_guids[csi_file]['md5sum']['raw_value']
-
-        # Google Cloud Platform / Google Storage copy
-        gs_vcf_access = DatsObj("Access", [ ("accessURL", gs_vcf) ])
-        gs_vcf_distro = DatsObj("DatasetDistribution", [
-            ("access", gs_vcf_access),
-            ("identifier", DatsObj("Identifier", [("identifier", vcf_doi)])),
-            ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", csi_doi), ("relationType", "vcf_index") ])]),
-            ("size", filesize_to_int(vcf_size)),
-            # TODO - add file size units
-            ("conformsTo", [ vcf_dstan ])
-        ])
-
-        # AWS / S3 copy
-        s3_vcf = ms['s3_vcf']['mapped_value']
-        s3_csi = ms['s3_csi']['mapped_value']
-        s3_vcf_access = DatsObj("Access", [ ("accessURL", s3_vcf) ])
-        s3_vcf_distro = DatsObj("DatasetDistribution", [
-            ("access", s3_vcf_access),
-            ("identifier", DatsObj("Identifier", [("identifier", vcf_doi)])),
-            ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", csi_doi), ("relationType", "vcf_index") ])]),
-            ("size", filesize_to_int(vcf_size)),
-            # TODO - add file size units
-            ("conformsTo", [ vcf_dstan ])
-        ])
-
-        m = re.match(r'^.*\/([^\/]+)$', gs_vcf)
-        if m is None:
-            logging.fatal("unable to parse filename from VCF file URI " + gs_vcf)
-            sys.exit(1)
-        filename = m.group(1)
-
-        # TODO - replace this with DATS-specific MD5 checksum encoding (TBD)
-        md5_dimension = DatsObj("Dimension", [
-                ("name", util.get_value_annotation("MD5", cache)),
-                ("values", [ vcf_md5 ])
-                ])
-
-        vcf_dataset = DatsObj("Dataset", [
-            ("distributions", [gs_vcf_distro, s3_vcf_distro]),
-            ("dimensions", [ md5_dimension ]),
-            ("title", filename),
-            ("types", [ snp_type, cnv_type ]),
-            ("creators", creators),
-        ])
-
-        vcf_da = DatsObj("DataAcquisition", [
-            ("name", filename),
-            ("input", [dats_sample.getIdRef()])
-#            ("uses", [])                          # software used
-        ])
-
-        vcf_dataset.set("producedBy", vcf_da)
-        # circular link back to enclosing Dataset as the output
-        if not no_circular_links:
-            vcf_da.set("output", [vcf_dataset.getIdRef()])
-        file_datasets_l.append(vcf_dataset)
+        snp_type = get_snp_datatype()
+        cnv_type = get_cnv_datatype()
+        add_file_dataset(make_file_dataset(dats_sample, ms, 'gs_vcf', 's3_vcf', 'gs_csi', "VCF", "vcf_index", [ snp_type, cnv_type ]))
 
     logging.info("found " + str(n_samples_found) + " / " + str(n_samples) + " sample(s) in TOPMed file manifest")
     return file_datasets_l
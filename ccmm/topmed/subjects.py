@@ -3,6 +3,7 @@
 from ccmm.dats.datsobj import DatsObj
 import ccmm.dats.util as util
 import ccmm.topmed.dna_extracts as dna_extracts
+import ccmm.topmed.harmonized
 from collections import OrderedDict
 import csv
 import json
@@ -19,95 +20,14 @@ import sys
 #    def get_var_id(name):
 #        return var_lookup[name]['dim'].get("identifier").getIdRef()
 
-def get_subject_dats_material(cache, study, study_md, subj_var_values):
-
-    # extract subject attributes
-    gender = None
-    age = None
-    visit_year = None
-    sys_bp = None
-    dias_bp = None
-    disease = {}
-    disease['hypertension'] = "unknown"
-    
-    for name in subj_var_values:
-        name_upper = name.upper()
-        if name_upper == "GENDER" or name_upper == "SEX":
-            gender = subj_var_values[name]['value'].lower()
-        elif name_upper == "VISIT_AGE" or name_upper == "AGE" or name_upper == "AGE_ENROLL": #need to confirm that these  allmean the same thing
-            age = subj_var_values[name]['value']
-        elif name_upper == "VISIT_YEAR":
-            visit_year =  subj_var_values[name]['value']
-        elif name_upper == "SYSBP":
-            sys_bp = subj_var_values[name]['value']
-        elif name_upper == "DIASBP":
-            dias_bp = subj_var_values[name]['value']
-        elif name_upper == "HYPERTENSION" or name_upper == "HIGHBLOODPRES":
-            if subj_var_values[name]['value'].lower() == "yes" or subj_var_values[name]['value'] == '1':
-                disease['hypertension'] = "yes"
-            elif re.match(r'\S', subj_var_values[name]['value']):
-                disease['hypertension'] = "no"
-
-    subject_characteristics = []
-    subject_bearerOfDisease = []
+# harmonized - harmonized variable values for the subject (see ccmm.topmed.harmonized.) These are
+# computed from subj_var_values if not given.
+def get_subject_dats_material(cache, study, study_md, subj_var_values, harmonized=None):
 
     # harmonized/standardized characteristics
-    if gender is not None:
-        subject_sex = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Gender")])),
-                ("description", "Gender of the subject"),
-                ("values", [ gender ])
-                ])
-        subject_characteristics.append(subject_sex)
-
-    if age is not None:
-        subject_age = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Age")])),
-                ("description", "Age of the subject"),
-                ("values", [ age ])
-                ])
-        subject_characteristics.append(subject_age)
-    
-    if visit_year is not None:
-        subject_visitYear = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Visit year")])),
-                ("description", "Year of visit, to use for longitudinal analysis"),
-                ("values", [ visit_year ])
-                ])
-        subject_characteristics.append(subject_visitYear)
-    
-    if sys_bp is not None:
-        subject_sysBP = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Systolic blood pressure")])),
-                ("description", "Systolic blood pressure of subject, measured in mmHg"),
-                ("values", [ sys_bp ])
-                ])
-        subject_characteristics.append(subject_sysBP)
-        
-    if dias_bp is not None:
-        subject_diasBP = DatsObj("Dimension", [
-                ("name", DatsObj("Annotation", [("value", "Diastolic blood pressure")])),
-                ("description", "Diastolic blood pressure of subject, measured in mmHg"),
-                ("values", [ dias_bp ])
-                ])
-        subject_characteristics.append(subject_diasBP)                                      
-    
-    if disease['hypertension'] != "unknown":
-        disease_name = "hypertension"
-        disease_id = "10763"
-        disease_identifier = OrderedDict([
-            ("identifier",  "DOID:" + str(disease_id)),
-            ("identifierSource", "Disease Ontology")])
-        disease_alt_ids = [OrderedDict([
-            ("identifier", "http://purl.obolibrary.org/obo/DOID_" + str(disease_id)),
-            ("identifierSource", "Disease Ontology")])]
-        subject_hypertension = DatsObj("Disease", [
-            ("name", "Hypertension"),
-            ("identifier", disease_identifier),
-            ("alternateIdentifiers", disease_alt_ids),
-            ("diseaseStatus", DatsObj("Annotation", [("value", disease['hypertension'] ), ("valueIRI", "")])), 
-            ])
-        subject_bearerOfDisease.append(subject_hypertension)
+    if harmonized is None:
+        harmonized = ccmm.topmed.harmonized.get_var_values(subj_var_values)
+    (subject_characteristics, subject_bearerOfDisease) = ccmm.topmed.harmonized.get_harmonized_characteristics(harmonized)
 
     # create a DATS Dimension from a dbGaP variable value
     def make_var_dimension(name, var_value):
@@ -163,8 +83,8 @@ def get_synthetic_subject_dats_material_from_public_metadata(cache, study, study
     for var_type in ('Subject', 'Subject_Phenotypes'):
         if var_type not in study_md:
             continue
-        subj_data = study_md[var_type]['var_report']['data']
-        subj_vars = subj_data['vars']
+        subj_report = study_md[var_type]['var_report']
+        subj_vars = subj_report['data']['vars']
         for sv in subj_vars:
             id = sv['id']
             m = re.match(r'^(phv\d+\.v\d+).*$', id)
@@ -174,7 +94,7 @@ def get_synthetic_subject_dats_material_from_public_metadata(cache, study, study
                 logging.warn("failed to parse variable prefix from " + id)
 
         # pick representative and/or legal value for each variable
-        dna_extracts.pick_var_values(subj_vars, subj_var_values)
+        dna_extracts.pick_var_values(subj_vars, subj_var_values, subj_report.get('stats'))
 
     # assign dummy ids: subject ids are protected data
     subj_var_values['dbGaP_Subject_ID'] = { "value" : dbgap_subj_id }
@@ -228,6 +148,9 @@ def get_subjects_dats_materials_from_restricted_metadata(cache, study, pub_md, r
         subject_phens = dna_extracts.index_dicts(subject_phen_md['data']['rows'], 'dbGaP_Subject_ID')
         subject_phens_vars = lookup_var_ids(subject_phen_md['data']['rows'][0], 'Subject_Phenotypes', '')
 
+    # harmonized variables, resolved once per table
+    harmonized = ccmm.topmed.harmonized.get_subject_values(subject_md, restricted_md.get('Subject_Phenotypes'))
+
     n_found = 0
     for dbgap_subj_id in subjects:
         subject = subjects[dbgap_subj_id]
@@ -247,7 +170,7 @@ def get_subjects_dats_materials_from_restricted_metadata(cache, study, pub_md, r
             if sa in combined_vars:
                 subject_atts[sa]["var"] = combined_vars[sa]
 
-        dats_subject = get_subject_dats_material(cache, study, pub_md, subject_atts)
+        dats_subject = get_subject_dats_material(cache, study, pub_md, subject_atts, harmonized[dbgap_subj_id])
         if dbgap_subj_id in dats_subjects:
             logging.fatal("duplicate dbGaP_subject_ID=" + dbgap_subj_id)
             sys.exit(1)
@@ -18,16 +18,37 @@ def make_multilevel_dict(items, keys):
 
     return md
 
-# check whether a given key exists within a multilevel dict. Returns True or False.
-def multilevel_dict_key_exists(d, key):
-    for k in d:
-        if k == key:
-            return True
-        v = d[k]
-        if v is None:
-            pass
-        elif isinstance(v, str):
-            pass
-        elif multilevel_dict_key_exists(v, key):
-            return True
-    return False
+# ------------------------------------------------------
+# Histograms
+# ------------------------------------------------------
+
+# count the number of times each value appears in values
+def count_values(values):
+    counts = {}
+    for v in values:
+        if v in counts:
+            counts[v] += 1
+        else:
+            counts[v] = 1
+    return counts
+
+# convert dict of key -> count to a list of (count, number of keys with that count), ordered by count
+def get_count_histogram(counts):
+    hist = count_values(counts.values())
+    return [(ct, hist[ct]) for ct in sorted(hist)]
+
+# Histogram of the number of subjects that have a given number of samples, given the subject id of each sample.
+def get_subject_sample_count_histogram(sample_subject_ids):
+    return get_count_histogram(count_values(sample_subject_ids))
+
+def print_subject_sample_count_histogram(sample_subject_ids):
+    print("Histogram of number of subjects that have a given number of samples")
+    n_total_samples = 0
+    n_total_subjects = 0
+    print("n_samples\tn_subjects")
+    for (n_samples, n_subjects) in get_subject_sample_count_histogram(sample_subject_ids):
+        print(str(n_samples) + "\t" + str(n_subjects))
+        n_total_subjects += n_subjects
+        n_total_samples += (n_subjects * n_samples)
+    print("n_total_samples=" + str(n_total_samples))
+    print("n_total_subjects=" + str(n_total_subjects))
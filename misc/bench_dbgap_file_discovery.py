@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Benchmark dbGaP metadata file discovery on a synthetic accession tree.
+#
+# Creates a temporary directory tree with one subdirectory per study accession, each containing
+# empty data_dict/var_report XML files, then times the original os.listdir/re.match approach
+# against ccmm.dbgap.study_files.find_study_metadata_files. Run from the top level of the repo:
+#
+#  setenv PYTHONPATH ./
+#  ./misc/bench_dbgap_file_discovery.py --n_files=50000
+
+import argparse
+import ccmm.dbgap.study_files as study_files
+import ccmm.util as util
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+# ------------------------------------------------------
+# Synthetic data
+# ------------------------------------------------------
+
+def make_synthetic_tree(root, n_files):
+    file_types = ['Subject', 'Sample', 'Sample_Attributes', 'Subject_Phenotypes']
+    metadata_types = ['data_dict', 'var_report']
+    files_per_study = len(file_types) * len(metadata_types)
+    n_studies = (n_files + files_per_study - 1) // files_per_study
+    n_created = 0
+
+    for s in range(n_studies):
+        study_id = "phs{:06d}.v1".format(s + 1)
+        study_dir = os.path.join(root, study_id + ".p1")
+        os.mkdir(study_dir)
+        for (i, ft) in enumerate(file_types):
+            for mt in metadata_types:
+                if n_created == n_files:
+                    break
+                pht = "pht{:06d}.v1".format(s * len(file_types) + i + 1)
+                name = ".".join([study_id, pht, "p1", "STUDY" + str(s + 1) + "_" + ft, mt, "xml"])
+                open(os.path.join(study_dir, name), "w").close()
+                n_created += 1
+
+    return n_studies
+
+# ------------------------------------------------------
+# Original implementation, for comparison
+# ------------------------------------------------------
+
+def listdir_study_metadata_files(dir, suffix):
+    filenames = os.listdir(dir)
+    files = []
+
+    for f in filenames:
+        if re.match(r'^phs\d+\..*\.' + suffix + '$', f):
+            m = re.match(r'^(phs\d+\.v\d+)\.(pht\d+\.v\d+)(\.p\d+)?\.(\S+)_(' + study_files.FILE_TYPES_RE + ').(' + study_files.METADATA_TYPES_RE + ')\.' + suffix + '$', f)
+            if m is None:
+                logging.fatal("unable to parse file type and study name from dbGaP file " + f)
+                sys.exit(1)
+            files.append({
+                "name": f,
+                "path": os.path.join(dir, f),
+                "study_id": m.group(1),
+                "phenotype_id": m.group(2),
+                "participant_set_version": m.group(3),
+                "study_name": m.group(4),
+                "metadata_type": m.group(5),
+                "file_type": m.group(6)
+                })
+
+    return util.make_multilevel_dict(files, study_files.LEVEL_KEYS)
+
+# ------------------------------------------------------
+# main()
+# ------------------------------------------------------
+
+def main():
+
+    # input
+    parser = argparse.ArgumentParser(description='Benchmark dbGaP metadata file discovery on a synthetic accession tree.')
+    parser.add_argument('--n_files', required=False, type=int, default=50000, help ='Number of synthetic dbGaP XML files to create.')
+    parser.add_argument('--n_iterations', required=False, type=int, default=3, help ='Number of times to run each implementation.')
+    args = parser.parse_args()
+
+    # logging
+    logging.basicConfig(level=logging.INFO)
+
+    root = tempfile.mkdtemp(prefix="dbgap-bench-")
+    try:
+        n_studies = make_synthetic_tree(root, args.n_files)
+        logging.info("created " + str(args.n_files) + " file(s) for " + str(n_studies) + " studies in " + root)
+        study_dirs = [os.path.join(root, d) for d in sorted(os.listdir(root))]
+
+        # original: one os.listdir and one multilevel dict per accession directory
+        best_listdir = None
+        for i in range(args.n_iterations):
+            t0 = time.perf_counter()
+            n_found = 0
+            for d in study_dirs:
+                n_found += len(listdir_study_metadata_files(d, "xml"))
+            elapsed = time.perf_counter() - t0
+            if best_listdir is None or elapsed < best_listdir:
+                best_listdir = elapsed
+
+        # catalog: single recursive walk of the whole tree
+        best_scandir = None
+        for i in range(args.n_iterations):
+            t0 = time.perf_counter()
+            catalog = study_files.find_study_metadata_files(root, "xml", recursive=True)
+            elapsed = time.perf_counter() - t0
+            if best_scandir is None or elapsed < best_scandir:
+                best_scandir = elapsed
+
+        if len(catalog.get_study_ids()) != n_found:
+            logging.fatal("study count mismatch: " + str(len(catalog.get_study_ids())) + " != " + str(n_found))
+            sys.exit(1)
+
+        print("n_files\tn_studies\tlistdir_secs\tcatalog_secs")
+        print("\t".join([str(len(catalog)), str(n_studies), "{:.3f}".format(best_listdir), "{:.3f}".format(best_scandir)]))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
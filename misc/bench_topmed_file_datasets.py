@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Benchmark TOPMed file Dataset construction on a synthetic manifest.
+#
+# Creates a synthetic TOPMed manifest, GUID lookup, and set of sample Materials, then times
+# file Dataset construction using DatsObj constructor calls (as in the original implementation)
+# against ccmm.topmed.samples.get_files_dats_datasets, which fills compiled templates (see
+# ccmm.dats.template), and checks that both produce the same JSON. Run from the top level of
+# the repo:
+#
+#  setenv PYTHONPATH ./
+#  ./misc/bench_topmed_file_datasets.py --n_samples=150000
+
+import argparse
+from ccmm.dats.datsobj import DatsObj, DatsObjCache, DATSEncoder
+import ccmm.dats.util as util
+import ccmm.topmed.samples as samples
+import hashlib
+import json
+import logging
+import re
+import sys
+import time
+
+# ------------------------------------------------------
+# Synthetic data
+# ------------------------------------------------------
+
+def mv(value):
+    return { "raw_value": value, "mapped_value": value }
+
+def make_synthetic_data(n_samples):
+    sample_manifest = {}
+    file_guids = {}
+    dats_samples_d = {}
+
+    for i in range(n_samples):
+        sample_id = "NWD{:06d}".format(i + 1)
+        ms = {}
+        for (suffix, col) in (("cram", "cram"), ("cram.crai", "crai"), ("vcf.gz", "vcf"), ("vcf.gz.csi", "csi")):
+            filename = sample_id + ".b38.irc.v1." + suffix
+            ms["gs_" + col] = mv("gs://topmed-irc-share/genomes/" + filename)
+            ms["s3_" + col] = mv("s3://nih-nhlbi-datacommons/" + filename)
+            file_guids[filename] = {
+                "Sodium_GUID": mv("https://doi.org/10.99999/" + sample_id + "." + col),
+                "File size": mv(str(1000000 + i) if i % 100 != 0 else "1.5e+10"),
+                "md5sum": mv("{:032x}".format(i))
+                }
+        sample_manifest[sample_id] = ms
+        dats_samples_d[sample_id] = DatsObj("Material", [("name", sample_id)])
+
+    return (sample_manifest, file_guids, dats_samples_d)
+
+# ------------------------------------------------------
+# Original implementation, for comparison
+# ------------------------------------------------------
+
+def constructor_files_dats_datasets(cache, dats_samples_d, sample_manifest, file_guids, no_circular_links):
+    file_datasets_l = []
+    creators = None
+    dstans = {}
+
+    def get_datatype(name, atts):
+        return cache.get_obj_or_ref("DataType." + name, lambda: DatsObj("DataType", [(k, util.get_annotation(v, cache)) for (k, v) in atts]))
+
+    def get_data_standard(format):
+        if format not in dstans:
+            dstans[format] = cache.get_obj_or_ref("DataStandard:" + format, lambda: DatsObj("DataStandard", [
+                ("name", format),
+                ("type", util.get_value_annotation("format", cache)),
+                ("description", format + " file format")
+                ]))
+        return dstans[format]
+
+    def make_distro(url, doi, index_doi, relation_type, size, dstan):
+        return DatsObj("DatasetDistribution", [
+            ("access", DatsObj("Access", [ ("accessURL", url) ])),
+            ("identifier", DatsObj("Identifier", [("identifier", doi)])),
+            ("relatedIdentifiers", [ DatsObj("RelatedIdentifier", [("identifier", index_doi), ("relationType", relation_type) ])]),
+            ("size", size),
+            ("conformsTo", [ dstan ])
+        ])
+
+    def make_dataset(dats_sample, ms, col, index_col, format, relation_type, types):
+        gs_uri = ms['gs_' + col]['mapped_value']
+        filename = re.match(r'^.*\/([^\/]+)$', gs_uri).group(1)
+        index_filename = re.match(r'^.*\/([^\/]+)$', ms['gs_' + index_col]['mapped_value']).group(1)
+        doi = file_guids[filename]['Sodium_GUID']['raw_value']
+        index_doi = file_guids[index_filename]['Sodium_GUID']['raw_value']
+        size = samples.filesize_to_int(file_guids[filename]['File size']['raw_value'])
+        dstan = get_data_standard(format)
+        gs_distro = make_distro(gs_uri, doi, index_doi, relation_type, size, dstan)
+        s3_distro = make_distro(ms['s3_' + col]['mapped_value'], doi, index_doi, relation_type, size, dstan)
+        md5_dimension = DatsObj("Dimension", [
+            ("name", util.get_value_annotation("MD5", cache)),
+            ("values", [ file_guids[filename]['md5sum']['raw_value'] ])
+        ])
+        dataset = DatsObj("Dataset", [
+            ("distributions", [gs_distro, s3_distro]),
+            ("dimensions", [ md5_dimension ]),
+            ("title", filename),
+            ("types", types),
+            ("creators", creators),
+        ])
+        da = DatsObj("DataAcquisition", [
+            ("name", filename),
+            ("input", [dats_sample.getIdRef()])
+        ])
+        dataset.set("producedBy", da)
+        if not no_circular_links:
+            da.set("output", [dataset.getIdRef()])
+        file_datasets_l.append(dataset)
+
+    for sample_id in dats_samples_d:
+        if sample_id not in sample_manifest:
+            continue
+        ms = sample_manifest[sample_id]
+        if creators is None:
+            creators = [cache.get_obj_or_ref("Organization:NHLBI", lambda: samples.NIH_NHLBI)]
+        wgs_type = get_datatype("WGS", [("information", "DNA sequencing"), ("method", "whole genome sequencing assay"), ("platform", "Illumina")])
+        make_dataset(dats_samples_d[sample_id], ms, 'cram', 'crai', "CRAM", "cram_index", [ wgs_type ])
+        if ms['gs_vcf']['mapped_value'] is None:
+            continue
+        snp_type = get_datatype("SNP", [("information", "SNP"), ("method", "SNP analysis")])
+        cnv_type = get_datatype("CNV", [("information", "CNV"), ("method", "CNV analysis")])
+        make_dataset(dats_samples_d[sample_id], ms, 'vcf', 'csi', "VCF", "vcf_index", [ snp_type, cnv_type ])
+
+    return file_datasets_l
+
+# ------------------------------------------------------
+# Output comparison
+# ------------------------------------------------------
+
+# MD5 digest of the serialized datasets, with the temporary @ids in each one renumbered in order of appearance
+def get_normalized_digest(datasets):
+    md5 = hashlib.md5()
+    for ds in datasets:
+        tmp_ids = {}
+        def renumber(m):
+            if m.group(0) not in tmp_ids:
+                tmp_ids[m.group(0)] = "TMPID/" + str(len(tmp_ids))
+            return tmp_ids[m.group(0)]
+        md5.update(re.sub(r'TMPID/[0-9a-f\-]+', renumber, json.dumps(ds, cls=DATSEncoder)).encode('utf-8'))
+    return md5.hexdigest()
+
+# Returns (best time in seconds, number of datasets, output digest) for n_iterations runs of files_fn.
+# Only one set of datasets is kept in memory at a time.
+def time_files_fn(files_fn, n_iterations, dats_samples_d, sample_manifest, file_guids):
+    best = None
+    for i in range(n_iterations):
+        t0 = time.perf_counter()
+        datasets = files_fn(DatsObjCache(), dats_samples_d, sample_manifest, file_guids, False)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+        if i < n_iterations - 1:
+            del datasets
+    return (best, len(datasets), get_normalized_digest(datasets))
+
+# ------------------------------------------------------
+# main()
+# ------------------------------------------------------
+
+def main():
+
+    # input
+    parser = argparse.ArgumentParser(description='Benchmark TOPMed file Dataset construction on a synthetic manifest.')
+    parser.add_argument('--n_samples', required=False, type=int, default=150000, help ='Number of synthetic samples in the manifest.')
+    parser.add_argument('--n_iterations', required=False, type=int, default=3, help ='Number of times to run each implementation.')
+    args = parser.parse_args()
+
+    # logging
+    logging.basicConfig(level=logging.WARN)
+
+    (sample_manifest, file_guids, dats_samples_d) = make_synthetic_data(args.n_samples)
+
+    (constructor_secs, n_datasets, constructor_digest) = time_files_fn(constructor_files_dats_datasets, args.n_iterations, dats_samples_d, sample_manifest, file_guids)
+    (template_secs, n_datasets, template_digest) = time_files_fn(samples.get_files_dats_datasets, args.n_iterations, dats_samples_d, sample_manifest, file_guids)
+
+    if constructor_digest != template_digest:
+        logging.fatal("DatsObj constructor and template output differ")
+        sys.exit(1)
+
+    print("n_samples\tn_datasets\tconstructor_secs\ttemplate_secs")
+    print("\t".join([str(args.n_samples), str(n_datasets), "{:.3f}".format(constructor_secs), "{:.3f}".format(template_secs)]))
+
+if __name__ == '__main__':
+    main()
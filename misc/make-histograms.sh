@@ -2,7 +2,7 @@
 
 setenv PYTHONPATH ./
 
-# Generate sample/subject histogram for _all_ samples
-./bin/gtex_v7_to_dats.py --print_sample_histogram > all-histogram.txt
+# Generate sample/subject histogram, tissue counts and variable distributions for _all_ samples
+./bin/gtex_v7_stats.py > all-histogram.txt
 # And RNA-Seq only
-./bin/gtex_v7_to_dats.py --print_sample_histogram --smafrze=RNASEQ > rnaseq-histogram.txt
+./bin/gtex_v7_stats.py --smafrze=RNASEQ > rnaseq-histogram.txt